@@ -0,0 +1,21 @@
+# Gunicorn configuration, picked up automatically from the working directory
+
+
+def post_worker_init(worker):
+    """Load the FAISS index, and a local embedding model, once per worker
+    before it accepts requests
+    """
+    from myapp.services.index_store import get_index_store
+    from myapp.services.query_embedding import get_query_embedder
+    from myapp.services.embeddings import warm_embedding_model
+
+    store = get_index_store()
+    store.warm()
+    stats = store.stats()
+    worker.log.info(
+        "Index loaded: %d vectors in %.3fs, worker RSS %.1f MB",
+        stats['vectors'], stats['load_seconds'], stats['process_rss_bytes'] / 2**20,
+    )
+    seconds = warm_embedding_model(get_query_embedder().embedding_model)
+    if seconds:
+        worker.log.info("Embedding model loaded in %.2fs", seconds)
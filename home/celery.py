@@ -1,8 +1,27 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'home.settings')
 
 app = Celery('home')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def warm_embedding_model(**kwargs):
+    """Load a local embedding model in each worker process before its first task"""
+    from myapp.services.embeddings import get_embedding_model, warm_embedding_model
+
+    warm_embedding_model(get_embedding_model())
+
+
+@worker_process_init.connect
+def fold_exited_metrics(**kwargs):
+    """Archive the metrics files of this container's exited workers, which
+    only its own processes can tell apart from running ones
+    """
+    from myapp.services.metrics import get_metrics
+
+    get_metrics().fold_exited()
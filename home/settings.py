@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
 from pathlib import Path
+from urllib.parse import urlsplit
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -147,19 +149,159 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Vector DB Configuration
 VECTOR_DB_PATH = BASE_DIR / 'vector_db'
 VECTOR_DB_PATH.mkdir(exist_ok=True)
+# Seconds between checks for a newer index on disk in serving workers
+VECTOR_INDEX_RELOAD_INTERVAL = float(os.environ.get("VECTOR_INDEX_RELOAD_INTERVAL", 2.0))
+# Memory-map the serving index read-only, so worker processes on a host share
+# one copy through the page cache instead of each reading its own
+VECTOR_INDEX_MMAP = os.environ.get("VECTOR_INDEX_MMAP", "true").lower() == "true"
+# FAISS index type: 'flat', 'hnsw', 'ivf_flat', 'ivf_pq', or 'auto' to pick by corpus size
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "auto")
+VECTOR_INDEX_AUTO_THRESHOLDS = {'hnsw': 50_000, 'ivf_flat': 500_000, 'ivf_pq': 5_000_000}
+# How the index holds each vector in worker memory: 'float32' (exact), 'fp16',
+# 'sq8' (8-bit scalar quantization) or 'pq' (product quantization, ~16 dims per
+# byte). Compressed indexes fetch VECTOR_RERANK_FACTOR * top_k candidates and
+# re-score them against the exact vectors in the on-disk vector log.
+VECTOR_INDEX_STORAGE = os.environ.get("VECTOR_INDEX_STORAGE", "float32")
+VECTOR_RERANK_FACTOR = int(os.environ.get("VECTOR_RERANK_FACTOR", 4))
+# Unmerged vectors (scanned exactly at query time) before ingest schedules a
+# background merge into the base index
+VECTOR_INDEX_MERGE_ROWS = int(os.environ.get("VECTOR_INDEX_MERGE_ROWS", 5000))
+# Share of deleted (tombstoned) vectors at which the store is compacted
+VECTOR_INDEX_COMPACT_DEAD_FRACTION = float(os.environ.get("VECTOR_INDEX_COMPACT_DEAD_FRACTION", 0.2))
+# Default search depth for IVF (lists probed) and HNSW (candidate queue size)
+VECTOR_SEARCH_NPROBE = 16
+VECTOR_SEARCH_EF = 64
+
+# Hybrid retrieval: BM25 over chunk text fused with the vector search by
+# reciprocal rank fusion; candidates taken from each side, and the RRF constant
+HYBRID_SEARCH_ENABLED = os.environ.get("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+HYBRID_CANDIDATES = 20
+HYBRID_RRF_K = 60
+# Lexical index segments before ingest schedules a background merge
+LEXICAL_MAX_SEGMENTS = 8
+# Query terms found in more than this share of a user's chunks are skipped
+LEXICAL_MAX_DF_FRACTION = 0.5
+
+# Re-ranking before the LLM: RETRIEVAL_CANDIDATES hits are fetched, then MMR
+# picks top_k of them, trading relevance for diversity (MMR_DIVERSITY, 0 ranks
+# by relevance alone) and skipping chunks at least MMR_DUPLICATE_THRESHOLD
+# cosine-similar to one already picked, e.g. overlapping chunks of one page
+MMR_ENABLED = os.environ.get("MMR_ENABLED", "true").lower() == "true"
+RETRIEVAL_CANDIDATES = 20
+MMR_DIVERSITY = 0.3
+MMR_DUPLICATE_THRESHOLD = 0.95
+# Optional reranker model scoring (question, chunk) pairs: dotted path to a class
+# with score(question, texts), e.g. myapp.services.reranking.CrossEncoderReranker.
+# Its scores replace retrieval scores as MMR relevance when they arrive within
+# RERANKER_BUDGET_MS; at most RERANKER_MAX_IN_FLIGHT calls run per process
+RERANKER = os.environ.get("RERANKER", "")
+RERANKER_OPTIONS = {}
+RERANKER_BUDGET_MS = float(os.environ.get("RERANKER_BUDGET_MS", 150))
+RERANKER_MAX_IN_FLIGHT = 2
+
+# Retrieved chunks kept in each worker's in-process LRU, keyed by chunk ID
+CHUNK_CACHE_SIZE = 2048
+
+# Stage latency histograms and counters, written by each gunicorn and Celery
+# process to METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds and
+# served, summed, at /metrics; requests need `Authorization: Bearer
+# <METRICS_TOKEN>` when it is set
+METRICS_DIR = os.environ.get("METRICS_DIR", str(BASE_DIR / 'metrics'))
+METRICS_FLUSH_INTERVAL = 5.0
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Embedding provider: dotted path to a class with embed_documents / embed_query
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "langchain_google_genai.GoogleGenerativeAIEmbeddings")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "models/embedding-001")
+# Ingest batching: texts per provider call, concurrent calls, and 429 retry policy
+EMBEDDING_BATCH_SIZE = 100
+EMBEDDING_MAX_IN_FLIGHT = 4
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_BACKOFF_SECONDS = 1.0
+# Local CPU provider (EMBEDDING_PROVIDER = "myapp.services.local_embeddings.LocalEmbeddings",
+# EMBEDDING_MODEL a sentence-transformers model): texts per inference batch,
+# estimated tokens per batch including padding, and inference threads.
+# Web and Celery workers load the model at start unless EMBEDDING_WARMUP is off
+LOCAL_EMBEDDING_BATCH_SIZE = 32
+LOCAL_EMBEDDING_MAX_BATCH_TOKENS = 8192
+LOCAL_EMBEDDING_THREADS = int(os.environ.get("LOCAL_EMBEDDING_THREADS", 1))
+EMBEDDING_WARMUP = os.environ.get("EMBEDDING_WARMUP", "true").lower() == "true"
+
+# Question embeddings: in-process LRU (entries, seconds) in front of the
+# embedding cache, and a micro-batcher that sends questions arriving within
+# QUERY_BATCH_WINDOW_MS of each other (0 disables it) as one provider call
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+QUERY_EMBEDDING_CACHE_TTL = 3600
+QUERY_BATCH_WINDOW_MS = float(os.environ.get("QUERY_BATCH_WINDOW_MS", 5))
+QUERY_BATCH_MAX_SIZE = 64
+QUERY_BATCH_MAX_IN_FLIGHT = 4
+# Seconds a question waits for its batch before the request fails
+QUERY_BATCH_TIMEOUT = float(os.environ.get("QUERY_BATCH_TIMEOUT", 30))
+
+# Chunking: 'fixed', 'sentence', 'recursive' or a dotted path to a chunker class.
+# Sizes are in estimated tokens (see myapp/services/tokens.py)
+CHUNKING_STRATEGY = os.environ.get("CHUNKING_STRATEGY", "recursive")
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 48
+# Estimated tokens of chunk text packed into each LLM prompt, best chunks
+# first, with neighbouring chunks merged and their overlap removed
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+
+# Documents stream through chunking, storage and embedding this many chunks at a time
+INGEST_BATCH_SIZE = 1000
+# Bulk ingest (POST api/doc/bulk): files per upload, and chunks embedded per task,
+# grouped across files
+BULK_INGEST_MAX_FILES = 1000
+BULK_EMBED_CHUNKS = 1000
+# PDF pages are read in ranges of PDF_PAGES_PER_TASK; with PDF_EXTRACTION_WORKERS > 0
+# the ranges are extracted in a process pool of that size, except in daemonic
+# processes such as Celery's prefork workers, which extract in-process
+PDF_EXTRACTION_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", 0))
+PDF_PAGES_PER_TASK = 16
 
 # Cache Configuration
+# Embeddings live in their own Redis: its allkeys-lru eviction must never reach
+# the Celery broker's queues and results, so there is no fallback to REDIS_URL
+EMBEDDING_CACHE_URL = os.environ.get("EMBEDDING_CACHE_URL") or 'redis://127.0.0.1:6380/0'
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': os.environ.get("REDIS_URL",'redis://127.0.0.1:6379/'),
-    }
+    },
+    # Content-addressed embeddings; run this Redis with maxmemory-policy allkeys-lru
+    # so the least recently used vectors are evicted when memory fills up
+    'embeddings': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': EMBEDDING_CACHE_URL,
+        'KEY_PREFIX': 'vectormind',
+    },
 }
 
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_ALIAS = 'embeddings'
+EMBEDDING_CACHE_TIMEOUT = 30 * 24 * 3600
+# REDIS_URL is the default cache and the Celery broker
+if EMBEDDING_CACHE_ENABLED and urlsplit(EMBEDDING_CACHE_URL).netloc == urlsplit(CACHES['default']['LOCATION']).netloc:
+    raise ImproperlyConfigured(
+        "EMBEDDING_CACHE_URL must point at a different Redis instance than the Celery broker (REDIS_URL)"
+    )
+# Provider price used to report the spend avoided by cache hits
+EMBEDDING_COST_PER_1K_TOKENS = float(os.environ.get("EMBEDDING_COST_PER_1K_TOKENS", 0.0001))
+
+# Semantic answer cache: reuse a user's recent answer when a new question's
+# embedding has at least this cosine similarity to one they already asked
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_ALIAS = 'default'
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_TTL = 3600
+SEMANTIC_CACHE_MAX_ENTRIES = 200  # per user, least recently used evicted first
+
 # Celery Configuration Options
 CELERY_BROKER_URL = os.environ.get("REDIS_URL", 'redis://127.0.0.1:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get("REDIS_URL", 'redis://127.0.0.1:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
+
 CELERY_TASK_SERIALIZER = 'json'
 
 from datetime import timedelta
@@ -19,12 +19,14 @@ from django.urls import path,include
 
 from django.conf import settings
 from django.conf.urls.static import static
+from myapp.views import metrics
 #from rest_framework.authtoken.views import obtain_auth_token
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('myapp.urls')),
+    path('metrics', metrics, name='metrics'),
     #path('auth/token/', obtain_auth_token, name='api_token_auth'),
     ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -2,7 +2,7 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import Document, DocumentChunk, QueryLog
+from .models import Document, DocumentChunk, IngestBatch, QueryLog
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
@@ -11,6 +11,12 @@ class DocumentAdmin(admin.ModelAdmin):
     search_fields = ['title', 'uploaded_by__username']
     readonly_fields = ['id', 'uploaded_at', 'processed', 'total_chunks']
 
+@admin.register(IngestBatch)
+class IngestBatchAdmin(admin.ModelAdmin):
+    list_display = ['id', 'uploaded_by', 'status', 'total_documents', 'failed_documents', 'embedded_chunks', 'created_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['id', 'created_at', 'completed_at']
+
 @admin.register(DocumentChunk)
 class DocumentChunkAdmin(admin.ModelAdmin):
     list_display = ['document', 'chunk_index', 'page_number', 'embedding_stored']
@@ -0,0 +1 @@
+"""Synthetic workloads and stub providers for the bench_* management commands"""
@@ -0,0 +1,53 @@
+import zlib
+import numpy as np
+
+WORDS = (
+    "policy refund invoice customer account payment shipping order return warranty service contract "
+    "agreement period notice terms delivery product support request claim balance statement report"
+).split()
+
+
+def write_text_pdf(path: str, pages: int, lines_per_page: int = 50, words_per_line: int = 12, seed: int = 0):
+    """Write a text-only PDF of `pages` pages with Flate-compressed content
+    streams, page by page, so arbitrarily large files can be generated
+    without holding them in memory
+    """
+    rng = np.random.default_rng(seed)
+    offsets = {}
+
+    with open(path, 'wb') as f:
+        def write_object(number: int, body: bytes):
+            offsets[number] = f.tell()
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+        kids = []
+        for page in range(pages):
+            page_number, content_number = 4 + 2 * page, 5 + 2 * page
+            lines = [f"Page {page + 1}."] + [
+                ' '.join(rng.choice(WORDS, words_per_line)).capitalize() + '.' for _ in range(lines_per_page)
+            ]
+            text = b" T* ".join(b"(" + _escape(line) + b") Tj" for line in lines)
+            stream = zlib.compress(b"BT /F1 10 Tf 50 760 Td 14 TL " + text + b" ET")
+            write_object(content_number, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            write_object(page_number, (
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_number
+            ))
+            kids.append(b"%d 0 R" % page_number)
+
+        write_object(2, b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % pages)
+
+        xref_offset = f.tell()
+        size = max(offsets) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for number in range(1, size):
+            f.write(b"%010d 00000 n \n" % offsets[number])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset))
+
+
+def _escape(text: str) -> bytes:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1')
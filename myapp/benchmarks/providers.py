@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import threading
+import time
+import numpy as np
+from typing import Any, AsyncIterator, Iterator, List
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class RateLimitError(Exception):
+    """Raised by the fake server the way an HTTP client surfaces a 429"""
+    status_code = 429
+
+
+class FakeEmbeddings:
+    """Deterministic embedding provider: each text maps to a fixed vector
+    seeded from its hash, so identical texts always embed identically.
+
+    Optionally emulates a remote server: each call costs `latency` seconds
+    plus `per_text_latency` per text, and calls beyond `capacity` concurrent
+    requests are rejected with a 429.
+    """
+
+    def __init__(self, dimension: int = 768, latency: float = 0.0, per_text_latency: float = 0.0,
+                 capacity: int = 0, model: str = 'fake-embedding'):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.capacity = capacity
+        self.model = model
+        self.calls = 0
+        self.rejected_calls = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            if self.capacity and self._active >= self.capacity:
+                self.rejected_calls += 1
+                raise RateLimitError("429 Too Many Requests")
+            self._active += 1
+        try:
+            if self.latency or self.per_text_latency:
+                time.sleep(self.latency + self.per_text_latency * len(texts))
+            return [self._vector(text).tolist() for text in texts]
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency or self.per_text_latency:
+            await asyncio.sleep(self.latency + self.per_text_latency * len(texts))
+        with self._lock:
+            self.calls += 1
+        return [self._vector(text).tolist() for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+class HashedWordEmbeddings:
+    """Deterministic embedding provider where texts sharing words have
+    similar vectors: each word hashes to a fixed random vector and a text
+    embeds as the normalized sum of its words', so a question made of a
+    chunk's words lands near that chunk and retrieval recall means something
+    """
+
+    def __init__(self, dimension: int = 384, table_size: int = 1 << 15, model: str = 'hashed-words'):
+        self.dimension = dimension
+        self.model = model
+        self.table = np.random.default_rng(0).standard_normal((table_size, dimension)).astype(np.float32)
+        self.calls = 0
+        self._word_ids = {}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return self._vectors(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+    def _vectors(self, texts: List[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            ids = []
+            for word in text.lower().split() or ['']:
+                word_id = self._word_ids.get(word)
+                if word_id is None:
+                    digest = hashlib.blake2b(word.encode(), digest_size=4).digest()
+                    word_id = self._word_ids[word] = int.from_bytes(digest, 'little') % len(self.table)
+                ids.append(word_id)
+            vectors[row] = self.table[ids].sum(axis=0)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model stub that answers after a fixed delay, without a network.
+
+    The answer repeats the first words of the prompt, so it is deterministic;
+    streaming emits it word by word spread over the same total latency.
+    """
+
+    latency: float = 0.0
+    answer_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    def _answer(self, messages: List[BaseMessage]) -> List[str]:
+        words = str(messages[-1].content).split()
+        return (words * (self.answer_words // max(len(words), 1) + 1))[:self.answer_words]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=' '.join(self._answer(messages))))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=' '.join(self._answer(messages))))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        words = self._answer(messages)
+        for word in words:
+            time.sleep(self.latency / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + ' '))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        words = self._answer(messages)
+        for word in words:
+            await asyncio.sleep(self.latency / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + ' '))
+
+
+class FakeReranker:
+    """Reranker stub scoring each text by how many of the question's words it
+    contains, after a delay drawn from a log-normal distribution with median
+    `latency` seconds, so some calls overrun any budget
+    """
+
+    def __init__(self, latency: float = 0.0, spread: float = 0.5, seed: int = 0):
+        self.latency = latency
+        self.spread = spread
+        self.calls = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def score(self, question: str, texts: List[str]) -> List[float]:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * float(self._rng.lognormal(0.0, self.spread)) if self.latency else 0.0
+        time.sleep(delay)
+        words = set(question.lower().split())
+        return [float(len(words & set(text.lower().split()))) for text in texts]
+
+
+class FakeEncoder:
+    """CPU-bound stand-in for a sentence-transformers model, with its `encode`
+    signature: texts are hashed into token IDs, padded to the longest in the
+    batch and passed through `layers` feed-forward blocks (dimension to 4x
+    and back, about the arithmetic of a MiniLM-sized transformer per token)
+    before mean pooling, so the cost grows with batch size times padded
+    length as a transformer's does
+    """
+
+    def __init__(self, dimension: int = 384, layers: int = 6, vocabulary: int = 30_000, max_tokens: int = 256):
+        rng = np.random.default_rng(0)
+        self.max_tokens = max_tokens
+        self.table = rng.standard_normal((vocabulary, dimension)).astype(np.float32)
+        self.blocks = [
+            ((rng.standard_normal((dimension, 4 * dimension)) / np.sqrt(dimension)).astype(np.float32),
+             (rng.standard_normal((4 * dimension, dimension)) / np.sqrt(4 * dimension)).astype(np.float32))
+            for _ in range(layers)
+        ]
+        self.calls = 0
+
+    def encode(self, sentences: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False) -> np.ndarray:
+        self.calls += 1
+        tokens = [
+            [int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), 'little') % len(self.table)
+             for word in sentence.split()[:self.max_tokens]] or [0]
+            for sentence in sentences
+        ]
+        width = max(len(ids) for ids in tokens)
+        ids = np.zeros((len(tokens), width), dtype=np.int64)
+        mask = np.zeros((len(tokens), width, 1), dtype=np.float32)
+        for row, sentence_ids in enumerate(tokens):
+            ids[row, :len(sentence_ids)] = sentence_ids
+            mask[row, :len(sentence_ids)] = 1.0
+        hidden = self.table[ids]
+        for expand, project in self.blocks:
+            hidden = hidden + np.maximum(hidden @ expand, 0) @ project
+            hidden /= np.linalg.norm(hidden, axis=-1, keepdims=True)
+        pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+        return pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
@@ -0,0 +1,56 @@
+import numpy as np
+import faiss
+
+
+def random_embeddings(n: int, dimension: int, seed: int = 0, clusters: int = 64) -> np.ndarray:
+    """L2-normalized float32 vectors drawn around a few cluster centres.
+
+    Real embeddings are far from uniform; clustering keeps nearest-neighbour
+    structure (and therefore recall numbers) closer to what production sees.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignment = rng.integers(0, clusters, size=n)
+    vectors = centres[assignment] + 0.5 * rng.standard_normal((n, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def tenant_assignment(n: int, tenants: int, seed: int = 0) -> np.ndarray:
+    """Owner user ID per vector, with Zipf-skewed tenant sizes"""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, tenants + 1)
+    weights /= weights.sum()
+    return rng.choice(tenants, size=n, p=weights) + 1
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ground-truth neighbour positions by brute-force inner product"""
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    _, indices = index.search(queries, k)
+    return indices
+
+
+def recall_at_k(found, expected) -> float:
+    """Fraction of expected neighbours present in found, averaged over queries"""
+    hits, total = 0, 0
+    for got, want in zip(found, expected):
+        want = [i for i in want if i >= 0]
+        hits += len(set(got) & set(want))
+        total += len(want)
+    return hits / total if total else 1.0
+
+
+def queries_near(vectors: np.ndarray, n: int, noise: float = 0.3, seed: int = 1):
+    """Normalized queries perturbed from random corpus vectors.
+
+    Returns (queries, source_positions).
+    """
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, len(vectors), size=n)
+    dimension = vectors.shape[1]
+    perturbation = rng.standard_normal((n, dimension)) * (noise / np.sqrt(dimension))
+    queries = (vectors[sources] + perturbation).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries, sources
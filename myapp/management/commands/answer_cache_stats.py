@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from myapp.services.answer_cache import SemanticAnswerCache
+
+
+class Command(BaseCommand):
+    help = "Show semantic answer cache hits, misses and answers dropped because their documents changed"
+
+    def handle(self, *args, **options):
+        stats = SemanticAnswerCache().stats()
+        self.stdout.write(f"Hit rate:       {stats['hit_rate']:.1%} ({stats['hits']} hits, {stats['misses']} misses)")
+        self.stdout.write(f"Stale matches:  {stats['stale']}")
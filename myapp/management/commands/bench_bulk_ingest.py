@@ -0,0 +1,90 @@
+import shutil
+import tempfile
+import time
+import numpy as np
+from celery import current_app
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from myapp.models import Document, DocumentChunk, IngestBatch
+from myapp.services.id_map import VectorIdMap
+from myapp.services.index_writer import store_dir
+from myapp.services.document_processor import DocumentProcessor
+from myapp.tasks import schedule_index_maintenance, start_bulk_ingest
+from myapp.benchmarks.pdfs import WORDS
+
+
+class Command(BaseCommand):
+    help = ("Benchmark ingest throughput in chunks/sec for many small documents: one task per document "
+            "versus a bulk batch whose embedding calls span documents and commit once, with a fake "
+            "embedding provider and Celery tasks run eagerly")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=300)
+        parser.add_argument('--words-per-document', type=int, default=600)
+        parser.add_argument('--embed-latency', type=float, default=0.1, help="Seconds per provider call")
+        parser.add_argument('--per-text-latency', type=float, default=0.001, help="Extra seconds per text")
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-bulk-')
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        overrides = override_settings(
+            VECTOR_DB_PATH=directory,
+            MEDIA_ROOT=directory,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            EMBEDDING_CACHE_ENABLED=False,
+            EMBEDDING_PROVIDER='myapp.benchmarks.providers.FakeEmbeddings',
+            EMBEDDING_PROVIDER_OPTIONS={
+                'latency': options['embed_latency'], 'per_text_latency': options['per_text_latency'],
+            },
+        )
+        overrides.enable()
+        always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        try:
+            user = User.objects.create_user(username='bench', password='bench')
+            self.stdout.write(
+                f"{options['documents']} documents of {options['words_per_document']} words, provider call "
+                f"{options['embed_latency'] * 1000:.0f} ms + {options['per_text_latency'] * 1000:.1f} ms/text"
+            )
+            self.stdout.write(f"{'mode':>13} {'seconds':>8} {'chunks':>7} {'chunks/s':>9} {'indexed':>8}")
+            for mode, seed in (('per-document', 1), ('bulk', 2)):
+                documents = self._documents(user, options['documents'], options['words_per_document'], seed)
+                start = time.perf_counter()
+                if mode == 'bulk':
+                    batch = IngestBatch.objects.create(uploaded_by=user, total_documents=len(documents))
+                    Document.objects.filter(id__in=[document.id for document in documents]).update(batch=batch)
+                    start_bulk_ingest(batch)
+                else:
+                    # What process_document_task does for each upload, minus progress reporting
+                    for document in documents:
+                        DocumentProcessor().process_document(document)
+                        schedule_index_maintenance()
+                seconds = time.perf_counter() - start
+
+                chunks = DocumentChunk.objects.filter(document__in=documents, embedding_stored=True).count()
+                document_ids = {document.id.bytes for document in documents}
+                id_map = VectorIdMap.load(store_dir(directory))
+                indexed = sum(bytes(value).ljust(16, b'\0') in document_ids for value in id_map.document_ids)
+                self.stdout.write(f"{mode:>13} {seconds:>8.2f} {chunks:>7} {chunks / seconds:>9.0f} {indexed:>8}")
+        finally:
+            current_app.conf.task_always_eager = always_eager
+            overrides.disable()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def _documents(user, count: int, words: int, seed: int):
+        rng = np.random.default_rng(seed)
+        documents = []
+        for i in range(count):
+            text = '. '.join(
+                ' '.join(rng.choice(WORDS, 12)).capitalize() for _ in range(words // 12)
+            ) + '.'
+            document = Document(title=f'bench-{seed}-{i}', document_type='txt', uploaded_by=user)
+            document.file.save(f'bench-{seed}-{i}.txt', ContentFile(text.encode()), save=False)
+            document.save()
+            documents.append(document)
+        return documents
@@ -0,0 +1,67 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from myapp.services.chunking import CHUNKERS
+from myapp.benchmarks.pdfs import WORDS
+
+
+class Command(BaseCommand):
+    help = ("Benchmark chunking throughput on multi-MB texts for each strategy against the previous "
+            "character-scan chunker")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes-mb', default='1,4,16')
+        parser.add_argument('--chunk-tokens', type=int, default=256)
+        parser.add_argument('--overlap-tokens', type=int, default=48)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'MB':>5} {'strategy':>10} {'MB/s':>7} {'chunks':>8} {'avg tokens':>11}")
+        for size_mb in [float(n) for n in options['sizes_mb'].split(',')]:
+            text = synthetic_text(int(size_mb * 2**20))
+            start = time.perf_counter()
+            chunks = sum(1 for _ in _legacy_chunks(text))
+            self._report(size_mb, 'legacy', time.perf_counter() - start, chunks, None)
+            for name, chunker_class in CHUNKERS.items():
+                chunker = chunker_class(options['chunk_tokens'], options['overlap_tokens'])
+                start = time.perf_counter()
+                chunks = tokens = 0
+                for chunk in chunker.chunk_pages([(text, 1)]):
+                    chunks += 1
+                    tokens += chunk.token_count
+                self._report(size_mb, name, time.perf_counter() - start, chunks, tokens / chunks)
+
+    def _report(self, size_mb, name, seconds, chunks, avg_tokens):
+        avg = f"{avg_tokens:>11.1f}" if avg_tokens is not None else f"{'-':>11}"
+        self.stdout.write(f"{size_mb:>5g} {name:>10} {size_mb / seconds:>7.1f} {chunks:>8} {avg}")
+
+
+def synthetic_text(size: int, seed: int = 0) -> str:
+    """Prose of about `size` characters: sentences wrapped into lines, grouped into paragraphs"""
+    rng = np.random.default_rng(seed)
+    paragraphs, length = [], 0
+    while length < size:
+        sentences = [
+            ' '.join(rng.choice(WORDS, int(rng.integers(5, 25)))).capitalize() + str(rng.choice(['.', '.', '?', '!']))
+            for _ in range(int(rng.integers(2, 12)))
+        ]
+        words = ' '.join(sentences).split(' ')
+        paragraph = '\n'.join(' '.join(words[i:i + 12]) for i in range(0, len(words), 12))
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)
+
+
+def _legacy_chunks(text: str, chunk_size: int = 1000, chunk_overlap: int = 200):
+    """The previous character-scan chunker, kept for comparison"""
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            for i in range(end, start + chunk_size // 2, -1):
+                if text[i] in '.!?':
+                    end = i + 1
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        start = end - chunk_overlap
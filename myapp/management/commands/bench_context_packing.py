@@ -0,0 +1,116 @@
+import time
+import uuid
+import numpy as np
+from django.core.management.base import BaseCommand
+from myapp.models import DocumentChunk
+from myapp.services.chunking import get_chunker
+from myapp.services.context_packing import pack_context
+from myapp.services.tokens import count_tokens
+
+
+class Command(BaseCommand):
+    help = ("Benchmark LLM context assembly on retrieved chunks that include neighbours of one "
+            "document: prompt tokens and packing time of concatenating every chunk vs. packing "
+            "into a token budget with overlaps removed, and a check that every merged passage "
+            "is exactly its span of the document text")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=20)
+        parser.add_argument('--words-per-document', type=int, default=20_000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--top-k', type=int, default=20)
+        parser.add_argument('--budgets', default='1000,3000,6000')
+
+    def handle(self, *args, **options):
+        texts, chunks = self._corpus(options)
+        rng = np.random.default_rng(1)
+        results = [self._retrieve(rng, chunks, options['top_k']) for _ in range(options['queries'])]
+        legacy = [[(self._without_offsets(chunk), score) for chunk, score in hits] for hits in results]
+
+        self.stdout.write(
+            f"{sum(len(c) for c in chunks)} chunks from {len(texts)} documents, {options['queries']} questions "
+            f"retrieving {options['top_k']} chunks each, about half of them neighbours of another hit"
+        )
+        self.stdout.write(
+            f"{'context':>22} {'tokens':>7} {'p99 tok':>8} {'chunks':>7} {'passages':>9} {'p50 us':>7} {'p99 us':>7} {'exact':>6}"
+        )
+        tokens, latencies = [], []
+        for hits in results:
+            start = time.perf_counter()
+            context = "\n".join(f"Context {i}:\n{chunk.content}\n" for i, (chunk, _) in enumerate(hits, 1))
+            latencies.append((time.perf_counter() - start) * 1e6)
+            tokens.append(count_tokens(context))
+        self._row('concatenate all', tokens, [len(h) for h in results], [len(h) for h in results], latencies, '-')
+
+        for budget in [int(b) for b in options['budgets'].split(',')]:
+            for name, hit_sets in ((f'packed {budget}', results), (f'packed {budget} by text', legacy)):
+                tokens, kept, passages, latencies, exact = [], [], [], [], True
+                for hits in hit_sets:
+                    packed = pack_context(hits, budget)
+                    latencies.append(packed.seconds * 1e6)
+                    tokens.append(packed.tokens)
+                    kept.append(len(packed.chunks))
+                    passages.append(packed.text.count('Context '))
+                    exact &= self._exact(packed, texts)
+                self._row(name, tokens, kept, passages, latencies, 'yes' if exact else 'NO')
+
+    def _row(self, name, tokens, kept, passages, latencies, exact):
+        self.stdout.write(
+            f"{name:>22} {np.mean(tokens):>7.0f} {np.percentile(tokens, 99):>8.0f} {np.mean(kept):>7.1f} "
+            f"{np.mean(passages):>9.1f} {np.percentile(latencies, 50):>7.0f} {np.percentile(latencies, 99):>7.0f} {exact:>6}"
+        )
+
+    @staticmethod
+    def _exact(packed, texts) -> bool:
+        """Every passage (bar a budget-truncated one) appears verbatim in its
+        document, so no overlap was repeated and no text was lost
+        """
+        for passage in packed.text.split('Context ')[1:]:
+            body = passage.split(':\n', 1)[1][:-1].rstrip('\n')
+            if not any(body in text for text in texts):
+                return False
+        return True
+
+    @staticmethod
+    def _retrieve(rng, chunks, top_k):
+        """top_k chunks with decreasing scores: runs of two to four
+        neighbours, as overlapping chunks of a relevant section score alike,
+        and single chunks from elsewhere
+        """
+        hits, seen = [], set()
+        while len(hits) < top_k:
+            document = chunks[int(rng.integers(len(chunks)))]
+            first = int(rng.integers(len(document)))
+            run = int(rng.integers(2, 5)) if rng.random() < 0.5 else 1
+            for chunk in document[first:first + run]:
+                if chunk.id not in seen and len(hits) < top_k:
+                    seen.add(chunk.id)
+                    hits.append(chunk)
+        scores = np.sort(rng.random(len(hits)))[::-1]
+        return list(zip(hits, scores.tolist()))
+
+    @staticmethod
+    def _without_offsets(chunk):
+        # As stored before chunks recorded byte offsets
+        return DocumentChunk(id=chunk.id, document_id=chunk.document_id, content=chunk.content,
+                             chunk_index=chunk.chunk_index)
+
+    @staticmethod
+    def _corpus(options):
+        rng = np.random.default_rng(0)
+        words = [f"word{i}" for i in range(3000)]
+        chunker = get_chunker()
+        texts, chunks = [], []
+        for _ in range(options['documents']):
+            sentences = []
+            for length in rng.integers(5, 30, options['words_per_document'] // 15):
+                sentences.append(' '.join(rng.choice(words, int(length))).capitalize() + '.')
+            text = '\n\n'.join(' '.join(sentences[i:i + 6]) for i in range(0, len(sentences), 6))
+            document_id = uuid.uuid4()
+            texts.append(text)
+            chunks.append([
+                DocumentChunk(id=uuid.uuid4(), document_id=document_id, content=chunk.content, chunk_index=i,
+                              start_offset=chunk.start, end_offset=chunk.end, token_count=chunk.token_count)
+                for i, chunk in enumerate(chunker.chunk_pages([(text, 1)]))
+            ])
+        return texts, chunks
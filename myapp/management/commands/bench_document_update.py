@@ -0,0 +1,122 @@
+import shutil
+import tempfile
+import time
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from myapp.models import Document
+from myapp.services.document_processor import DocumentProcessor
+from myapp.services.id_map import VectorIdMap
+from myapp.services.index_writer import load_tombstones, store_dir
+from myapp.services.metrics import get_metrics
+from myapp.benchmarks.pdfs import WORDS
+
+
+class Command(BaseCommand):
+    help = ("Benchmark uploading a new version of a document with a share of its paragraphs edited: "
+            "chunks embedded and seconds when only new or changed chunks are re-embedded vs. "
+            "re-ingesting the whole document, plus a check that the updated document matches a "
+            "fresh chunking of the new text and has exactly one live vector per chunk")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paragraphs', type=int, default=1000)
+        parser.add_argument('--edits', default='0,0.01,0.1,0.5', help="Fractions of paragraphs rewritten")
+        parser.add_argument('--embed-latency', type=float, default=0.1, help="Seconds per provider call")
+        parser.add_argument('--per-text-latency', type=float, default=0.001, help="Extra seconds per text")
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-update-')
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        overrides = override_settings(
+            VECTOR_DB_PATH=directory,
+            MEDIA_ROOT=directory,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            EMBEDDING_CACHE_ENABLED=False,
+            EMBEDDING_PROVIDER='myapp.benchmarks.providers.FakeEmbeddings',
+            EMBEDDING_PROVIDER_OPTIONS={
+                'latency': options['embed_latency'], 'per_text_latency': options['per_text_latency'],
+            },
+        )
+        overrides.enable()
+        try:
+            user = User.objects.create_user(username='bench', password='bench')
+            rng = np.random.default_rng(0)
+            paragraphs = [self._paragraph(rng) for _ in range(options['paragraphs'])]
+            self.stdout.write(
+                f"{options['paragraphs']} paragraphs, provider call {options['embed_latency'] * 1000:.0f} ms "
+                f"+ {options['per_text_latency'] * 1000:.1f} ms/text"
+            )
+            self.stdout.write(
+                f"{'edited':>7} {'chunks':>7} {'embedded':>9} {'removed':>8} {'update s':>9} {'full s':>7} {'exact':>6}"
+            )
+            for fraction in [float(f) for f in options['edits'].split(',')]:
+                edited = list(paragraphs)
+                for i in rng.choice(len(edited), int(round(fraction * len(edited))), replace=False):
+                    edited[i] = self._paragraph(rng)
+                text = '\n\n'.join(edited)
+
+                document = self._document(user, '\n\n'.join(paragraphs), f'v1-{fraction}')
+                DocumentProcessor().process_document(document)
+                before = document.chunks.count()
+                reused_before = self._reused()
+                document.file.save(f'v2-{fraction}.txt', ContentFile(text.encode()), save=False)
+                document.version += 1
+                document.save()
+                start = time.perf_counter()
+                DocumentProcessor().process_document(document)
+                update_seconds = time.perf_counter() - start
+                after = document.chunks.count()
+                reused = self._reused() - reused_before
+
+                # What re-uploading did before: a new document, embedded whole
+                start = time.perf_counter()
+                DocumentProcessor().process_document(self._document(user, text, f'full-{fraction}'))
+                full_seconds = time.perf_counter() - start
+
+                exact = self._exact(document, text, directory)
+                self.stdout.write(
+                    f"{fraction:>7.0%} {after:>7} {after - reused:>9} {before - reused:>8} "
+                    f"{update_seconds:>9.2f} {full_seconds:>7.2f} {'yes' if exact else 'NO':>6}"
+                )
+        finally:
+            overrides.disable()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def _paragraph(rng) -> str:
+        return ' '.join(
+            ' '.join(rng.choice(WORDS, int(rng.integers(8, 25)))).capitalize() + '.'
+            for _ in range(int(rng.integers(2, 8)))
+        )
+
+    @staticmethod
+    def _reused() -> float:
+        """Chunks that have taken over a previous version's vector so far"""
+        return sum(value for name, _, value in get_metrics().snapshot()['counters']
+                   if name == 'vectormind_ingest_chunks_reused_total')
+
+    @staticmethod
+    def _document(user, text: str, name: str) -> Document:
+        document = Document(title=name, document_type='txt', uploaded_by=user)
+        document.file.save(f'{name}.txt', ContentFile(text.encode()), save=False)
+        document.save()
+        return document
+
+    @staticmethod
+    def _exact(document: Document, text: str, directory: str) -> bool:
+        """The document's chunks are those of a fresh chunking of `text`, in
+        order, and each has exactly one live vector
+        """
+        chunks = list(document.chunks.order_by('chunk_index'))
+        expected = [chunk.content for chunk in DocumentProcessor().chunker.chunk_pages([(text, 1)])]
+        if [chunk.content for chunk in chunks] != expected:
+            return False
+        if [chunk.chunk_index for chunk in chunks] != list(range(len(chunks))):
+            return False
+        id_map = VectorIdMap.load(store_dir(directory))
+        live = np.setdiff1d(id_map.positions_for_documents([document.id]), load_tombstones(store_dir(directory)))
+        return sorted(id_map.chunk_ids_at(live)) == sorted(chunk.id for chunk in chunks)
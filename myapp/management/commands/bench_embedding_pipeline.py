@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from myapp.services.embedding_pipeline import EmbeddingPipeline
+from myapp.benchmarks.providers import FakeEmbeddings
+
+
+class Command(BaseCommand):
+    help = "Benchmark batched, concurrent embedding against a fake rate-limited embedding server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=5000)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds per provider call")
+        parser.add_argument('--per-text-latency', type=float, default=0.001)
+        parser.add_argument('--capacity', type=int, default=6, help="Concurrent calls before the server returns 429")
+        parser.add_argument('--batch-sizes', default='50,100')
+        parser.add_argument('--in-flight', default='1,4,8,16')
+
+    def handle(self, *args, **options):
+        texts = [f"chunk {i} " + "lorem ipsum " * 80 for i in range(options['chunks'])]
+        self.stdout.write(
+            f"{len(texts)} chunks, {options['latency'] * 1000:.0f} ms/call, server capacity {options['capacity']}"
+        )
+        self.stdout.write(f"{'batch':>6} {'in-flight':>9} {'seconds':>8} {'chunks/s':>9} {'calls':>6} {'429s':>5}")
+
+        for batch_size in [int(b) for b in options['batch_sizes'].split(',')]:
+            for in_flight in [int(n) for n in options['in_flight'].split(',')]:
+                provider = FakeEmbeddings(
+                    latency=options['latency'],
+                    per_text_latency=options['per_text_latency'],
+                    capacity=options['capacity'],
+                )
+                pipeline = EmbeddingPipeline(
+                    provider, batch_size=batch_size, max_in_flight=in_flight,
+                    max_retries=10, backoff_seconds=0.05,
+                )
+                start = time.perf_counter()
+                embeddings = pipeline.embed(texts)
+                elapsed = time.perf_counter() - start
+                assert embeddings.shape[0] == len(texts)
+                self.stdout.write(
+                    f"{batch_size:>6} {in_flight:>9} {elapsed:>8.2f} {len(texts) / elapsed:>9.0f} "
+                    f"{provider.calls:>6} {provider.rejected_calls:>5}"
+                )
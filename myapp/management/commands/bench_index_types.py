@@ -0,0 +1,60 @@
+import time
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand
+from myapp.services import index_factory
+from myapp.benchmarks.synthetic import random_embeddings, queries_near, exact_top_k, recall_at_k
+
+
+class Command(BaseCommand):
+    help = "Benchmark recall@k versus latency of each FAISS index type against the flat baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=200_000)
+        parser.add_argument('--dimension', type=int, default=768)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--types', default=','.join(index_factory.INDEX_TYPES))
+
+    def handle(self, *args, **options):
+        n, dimension, k = options['vectors'], options['dimension'], options['top_k']
+        vectors = random_embeddings(n, dimension)
+        queries, _ = queries_near(vectors, options['queries'])
+        expected = exact_top_k(vectors, queries, k)
+
+        self.stdout.write(f"{n} vectors, dim {dimension}, recall@{k} over {len(queries)} queries")
+        self.stdout.write(
+            f"{'index':>10} {'param':>12} {'build s':>8} {'B/vector':>9} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}"
+        )
+
+        for index_type in options['types'].split(','):
+            start = time.perf_counter()
+            index = index_factory.build_index(vectors, index_type)
+            build_seconds = time.perf_counter() - start
+            bytes_per_vector = len(faiss.serialize_index(index)) / n
+
+            if index_type.startswith('ivf'):
+                settings_grid = [('nprobe', v) for v in (1, 4, 16, 64)]
+            elif index_type == 'hnsw':
+                settings_grid = [('efSearch', v) for v in (16, 64, 256)]
+            else:
+                settings_grid = [('-', None)]
+
+            for name, value in settings_grid:
+                params = index_factory.search_parameters(
+                    index,
+                    nprobe=value if name == 'nprobe' else None,
+                    ef_search=value if name == 'efSearch' else None,
+                )
+                found, latencies = [], []
+                for query in queries:
+                    t = time.perf_counter()
+                    _, indices = index.search(query.reshape(1, -1), k, params=params)
+                    latencies.append((time.perf_counter() - t) * 1000)
+                    found.append(list(indices[0]))
+                label = f"{name}={value}" if value else '-'
+                self.stdout.write(
+                    f"{index_type:>10} {label:>12} {build_seconds:>8.1f} {bytes_per_vector:>9.0f} "
+                    f"{recall_at_k(found, expected):>7.3f} "
+                    f"{np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 99):>8.3f}"
+                )
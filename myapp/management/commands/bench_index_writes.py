@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand
+from myapp.services.id_map import VectorIdMap
+from myapp.services.index_writer import IndexWriter, load_vectors, store_dir
+from myapp.benchmarks.providers import FakeEmbeddings
+from myapp.benchmarks.synthetic import random_embeddings
+
+
+class Command(BaseCommand):
+    help = ("Benchmark ingest cost against corpus size for append-only writes versus rewriting the whole "
+            "index, and check that concurrent writers, merges, deletes and compactions lose or misalign no rows")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus-sizes', default='10000,100000,500000')
+        parser.add_argument('--dimension', type=int, default=768)
+        parser.add_argument('--document-chunks', type=int, default=100)
+        parser.add_argument('--writers', type=int, default=8, help="Concurrent writer processes")
+        parser.add_argument('--documents-per-writer', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self._ingest_cost(options)
+        self._concurrent_writers(options)
+
+    def _ingest_cost(self, options):
+        dimension, chunks = options['dimension'], options['document_chunks']
+        document = random_embeddings(chunks, dimension, seed=7)
+        self.stdout.write(f"Ingesting one {chunks}-chunk document, dim {dimension}")
+        self.stdout.write(f"{'corpus':>9} {'append ms':>10} {'rewrite ms':>11}")
+
+        for corpus_size in [int(n) for n in options['corpus_sizes'].split(',')]:
+            path = tempfile.mkdtemp(prefix='bench-writes-')
+            try:
+                corpus = random_embeddings(corpus_size, dimension)
+                writer = IndexWriter(path)
+                writer.append(corpus, *self._ids(corpus_size))
+                start = time.perf_counter()
+                writer.append(document, *self._ids(chunks))
+                append_ms = (time.perf_counter() - start) * 1000
+
+                # The previous ingest path: read the whole index, add, write it back
+                index_path = os.path.join(path, 'rewrite.faiss')
+                index = faiss.IndexFlatIP(dimension)
+                index.add(corpus)
+                faiss.write_index(index, index_path)
+                del index
+                start = time.perf_counter()
+                index = faiss.read_index(index_path)
+                index.add(document)
+                faiss.write_index(index, index_path)
+                rewrite_ms = (time.perf_counter() - start) * 1000
+                del index, corpus
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+            self.stdout.write(f"{corpus_size:>9} {append_ms:>10.1f} {rewrite_ms:>11.1f}")
+
+    def _concurrent_writers(self, options):
+        writers, documents = options['writers'], options['documents_per_writer']
+        chunks, dimension = options['document_chunks'], options['dimension']
+        path = tempfile.mkdtemp(prefix='bench-writes-')
+        try:
+            context = multiprocessing.get_context('fork')
+            processes = [
+                context.Process(target=_write_documents, args=(path, documents, chunks, dimension))
+                for _ in range(writers)
+            ]
+            stop, deleted = context.Event(), context.Value('q', 0)
+            processes.append(context.Process(target=_merge_repeatedly, args=(path, 1.0, stop)))
+            processes.append(context.Process(target=_delete_and_compact, args=(path, 0.5, stop, deleted)))
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            for process in processes[:-2]:
+                process.join()
+            stop.set()
+            for process in processes[-2:]:
+                process.join()
+            elapsed = time.perf_counter() - start
+
+            writer = IndexWriter(path)
+            writer.compact()
+            writer.merge()
+            directory = store_dir(path)
+            id_map = VectorIdMap.load(directory)
+            vectors = load_vectors(directory, dimension)
+            provider = FakeEmbeddings(dimension=dimension)
+            misaligned = sum(
+                not np.allclose(vectors[i], provider._vector(str(id_map.chunk_id(i))), atol=1e-6)
+                for i in range(len(id_map))
+            )
+            index = faiss.read_index(os.path.join(directory, 'index.faiss'))
+            expected = writers * documents * chunks - deleted.value
+            self.stdout.write(
+                f"{writers} writers x {documents} documents with a concurrent merger and deleter "
+                f"in {elapsed:.2f}s: {deleted.value} vectors deleted, {len(id_map)}/{expected} rows, "
+                f"{len(vectors)} vectors, {index.ntotal} indexed, {misaligned} misaligned"
+            )
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _ids(n: int):
+        document_id = uuid.uuid4()
+        return [uuid.uuid4() for _ in range(n)], [document_id] * n, [1] * n
+
+
+def _write_documents(path, documents: int, chunks: int, dimension: int):
+    """Writer process: each vector is derived from its chunk ID so alignment can be checked"""
+    writer = IndexWriter(path)
+    provider = FakeEmbeddings(dimension=dimension)
+    for _ in range(documents):
+        chunk_ids = [uuid.uuid4() for _ in range(chunks)]
+        vectors = np.stack([provider._vector(str(chunk_id)) for chunk_id in chunk_ids])
+        writer.append(vectors, chunk_ids, [uuid.uuid4()] * chunks, [1] * chunks)
+
+
+def _merge_repeatedly(path, interval: float, stop):
+    writer = IndexWriter(path)
+    while not stop.wait(interval):
+        writer.merge()
+
+
+def _delete_and_compact(path, interval: float, stop, deleted):
+    """Deleter process: drops one random document per round, then compacts"""
+    writer = IndexWriter(path)
+    rng = np.random.default_rng(0)
+    while not stop.wait(interval):
+        document_ids = VectorIdMap.load(store_dir(path)).document_ids
+        if len(document_ids):
+            document_id = uuid.UUID(bytes=bytes(document_ids[rng.integers(len(document_ids))]).ljust(16, b'\0'))
+            deleted.value += writer.delete_documents([document_id])
+        writer.compact()
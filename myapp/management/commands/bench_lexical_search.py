@@ -0,0 +1,114 @@
+import shutil
+import tempfile
+import time
+import uuid
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from myapp.services.lexical_index import LexicalIndexWriter, LexicalStore
+from myapp.benchmarks.synthetic import tenant_assignment
+
+IDENTIFIER_SALT = np.uint64(0x5EED)
+
+
+class Command(BaseCommand):
+    help = ("Benchmark BM25 search latency on the on-disk lexical index as it grows to millions of "
+            "chunks, for word queries and for queries naming a chunk's unique identifier alongside two "
+            "common words, which must return that chunk")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000,3000000', help="Cumulative chunk counts")
+        parser.add_argument('--tenants', type=int, default=100)
+        parser.add_argument('--terms-per-chunk', type=int, default=40)
+        parser.add_argument('--vocabulary', type=int, default=200_000)
+        parser.add_argument('--segment-chunks', type=int, default=250_000)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--top-k', type=int, default=20)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-lexical-')
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        owners = tenant_assignment(sizes[-1], options['tenants'])
+        rng = np.random.default_rng(0)
+        vocabulary = rng.integers(0, 2**63, options['vocabulary'], dtype=np.uint64)
+        # Queries are bounded by segment count, not size; keep every segment unmerged
+        overrides = override_settings(LEXICAL_MAX_SEGMENTS=sizes[-1] // options['segment_chunks'] + 1)
+        overrides.enable()
+        try:
+            writer = LexicalIndexWriter(directory)
+            self.stdout.write(
+                f"{options['tenants']} tenants (Zipf sizes), {options['terms_per_chunk']} terms per chunk "
+                f"from a Zipf vocabulary of {options['vocabulary']}, top_k {options['top_k']}"
+            )
+            self.stdout.write(f"{'chunks':>9} {'segments':>8} {'query':>10} {'p50 ms':>7} {'p99 ms':>7} {'found':>6} {'rank 1':>7}")
+            indexed = 0
+            for size in sizes:
+                start = time.perf_counter()
+                while indexed < size:
+                    count = min(options['segment_chunks'], size - indexed)
+                    self._add_segment(writer, indexed, owners[indexed:indexed + count], vocabulary, options, rng)
+                    indexed += count
+                build_seconds = time.perf_counter() - start
+                snapshot = LexicalStore(directory).get_snapshot()
+                for kind in ('words', 'identifier'):
+                    latencies, found, first = self._run_queries(snapshot, kind, size, owners, vocabulary, options)
+                    shares = f"{found:>6.1%} {first:>7.1%}" if kind == 'identifier' else f"{'-':>6} {'-':>7}"
+                    self.stdout.write(
+                        f"{size:>9} {len(snapshot.segments):>8} {kind:>10} {np.percentile(latencies, 50):>7.2f} "
+                        f"{np.percentile(latencies, 99):>7.2f} {shares}"
+                    )
+                    if kind == 'identifier' and found < 1.0:
+                        raise CommandError("an identifier query did not return its chunk")
+                self.stdout.write(f"{'':>9} indexed in {build_seconds:.1f}s")
+        finally:
+            overrides.disable()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def _add_segment(writer, first_row, owners, vocabulary, options, rng):
+        """Postings for chunks first_row.. drawn at random: Zipf-distributed
+        words plus one identifier unique to each chunk
+        """
+        count, terms, size = len(owners), options['terms_per_chunk'], len(vocabulary)
+        # Distinct (row, word) pairs, as analysis counts repeats in the term frequency
+        pairs = np.unique(np.arange(count)[:, None] * size + (rng.zipf(1.1, (count, terms)) - 1) % size)
+        rows = np.concatenate([pairs // size, np.arange(count)]).astype(np.uint32)
+        hashes = np.concatenate([vocabulary[pairs % size], identifier_hash(first_row + np.arange(count))])
+        tfs = rng.geometric(0.6, len(rows)).astype(np.uint16)
+        lengths = np.bincount(rows, weights=tfs, minlength=count).astype(np.uint32)
+        writer.add_postings(chunk_id_array(first_row, count), owners, rows, hashes, tfs, lengths)
+
+    @staticmethod
+    def _run_queries(snapshot, kind, size, owners, vocabulary, options):
+        """Latencies in ms, and the shares of queries whose chunk was returned
+        and returned first
+        """
+        rng = np.random.default_rng(size)
+        latencies, found, first = [], 0, 0
+        for target in rng.integers(0, size, options['queries']):
+            if kind == 'identifier':
+                # e.g. "what does ERR-4021 mean"
+                words = np.append(vocabulary[rng.integers(0, 100, 2)], identifier_hash(np.array([target])))
+            else:
+                words = vocabulary[(rng.zipf(1.3, 3) - 1) % len(vocabulary)]
+            start = time.perf_counter()
+            hits = snapshot.search_terms(words, int(owners[target]), options['top_k'])
+            latencies.append((time.perf_counter() - start) * 1000)
+            chunk_ids = [chunk_id for chunk_id, _ in hits]
+            found += chunk_uuid(int(target)) in chunk_ids
+            first += chunk_ids[:1] == [chunk_uuid(int(target))]
+        return latencies, found / options['queries'], first / options['queries']
+
+
+def identifier_hash(rows: np.ndarray) -> np.ndarray:
+    return (rows.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^ IDENTIFIER_SALT
+
+
+def chunk_id_array(first_row: int, count: int) -> np.ndarray:
+    ids = np.zeros((count, 2), dtype='<u8')
+    ids[:, 0] = np.arange(first_row, first_row + count) + 1
+    return ids.view('S16').ravel()
+
+
+def chunk_uuid(row: int) -> uuid.UUID:
+    return uuid.UUID(bytes=(row + 1).to_bytes(8, 'little') + bytes(8))
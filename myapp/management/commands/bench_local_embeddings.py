@@ -0,0 +1,92 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from myapp.services.embedding_pipeline import EmbeddingPipeline
+from myapp.services.local_embeddings import LocalEmbeddings
+from myapp.benchmarks.providers import FakeEmbeddings, FakeEncoder
+
+
+class Command(BaseCommand):
+    help = ("Benchmark a local CPU embedding model against a remote provider: document embeddings/sec "
+            "(local with fixed-order and length-sorted dynamic batches) and question embedding "
+            "latency, including the cold first call a warm-up at worker start avoids. Uses a "
+            "CPU-bound stand-in model unless --model names a sentence-transformers model")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=2000)
+        parser.add_argument('--queries', type=int, default=300)
+        parser.add_argument('--model', default='', help="sentence-transformers model to run instead of the stand-in")
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--max-batch-tokens', type=int, default=8192)
+        parser.add_argument('--threads', type=int, default=1)
+        parser.add_argument('--remote-latency', type=float, default=0.15, help="Seconds per remote call")
+        parser.add_argument('--remote-per-text-latency', type=float, default=0.002, help="Extra seconds per text")
+        parser.add_argument('--remote-in-flight', type=int, default=4)
+
+    def handle(self, *args, **options):
+        texts, questions = self._corpus(options)
+        remote = FakeEmbeddings(latency=options['remote_latency'], per_text_latency=options['remote_per_text_latency'])
+
+        # What warm() moves to worker start: loading the model and a first call
+        start = time.perf_counter()
+        encoder = None if options['model'] else FakeEncoder()
+        local = LocalEmbeddings(
+            options['model'] or 'fake-encoder', options['batch_size'], options['max_batch_tokens'],
+            options['threads'], encoder=encoder,
+        )
+        local.embed_query(questions[0])
+        cold = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{len(texts)} chunks of {np.mean([len(t.split()) for t in texts]):.0f} words on average, "
+            f"local model {local.model} on {options['threads']} thread(s), remote call "
+            f"{options['remote_latency'] * 1000:.0f} ms + {options['remote_per_text_latency'] * 1000:.1f} ms/text "
+            f"with {options['remote_in_flight']} in flight"
+        )
+        self.stdout.write(f"{'documents':>24} {'seconds':>8} {'emb/s':>8} {'calls':>6}")
+        # Calls are counted on the stand-in model and the fake remote only
+        rows = [
+            ('local, fixed batches', encoder, lambda: self._fixed_batches(local, texts)),
+            ('local, dynamic batches', encoder, lambda: local.embed_documents(texts)),
+            ('remote', remote, lambda: EmbeddingPipeline(remote, max_in_flight=options['remote_in_flight']).embed(texts)),
+        ]
+        for name, counted, embed in rows:
+            calls_before = counted.calls if counted else 0
+            start = time.perf_counter()
+            embed()
+            seconds = time.perf_counter() - start
+            calls = counted.calls - calls_before if counted else '-'
+            self.stdout.write(f"{name:>24} {seconds:>8.2f} {len(texts) / seconds:>8.0f} {calls:>6}")
+
+        self.stdout.write(f"\n{'questions':>24} {'cold ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, provider, first in (('local', local, cold), ('remote', remote, None)):
+            latencies = []
+            for question in questions:
+                start = time.perf_counter()
+                provider.embed_query(question)
+                latencies.append((time.perf_counter() - start) * 1000)
+            first = first * 1000 if first is not None else latencies[0]
+            self.stdout.write(
+                f"{name:>24} {first:>8.1f} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f}"
+            )
+
+    @staticmethod
+    def _fixed_batches(local: LocalEmbeddings, texts):
+        """Batches in arrival order, each padded to its longest text"""
+        for start in range(0, len(texts), local.batch_size):
+            local._encode(texts, np.arange(start, min(start + local.batch_size, len(texts))))
+
+    @staticmethod
+    def _corpus(options):
+        """Chunks of log-normally distributed length, as a mix of short
+        sections and full-size chunks gives, and short questions
+        """
+        rng = np.random.default_rng(0)
+        words = [f"term{i}" for i in range(5000)]
+        lengths = np.clip(rng.lognormal(4.3, 0.7, options['texts']), 5, 400).astype(int)
+        texts = [' '.join(rng.choice(words, length)) for length in lengths]
+        questions = [
+            ' '.join(rng.choice(words, int(length))) + '?'
+            for length in rng.integers(5, 20, options['queries'])
+        ]
+        return texts, questions
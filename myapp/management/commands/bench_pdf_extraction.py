@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+import PyPDF2
+from django.core.management.base import BaseCommand
+from myapp.services.index_store import resident_memory_bytes
+from myapp.services.pdf_extraction import iter_pdf_pages
+from myapp.benchmarks.pdfs import write_text_pdf
+
+
+class Command(BaseCommand):
+    help = "Benchmark pages/sec and peak RSS of PDF extraction: whole-document list vs streamed vs process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=5000)
+        parser.add_argument('--pages-per-task', type=int, default=16)
+        parser.add_argument('--workers', default='2,4')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-pdf-')
+        try:
+            path = os.path.join(directory, 'synthetic.pdf')
+            write_text_pdf(path, options['pages'])
+            self.stdout.write(f"{options['pages']} pages, {os.path.getsize(path) / 2**20:.1f} MB")
+            self.stdout.write(f"{'mode':>10} {'pages/s':>9} {'seconds':>8} {'peak MB':>8} {'worker MB':>10}")
+
+            modes = [('list', 0), ('stream', 0)] + [
+                (f'pool-{workers}', int(workers)) for workers in options['workers'].split(',')
+            ]
+            context = multiprocessing.get_context('fork')
+            for mode, workers in modes:
+                # Each mode runs in a fresh process so peak RSS is its own
+                queue = context.Queue()
+                process = context.Process(
+                    target=_measure, args=(queue, path, mode, workers, options['pages_per_task']),
+                )
+                process.start()
+                pages, seconds, peak_bytes, worker_peak_bytes = queue.get()
+                process.join()
+                self.stdout.write(
+                    f"{mode:>10} {pages / seconds:>9.0f} {seconds:>8.2f} {peak_bytes / 2**20:>8.1f} "
+                    f"{worker_peak_bytes / 2**20:>10.1f}"
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _measure(queue, path: str, mode: str, workers: int, pages_per_task: int):
+    baseline = resident_memory_bytes()
+    start = time.perf_counter()
+    if mode == 'list':
+        # Previous behaviour: one reader, every page's text collected before chunking
+        with open(path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            pages_text = [(page.extract_text(), n) for n, page in enumerate(pdf_reader.pages, 1)]
+        pages = sum(1 for text, _ in pages_text if text.strip())
+    else:
+        pages = sum(1 for _ in iter_pdf_pages(path, workers=workers, pages_per_task=pages_per_task))
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KB on Linux; the forked process starts at the parent's RSS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - baseline
+    worker_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024 if workers else 0
+    queue.put((pages, seconds, max(peak, 0), worker_peak))
@@ -0,0 +1,64 @@
+import asyncio
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from myapp.services.query_embedding import QueryEmbedder
+from myapp.benchmarks.providers import FakeEmbeddings
+
+# Settings per mode: the in-process cache and the micro-batcher, alone and together
+MODES = {
+    'direct': {'QUERY_EMBEDDING_CACHE_SIZE': 0, 'QUERY_BATCH_WINDOW_MS': 0},
+    'cache': {'QUERY_BATCH_WINDOW_MS': 0},
+    'batch': {'QUERY_EMBEDDING_CACHE_SIZE': 0},
+    'both': {},
+}
+
+
+class Command(BaseCommand):
+    help = ("Benchmark question embedding latency and provider calls/sec with concurrent clients "
+            "asking Zipf-distributed repeat questions: direct provider calls vs. the in-process cache, "
+            "the micro-batcher, and both, against a fake provider")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='10,100,1000')
+        parser.add_argument('--duration', type=float, default=3.0, help="Seconds per run")
+        parser.add_argument('--questions', type=int, default=5000, help="Distinct questions")
+        parser.add_argument('--embed-latency', type=float, default=0.05, help="Seconds per provider call")
+        parser.add_argument('--per-text-latency', type=float, default=0.0005, help="Extra seconds per text")
+
+    def handle(self, *args, **options):
+        questions = [f"How do I configure feature {i} for my account?" for i in range(options['questions'])]
+        self.stdout.write(
+            f"{len(questions)} distinct questions (Zipf), provider call {options['embed_latency'] * 1000:.0f} ms "
+            f"+ {options['per_text_latency'] * 1000:.1f} ms/text, {options['duration']:.0f} s per run"
+        )
+        self.stdout.write(f"{'clients':>8} {'mode':>7} {'req/s':>8} {'p50 ms':>7} {'p99 ms':>7} {'calls/s':>8} {'req/call':>9}")
+        for clients in [int(c) for c in options['clients'].split(',')]:
+            for mode, overrides in MODES.items():
+                provider = FakeEmbeddings(latency=options['embed_latency'], per_text_latency=options['per_text_latency'])
+                with override_settings(**overrides):
+                    embedder = QueryEmbedder(provider, model_name='fake-embedding')
+                latencies = asyncio.run(self._run(embedder, questions, clients, options['duration']))
+                self.stdout.write(
+                    f"{clients:>8} {mode:>7} {len(latencies) / options['duration']:>8.0f} "
+                    f"{np.percentile(latencies, 50):>7.1f} {np.percentile(latencies, 99):>7.1f} "
+                    f"{provider.calls / options['duration']:>8.0f} {len(latencies) / max(provider.calls, 1):>9.1f}"
+                )
+
+    @staticmethod
+    async def _run(embedder, questions, clients: int, duration: float):
+        """Latencies in ms of every question answered within duration"""
+        latencies = []
+        deadline = time.monotonic() + duration
+
+        async def client(seed: int):
+            rng = np.random.default_rng(seed)
+            while time.monotonic() < deadline:
+                question = questions[(int(rng.zipf(1.2)) - 1) % len(questions)]
+                start = time.perf_counter()
+                await embedder.aembed(question)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*(client(seed) for seed in range(clients)))
+        return latencies
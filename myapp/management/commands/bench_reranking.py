@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+from django.core.management.base import BaseCommand
+from myapp.services.reranking import BudgetedReranker, mmr, unit_range
+from myapp.benchmarks.providers import FakeReranker
+
+DUPLICATE_SIMILARITY = 0.95
+
+
+class Command(BaseCommand):
+    help = ("Benchmark MMR re-ranking on pages split into overlapping chunks: chunks sent to the LLM, "
+            "near-duplicates among them and relevant pages covered vs. plain top_k; then how often a "
+            "slow reranker model answers within its per-query time budget and the latency it adds")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=20_000)
+        parser.add_argument('--chunks-per-page', type=int, default=4)
+        parser.add_argument('--dimension', type=int, default=768)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--candidates', type=int, default=20)
+        parser.add_argument('--diversities', default='0,0.3,0.5')
+        parser.add_argument('--reranker-latency', type=float, default=0.06, help="Median seconds per reranker call")
+        parser.add_argument('--budgets', default='50,100,200', help="Reranker budgets in ms")
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--max-in-flight', type=int, default=8)
+        parser.add_argument('--pause', type=float, default=0.25,
+                            help="Seconds each client waits between questions, e.g. for the LLM answer")
+
+    def handle(self, *args, **options):
+        pages, chunk_pages, chunks = self._corpus(options)
+        index = faiss.IndexFlatIP(options['dimension'])
+        index.add(chunks)
+        rng = np.random.default_rng(1)
+        queries = pages[rng.integers(0, len(pages), options['queries'])]
+        queries = (queries + 0.5 / np.sqrt(options['dimension']) * rng.standard_normal(queries.shape)).astype(np.float32)
+        faiss.normalize_L2(queries)
+        k = options['top_k']
+        _, relevant_pages = faiss.knn(queries, pages, k, metric=faiss.METRIC_INNER_PRODUCT)
+        scores, candidates = index.search(queries, options['candidates'])
+
+        self.stdout.write(
+            f"{len(pages)} pages x {options['chunks_per_page']} overlapping chunks, dim {options['dimension']}, "
+            f"top_k {k} of {options['candidates']} candidates, {len(queries)} queries"
+        )
+        self.stdout.write(
+            f"{'strategy':>12} {'chunks':>7} {'dup pairs':>10} {'pages':>6} {'page recall':>12} {'mean sim':>9} "
+            f"{'p50 us':>7} {'p99 us':>7}"
+        )
+        strategies = [('top_k', None)] + [(f'mmr {d}', float(d)) for d in options['diversities'].split(',')]
+        for name, diversity in strategies:
+            sent, duplicates, covered, recall, similarity, latencies = [], [], [], [], [], []
+            for query_scores, found, relevant in zip(scores, candidates, relevant_pages):
+                vectors = chunks[found]
+                start = time.perf_counter()
+                if diversity is None:
+                    picked = np.arange(k)
+                else:
+                    picked = mmr(unit_range(query_scores), vectors, k, diversity, DUPLICATE_SIMILARITY)
+                latencies.append((time.perf_counter() - start) * 1e6)
+                picked_pages = chunk_pages[found[picked]]
+                pair_similarity = vectors[picked] @ vectors[picked].T
+                sent.append(len(picked))
+                duplicates.append(int(np.count_nonzero(np.triu(pair_similarity >= DUPLICATE_SIMILARITY, 1))))
+                covered.append(len(set(picked_pages)))
+                recall.append(len(set(picked_pages) & set(relevant)) / k)
+                similarity.append(float(query_scores[picked].mean()))
+            self.stdout.write(
+                f"{name:>12} {np.mean(sent):>7.2f} {np.mean(duplicates):>10.2f} {np.mean(covered):>6.2f} "
+                f"{np.mean(recall):>12.3f} {np.mean(similarity):>9.3f} "
+                f"{np.percentile(latencies, 50):>7.0f} {np.percentile(latencies, 99):>7.0f}"
+            )
+
+        self.stdout.write(
+            f"\nreranker: median {options['reranker_latency'] * 1000:.0f} ms per call (log-normal), "
+            f"{options['clients']} clients pausing {options['pause'] * 1000:.0f} ms between questions, "
+            f"{options['max_in_flight']} calls in flight at most"
+        )
+        self.stdout.write(f"{'budget ms':>10} {'in time':>8} {'timed out':>10} {'skipped':>8} {'p50 ms':>7} {'p99 ms':>7}")
+        texts = [f"chunk {i} about topic {i % 7}" for i in range(options['candidates'])]
+        for budget in [float(b) for b in options['budgets'].split(',')]:
+            reranker = BudgetedReranker(FakeReranker(options['reranker_latency'], spread=0.6), budget / 1000, options['max_in_flight'])
+
+            def ask(i):
+                start = time.perf_counter()
+                reranker.score(f"what about topic {i % 7}", texts)
+                latency = (time.perf_counter() - start) * 1000
+                time.sleep(options['pause'])
+                return latency
+
+            with ThreadPoolExecutor(options['clients']) as clients:
+                latencies = list(clients.map(ask, range(options['queries'])))
+            stats, total = reranker.stats(), options['queries']
+            self.stdout.write(
+                f"{budget:>10.0f} {stats['scored'] / total:>8.1%} {stats['timeouts'] / total:>10.1%} "
+                f"{stats['skipped'] / total:>8.1%} {np.percentile(latencies, 50):>7.1f} {np.percentile(latencies, 99):>7.1f}"
+            )
+
+    @staticmethod
+    def _corpus(options):
+        """Pages drawn around topics, each split into chunks that overlap
+        their neighbours and so embed close to the page (cosine ~0.96 with
+        each other), as overlapping windows of one page do
+        """
+        rng = np.random.default_rng(0)
+        dimension, per_page = options['dimension'], options['chunks_per_page']
+        topics = rng.standard_normal((max(1, options['pages'] // 50), dimension)).astype(np.float32)
+        pages = topics[rng.integers(0, len(topics), options['pages'])]
+        pages = pages + 0.6 * rng.standard_normal(pages.shape).astype(np.float32)
+        faiss.normalize_L2(pages)
+        chunk_pages = np.repeat(np.arange(options['pages']), per_page)
+        noise = rng.standard_normal((len(chunk_pages), dimension)).astype(np.float32)
+        chunks = (pages[chunk_pages] + 0.2 / np.sqrt(dimension) * noise).astype(np.float32)
+        faiss.normalize_L2(chunks)
+        return pages, chunk_pages, chunks
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from myapp.services.index_store import IndexStore, process_memory
+from myapp.services.index_writer import IndexWriter
+from myapp.benchmarks.synthetic import random_embeddings, queries_near, tenant_assignment
+
+QUERIES_FILE = 'queries.npy'
+
+
+class Command(BaseCommand):
+    help = ("Benchmark serving index load time and per-worker memory with several worker processes "
+            "holding the index at once: read into private memory vs. memory-mapped and shared")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=200_000)
+        parser.add_argument('--dimension', type=int, default=768)
+        parser.add_argument('--index-type', default='hnsw')
+        parser.add_argument('--storage', default='float32')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--top-k', type=int, default=5)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-shared-')
+        # Like gunicorn, workers are forked; FAISS only ever runs in the
+        # children, as OpenMP does not survive a fork after it started
+        context = multiprocessing.get_context('fork')
+        try:
+            with override_settings(VECTOR_INDEX_TYPE=options['index_type'], VECTOR_INDEX_STORAGE=options['storage']):
+                builder = context.Process(target=_build, args=(directory, options))
+                builder.start()
+                builder.join()
+            index_mb = sum(
+                os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+                if name.startswith('index.') and not os.path.islink(os.path.join(directory, name))
+            ) / 2**20
+            self.stdout.write(
+                f"{options['vectors']} vectors, dim {options['dimension']}, {options['index_type']} "
+                f"({options['storage']}) index of {index_mb:.0f} MB, {options['workers']} workers; "
+                f"memory is each worker's growth from loading and querying the index"
+            )
+            self.stdout.write(
+                f"{'mode':>6} {'load ms':>8} {'1st q ms':>9} {'q ms':>6} {'RSS MB':>7} {'PSS MB':>7} "
+                f"{'private MB':>10} {'total PSS MB':>12}"
+            )
+            for mmap in (False, True):
+                barrier = context.Barrier(options['workers'])
+                queue = context.Queue()
+                workers = [
+                    context.Process(target=_serve, args=(directory, mmap, options['top_k'], barrier, queue))
+                    for _ in range(options['workers'])
+                ]
+                for worker in workers:
+                    worker.start()
+                results = [queue.get() for _ in workers]
+                for worker in workers:
+                    worker.join()
+                load, first, query, rss, pss, private = (np.mean(column) for column in zip(*results))
+                self.stdout.write(
+                    f"{'mmap' if mmap else 'read':>6} {load * 1000:>8.1f} {first * 1000:>9.2f} {query * 1000:>6.2f} "
+                    f"{rss / 2**20:>7.1f} {pss / 2**20:>7.1f} {private / 2**20:>10.1f} "
+                    f"{pss * len(results) / 2**20:>12.1f}"
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _build(directory: str, options: dict):
+    n = options['vectors']
+    vectors = random_embeddings(n, options['dimension'])
+    writer = IndexWriter(directory)
+    document_id = uuid.uuid4()
+    writer.append(vectors, [uuid.uuid4() for _ in range(n)], [document_id] * n, tenant_assignment(n, 10))
+    writer.merge()
+    queries, sources = queries_near(vectors, options['queries'])
+    np.save(os.path.join(directory, QUERIES_FILE), np.column_stack([queries, tenant_assignment(n, 10)[sources]]))
+
+
+def _serve(directory: str, mmap: bool, top_k: int, barrier, queue):
+    queries = np.load(os.path.join(directory, QUERIES_FILE))
+    before = process_memory()
+    with override_settings(VECTOR_INDEX_MMAP=mmap):
+        start = time.perf_counter()
+        snapshot = IndexStore(directory).get_snapshot()
+        load = time.perf_counter() - start
+        latencies = []
+        for row in queries:
+            start = time.perf_counter()
+            snapshot.search(row[:-1].astype(np.float32), top_k, int(row[-1]))
+            latencies.append(time.perf_counter() - start)
+
+    # Measure while every worker holds the index, so shared pages are split
+    barrier.wait()
+    after = process_memory()
+    queue.put((
+        load, latencies[0], np.mean(latencies[1:]),
+        after['rss'] - before['rss'], after['pss'] - before['pss'], after['private'] - before['private'],
+    ))
+    barrier.wait()
@@ -0,0 +1,366 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+import django
+import faiss
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from myapp.models import Document, DocumentChunk, QueryLog
+from myapp.services import index_store, lexical_index
+from myapp.services.document_processor import DocumentProcessor
+from myapp.services.index_store import resident_memory_bytes
+from myapp.services.index_writer import IndexWriter
+from myapp.services.lexical_index import LexicalIndexWriter
+from myapp.services.llm_service import LLMService
+from myapp.services.question_answering import QuestionAnsweringService
+from myapp.services.retrieval_service import RetrievalService
+from myapp.services.tracing import trace
+from myapp.benchmarks.providers import FakeChatModel, HashedWordEmbeddings
+from myapp.benchmarks.synthetic import exact_top_k
+
+# Settings that change what the suite measures, recorded with the results
+RECORDED_SETTINGS = (
+    'VECTOR_INDEX_TYPE', 'CHUNKING_STRATEGY', 'CHUNK_TOKENS', 'CHUNK_OVERLAP_TOKENS', 'INGEST_BATCH_SIZE',
+    'EMBEDDING_BATCH_SIZE', 'HYBRID_SEARCH_ENABLED', 'MMR_ENABLED', 'RETRIEVAL_CANDIDATES', 'CONTEXT_TOKEN_BUDGET',
+)
+# Metrics printed side by side with --compare; higher is better for the first group
+HIGHER_IS_BETTER = ('ingest.chunks_per_second', 'retrieve.recall_at_k', 'retrieve.hit_rate_at_k', 'retrieve.qps')
+LOWER_IS_BETTER = (
+    'index_build.seconds', 'index_load.seconds', 'retrieve.p50_ms', 'retrieve.p99_ms', 'answer.p50_ms',
+    'answer.p99_ms', 'ingest.rss_peak_bytes', 'index_load.rss_growth_bytes',
+)
+
+
+class MemoryWatch:
+    """Resident memory at the start and end of a block and its peak in
+    between, sampled on a background thread
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+
+    def __enter__(self) -> 'MemoryWatch':
+        self.start = self.peak = resident_memory_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.end = resident_memory_bytes()
+        self.peak = max(self.peak, self.end)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, resident_memory_bytes())
+
+    def stats(self) -> dict:
+        return {
+            'rss_start_bytes': self.start, 'rss_peak_bytes': self.peak, 'rss_end_bytes': self.end,
+            'rss_growth_bytes': self.end - self.start,
+        }
+
+
+class Command(BaseCommand):
+    help = ("Reproducible end-to-end benchmark of ingest, index build, retrieval and answering on "
+            "synthetic corpora of 10k to 10M chunks with deterministic fake embedding and LLM "
+            "providers: chunks/sec, query p50/p99, recall@k against exact search, the source "
+            "chunk hit rate, and resident memory per stage, written as JSON for comparing commits")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000', help="Corpus sizes in chunks, e.g. 10000,1000000,10000000")
+        parser.add_argument('--users', type=int, default=10, help="Tenants the documents are spread over")
+        parser.add_argument('--words-per-document', type=int, default=20_000)
+        parser.add_argument('--vocabulary', type=int, default=20_000)
+        parser.add_argument('--dimension', type=int, default=384)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--question-words', type=int, default=8)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='', help="JSON results file (default bench-results/<commit>.json)")
+        parser.add_argument('--compare', default='', help="Earlier results file to compare the headline metrics with")
+
+    def handle(self, *args, **options):
+        commit, dirty = self._commit()
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        results = {
+            'suite': 'bench_suite',
+            'commit': commit,
+            'dirty': dirty,
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(), 'django': django.get_version(), 'numpy': np.__version__,
+                'faiss': getattr(faiss, '__version__', ''), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            },
+            'options': {key: options[key] for key in (
+                'users', 'words_per_document', 'vocabulary', 'dimension', 'queries', 'question_words', 'top_k', 'seed',
+            )},
+            'settings': {name: getattr(settings, name, None) for name in RECORDED_SETTINGS},
+            'runs': [],
+        }
+        for size in sizes:
+            run = self._run(size, options)
+            results['runs'].append(run)
+            self._print_run(run)
+
+        output = options['output'] or os.path.join('bench-results', f"{commit[:12] or 'unknown'}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f"\nResults written to {output}")
+        if options['compare']:
+            with open(options['compare']) as f:
+                self._print_comparison(json.load(f), results)
+
+    def _run(self, size: int, options) -> dict:
+        """One corpus of `size` chunks, in its own database and vector store"""
+        directory = tempfile.mkdtemp(prefix='bench-suite-')
+        # A database file rather than SQLite's in-memory test database, so
+        # its pages are not counted as the process's memory
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        test_name = test_settings.get('NAME')
+        test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        embeddings = HashedWordEmbeddings(dimension=options['dimension'])
+        os.makedirs(os.path.join(directory, 'vector_db'))
+        overrides = override_settings(
+            VECTOR_DB_PATH=os.path.join(directory, 'vector_db'),
+            MEDIA_ROOT=os.path.join(directory, 'media'),
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            EMBEDDING_CACHE_ENABLED=False,
+            QUERY_EMBEDDING_CACHE_SIZE=0,
+            SEMANTIC_CACHE_ENABLED=False,
+        )
+        overrides.enable()
+        index_store._store = lexical_index._store = None
+        try:
+            stages = {}
+            users = [User.objects.create_user(username=f'bench-{i}', password='bench') for i in range(options['users'])]
+            stages['ingest'] = self._ingest(size, users, embeddings, options)
+
+            with MemoryWatch() as memory:
+                start = time.perf_counter()
+                IndexWriter().merge()
+                while LexicalIndexWriter().merge():
+                    pass
+                seconds = time.perf_counter() - start
+            stages['index_build'] = {'seconds': seconds, **memory.stats()}
+
+            with MemoryWatch() as memory:
+                start = time.perf_counter()
+                retrieval = RetrievalService(embedding_model=embeddings)
+                snapshot = retrieval.index_store.warm()
+                retrieval.lexical_store.get_snapshot()
+                seconds = time.perf_counter() - start
+            stages['index_load'] = {'seconds': seconds, 'vectors': snapshot.ntotal, **memory.stats()}
+
+            questions = self._questions(snapshot, options)
+            stages['retrieve'] = self._retrieve(retrieval, snapshot, questions, options['top_k'])
+            stages['answer'] = self._answer(retrieval, users, questions)
+            return {
+                'chunks': stages['ingest']['chunks'],
+                'documents': stages['ingest']['documents'],
+                'stages': stages,
+            }
+        finally:
+            overrides.disable()
+            index_store._store = lexical_index._store = None
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            if test_name is None:
+                test_settings.pop('NAME', None)
+            else:
+                test_settings['NAME'] = test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _ingest(self, size: int, users, embeddings, options) -> dict:
+        """Upload and process txt documents until `size` chunks are indexed,
+        the way process_document_task does; only processing is timed
+        """
+        rng = np.random.default_rng(options['seed'])
+        vocabulary = [f'term{i}' for i in range(options['vocabulary'])]
+        # Zipf-distributed word frequencies, as in natural text
+        cumulative = np.cumsum(1.0 / np.arange(1, len(vocabulary) + 1))
+        cumulative /= cumulative[-1]
+        processor = DocumentProcessor(embedding_model=embeddings)
+        chunks = documents = 0
+        seconds = 0.0
+        with MemoryWatch() as memory, trace() as timings:
+            while chunks < size:
+                document = Document(title=f'bench-{documents}', document_type='txt', uploaded_by=users[documents % len(users)])
+                text = self._text(rng, vocabulary, cumulative, options['words_per_document'])
+                document.file.save(f'bench-{documents}.txt', ContentFile(text.encode()), save=False)
+                document.save()
+
+                start = time.perf_counter()
+                # process_document prints a line per embedded batch
+                with contextlib.redirect_stdout(io.StringIO()) as printed:
+                    processed = processor.process_document(document)
+                seconds += time.perf_counter() - start
+                if not processed:
+                    raise CommandError(f"Processing {document.title} failed: {printed.getvalue().strip()}")
+                chunks += document.total_chunks
+                documents += 1
+        return {
+            'chunks': chunks, 'documents': documents, 'seconds': seconds, 'chunks_per_second': chunks / seconds,
+            'stage_seconds': timings, **memory.stats(),
+        }
+
+    @staticmethod
+    def _text(rng, vocabulary, cumulative, words: int) -> str:
+        ids = np.searchsorted(cumulative, rng.random(words))
+        lengths = rng.integers(8, 21, words // 8 + 1)
+        sentences, position = [], 0
+        for length in lengths:
+            if position >= words:
+                break
+            sentences.append(' '.join(vocabulary[i] for i in ids[position:position + length]).capitalize() + '.')
+            position += length
+        return '\n\n'.join(' '.join(sentences[i:i + 6]) for i in range(0, len(sentences), 6))
+
+    @staticmethod
+    def _questions(snapshot, options) -> list:
+        """(question, user ID, source chunk ID): a few distinct words of a
+        random indexed chunk, asked by the chunk's owner
+        """
+        rng = np.random.default_rng(options['seed'] + 1)
+        positions = rng.choice(snapshot.ntotal, min(options['queries'], snapshot.ntotal), replace=False)
+        chunk_ids = snapshot.id_map.chunk_ids_at(positions)
+        contents = dict(DocumentChunk.objects.filter(id__in=chunk_ids).values_list('id', 'content'))
+        questions = []
+        for position, chunk_id in zip(positions, chunk_ids):
+            words = sorted(set(contents[chunk_id].lower().replace('.', '').split()))
+            picked = rng.choice(words, min(options['question_words'], len(words)), replace=False)
+            questions.append((' '.join(picked) + '?', int(snapshot.id_map.user_ids[position]), chunk_id))
+        return questions
+
+    @staticmethod
+    def _retrieve(retrieval: RetrievalService, snapshot, questions, top_k: int) -> dict:
+        """Latency of retrieve_relevant_chunks and how often it returns the
+        question's source chunk, plus recall@k of the vector index search
+        against exact search over the user's vectors
+        """
+        latencies, hits = [], 0
+        with MemoryWatch() as memory:
+            for question, user_id, chunk_id in questions:
+                start = time.perf_counter()
+                relevant_chunks = retrieval.retrieve_relevant_chunks(question, user_id, top_k=top_k)
+                latencies.append(time.perf_counter() - start)
+                hits += any(chunk.id == chunk_id for chunk, _ in relevant_chunks)
+
+        found, expected = 0, 0
+        by_user = {}
+        for question, user_id, _ in questions:
+            by_user.setdefault(user_id, []).append(retrieval.embed_query(question).reshape(-1))
+        for user_id, queries in by_user.items():
+            positions = snapshot.user_positions(user_id)
+            exact = exact_top_k(np.ascontiguousarray(snapshot.vectors_at(positions)), np.stack(queries), top_k)
+            for query, neighbours in zip(queries, exact):
+                want = set(positions[neighbours[neighbours >= 0]].tolist())
+                found += len(want & set(snapshot.search(query, top_k, user_id)[1].tolist()))
+                expected += len(want)
+
+        latencies = np.array(latencies) * 1000
+        return {
+            'queries': len(questions), 'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)), 'qps': len(latencies) / (latencies.sum() / 1000),
+            'recall_at_k': found / expected if expected else 1.0, 'hit_rate_at_k': hits / len(questions),
+            **memory.stats(),
+        }
+
+    @staticmethod
+    def _answer(retrieval: RetrievalService, users, questions) -> dict:
+        """End-to-end answer latency with an instant fake LLM, and the mean
+        seconds per stage from the QueryLog stage timings
+        """
+        service = QuestionAnsweringService(retrieval_service=retrieval, llm_service=LLMService(llm=FakeChatModel()))
+        users = {user.id: user for user in users}
+        latencies = []
+        with MemoryWatch() as memory:
+            for question, user_id, _ in questions:
+                start = time.perf_counter()
+                service.answer(users[user_id], question)
+                latencies.append(time.perf_counter() - start)
+        stage_seconds = {}
+        logged = list(QueryLog.objects.values_list('stage_timings', flat=True))
+        for timings in logged:
+            for stage, seconds in timings.items():
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds / len(logged)
+        latencies = np.array(latencies) * 1000
+        return {
+            'queries': len(questions), 'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)), 'mean_stage_seconds': stage_seconds, **memory.stats(),
+        }
+
+    def _print_run(self, run: dict):
+        stages = run['stages']
+        ingest, retrieve, answer = stages['ingest'], stages['retrieve'], stages['answer']
+        self.stdout.write(f"\n{run['chunks']} chunks in {run['documents']} documents")
+        self.stdout.write(f"{'stage':>12} {'seconds':>8} {'peak MB':>8} {'+MB':>7}  result")
+        rows = (
+            ('ingest', ingest['seconds'], f"{ingest['chunks_per_second']:.0f} chunks/s"),
+            ('index_build', stages['index_build']['seconds'], ''),
+            ('index_load', stages['index_load']['seconds'], f"{stages['index_load']['vectors']} vectors"),
+            ('retrieve', None, f"p50 {retrieve['p50_ms']:.1f} ms, p99 {retrieve['p99_ms']:.1f} ms, "
+                               f"recall@k {retrieve['recall_at_k']:.3f}, hit rate {retrieve['hit_rate_at_k']:.3f}"),
+            ('answer', None, f"p50 {answer['p50_ms']:.1f} ms, p99 {answer['p99_ms']:.1f} ms"),
+        )
+        for name, seconds, result in rows:
+            stage = stages[name]
+            self.stdout.write(
+                f"{name:>12} {'' if seconds is None else f'{seconds:.2f}':>8} {stage['rss_peak_bytes'] / 2**20:>8.0f} "
+                f"{stage['rss_growth_bytes'] / 2**20:>7.0f}  {result}"
+            )
+
+    def _print_comparison(self, before: dict, after: dict):
+        self.stdout.write(f"\nCompared with {before.get('commit', '')[:12]} ({before.get('created_at', '')})")
+        if before.get('settings') != after['settings'] or before.get('options') != after['options']:
+            self.stdout.write("Settings or options differ between the runs")
+        self.stdout.write(f"{'chunks':>9} {'metric':>30} {'before':>12} {'after':>12} {'change':>8}")
+        earlier = {run['chunks']: run for run in before.get('runs', [])}
+        for run in after['runs']:
+            previous = earlier.get(run['chunks'])
+            if previous is None:
+                continue
+            for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+                old, new = self._metric(previous, metric), self._metric(run, metric)
+                if old is None or new is None:
+                    continue
+                change = (new - old) / old * 100 if old else 0.0
+                better = change >= 0 if metric in HIGHER_IS_BETTER else change <= 0
+                marker = '' if abs(change) < 5 or better else ' !'
+                self.stdout.write(f"{run['chunks']:>9} {metric:>30} {old:>12.4g} {new:>12.4g} {change:>+7.1f}%{marker}")
+
+    @staticmethod
+    def _metric(run: dict, metric: str):
+        stage, name = metric.split('.')
+        return run['stages'].get(stage, {}).get(name)
+
+    @staticmethod
+    def _commit():
+        """(HEAD commit, whether tracked files have uncommitted changes)"""
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+            status = subprocess.run(
+                ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return '', False
+        return commit, bool(status.strip())
@@ -0,0 +1,77 @@
+import time
+import numpy as np
+import faiss
+from django.core.management.base import BaseCommand
+from myapp.services import index_store
+from myapp.services.index_store import IndexSnapshot
+from myapp.services.id_map import VectorIdMap, UUID_DTYPE
+from myapp.benchmarks.synthetic import random_embeddings, queries_near, tenant_assignment, recall_at_k
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-user recall and latency of vector search as the number of tenants grows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=100_000)
+        parser.add_argument('--dimension', type=int, default=768)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--tenants', default='1,10,100,1000,10000')
+
+    def handle(self, *args, **options):
+        n, dimension, k = options['vectors'], options['dimension'], options['top_k']
+        vectors = random_embeddings(n, dimension)
+        index = faiss.IndexFlatIP(dimension)
+        index.add(vectors)
+
+        self.stdout.write(f"{n} vectors, dim {dimension}, top_k {k}, {options['queries']} queries")
+        self.stdout.write(f"{'tenants':>8} {'strategy':>12} {'recall':>7} {'hits/q':>7} {'p50 ms':>8} {'p99 ms':>8}")
+
+        for tenants in [int(t) for t in options['tenants'].split(',')]:
+            owners = tenant_assignment(n, tenants)
+            snapshot = IndexSnapshot(
+                index=index,
+                id_map=VectorIdMap(np.empty(n, dtype=UUID_DTYPE), np.empty(n, dtype=UUID_DTYPE), owners.astype(np.int32)),
+                generation=(), load_seconds=0.0, load_rss_bytes=0,
+            )
+
+            # Each query comes from the owner of a random vector, near that vector
+            queries, sources = queries_near(vectors, options['queries'])
+            users = [int(owners[i]) for i in sources]
+            expected = []
+            for query, user in zip(queries, users):
+                positions = snapshot.user_positions(user)
+                scores = vectors[positions] @ query
+                expected.append(positions[np.argsort(-scores)[:k]])
+
+            strategies = {
+                'post_filter': lambda q, u: self._post_filter(snapshot, q, u, k),
+                'subset': lambda q, u: snapshot.search(q, k, u)[1],
+                'selector': lambda q, u: self._with_selector(snapshot, q, u, k),
+            }
+            for name, search in strategies.items():
+                found, latencies = [], []
+                for query, user in zip(queries, users):
+                    start = time.perf_counter()
+                    found.append(list(search(query.reshape(1, -1), user)))
+                    latencies.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f"{tenants:>8} {name:>12} {recall_at_k(found, expected):>7.3f} "
+                    f"{np.mean([len(f) for f in found]):>7.2f} "
+                    f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}"
+                )
+
+    @staticmethod
+    def _post_filter(snapshot, query, user, k):
+        """The previous behaviour: global top_k, then drop other tenants' rows"""
+        _, indices = snapshot.index.search(query, k)
+        return [i for i in indices[0] if i >= 0 and snapshot.id_map.user_ids[i] == user]
+
+    @staticmethod
+    def _with_selector(snapshot, query, user, k):
+        limit = index_store.SUBSET_SEARCH_MAX_VECTORS
+        index_store.SUBSET_SEARCH_MAX_VECTORS = -1
+        try:
+            return snapshot.search(query, k, user)[1]
+        finally:
+            index_store.SUBSET_SEARCH_MAX_VECTORS = limit
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from myapp.services import metrics, tracing
+from myapp.services.metrics import MetricsRegistry, render
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the tracing layer: cost of a span outside and inside a request trace, "
+            "of the periodic metrics file flush, and of merging and rendering /metrics for "
+            "many worker processes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spans', type=int, default=200_000)
+        parser.add_argument('--stages', type=int, default=10, help="Distinct stage names")
+        parser.add_argument('--processes', default='1,16,64', help="Worker metrics files to merge")
+        parser.add_argument('--scrapes', type=int, default=50)
+
+    def handle(self, *args, **options):
+        n, stages = options['spans'], [f'stage_{i}' for i in range(options['stages'])]
+        with tempfile.TemporaryDirectory(prefix='bench-metrics-') as directory:
+            # Flushing is measured on its own below
+            registry = MetricsRegistry(directory, flush_interval=3600)
+            tracing.get_metrics = lambda: registry
+
+            start = time.perf_counter()
+            for i in range(n):
+                pass
+            baseline = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i in range(n):
+                with tracing.span(stages[i % len(stages)]):
+                    pass
+            untraced = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with tracing.trace():
+                for i in range(n):
+                    with tracing.span(stages[i % len(stages)]):
+                        pass
+            traced = time.perf_counter() - start
+
+            flushes = []
+            for _ in range(100):
+                start = time.perf_counter()
+                registry.flush()
+                flushes.append((time.perf_counter() - start) * 1e6)
+
+            self.stdout.write(f"{n} spans over {len(stages)} stages")
+            self.stdout.write(f"{'':>24} {'ns/span':>8}")
+            self.stdout.write(f"{'span, no request trace':>24} {(untraced - baseline) / n * 1e9:>8.0f}")
+            self.stdout.write(f"{'span in a request trace':>24} {(traced - baseline) / n * 1e9:>8.0f}")
+            self.stdout.write(
+                f"metrics file flush (every METRICS_FLUSH_INTERVAL s): p50 {np.percentile(flushes, 50):.0f} us, "
+                f"p99 {np.percentile(flushes, 99):.0f} us"
+            )
+
+            self.stdout.write(f"\n{'processes':>10} {'scrape p50 ms':>14} {'scrape p99 ms':>14} {'bytes':>8}")
+            registry.flush()
+            own = os.path.join(directory, registry._file_name)
+            # The fake workers' files must not be archived as exited processes
+            metrics.process_alive = lambda pid, start: True
+            for processes in [int(p) for p in options['processes'].split(',')]:
+                # Other workers' files are copies of this process's
+                with open(own) as f:
+                    data = f.read()
+                for pid in range(processes - 1):
+                    with open(os.path.join(directory, f'{metrics.HOST_NAME}-{10_000_000 + pid}-0.json'), 'w') as f:
+                        f.write(data)
+                latencies = []
+                for _ in range(options['scrapes']):
+                    start = time.perf_counter()
+                    histograms, counters = registry.collect()
+                    text = render(histograms, counters, {}, {})
+                    latencies.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f"{processes:>10} {np.percentile(latencies, 50):>14.2f} {np.percentile(latencies, 99):>14.2f} {len(text):>8}"
+                )
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import time
+import numpy as np
+import faiss
+from django.core.management.base import BaseCommand
+from myapp.services import index_factory
+from myapp.services.index_store import IndexSnapshot
+from myapp.services.id_map import VectorIdMap, UUID_DTYPE
+from myapp.benchmarks.synthetic import random_embeddings, queries_near, exact_top_k, recall_at_k
+
+
+class Command(BaseCommand):
+    help = ("Benchmark index memory (bytes/vector), recall@k and queries/sec of each vector storage "
+            "(float32, fp16, SQ8, PQ) with and without re-ranking against the exact vectors on disk")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vectors', type=int, default=200_000)
+        parser.add_argument('--dimension', type=int, default=768)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--index-type', default='flat', choices=index_factory.INDEX_TYPES)
+        parser.add_argument('--storages', default=','.join(index_factory.STORAGE_TYPES))
+        parser.add_argument('--rerank-factors', default='1,4,16')
+
+    def handle(self, *args, **options):
+        n, dimension, k = options['vectors'], options['dimension'], options['top_k']
+        vectors = random_embeddings(n, dimension)
+        queries, _ = queries_near(vectors, options['queries'])
+        expected = exact_top_k(vectors, queries, k)
+
+        with tempfile.TemporaryDirectory(prefix='bench-storage-') as directory:
+            # Re-ranking reads a memory-mapped vector log, as serving does
+            log_path = os.path.join(directory, 'vectors.f32')
+            vectors.tofile(log_path)
+            vector_log = np.memmap(log_path, dtype=np.float32, mode='r', shape=vectors.shape)
+            id_map = VectorIdMap(np.empty(n, dtype=UUID_DTYPE), np.empty(n, dtype=UUID_DTYPE), np.ones(n, dtype=np.int32))
+
+            self.stdout.write(
+                f"{n} vectors, dim {dimension}, {options['index_type']} index, recall@{k} over {len(queries)} "
+                f"queries; exact vectors on disk: {4 * dimension} B/vector"
+            )
+            self.stdout.write(
+                f"{'storage':>8} {'rerank':>6} {'build s':>8} {'B/vector':>9} {'recall':>7} {'QPS':>7} {'p99 ms':>8}"
+            )
+            for storage in options['storages'].split(','):
+                start = time.perf_counter()
+                index = index_factory.build_index(vectors, options['index_type'], storage)
+                build_seconds = time.perf_counter() - start
+                bytes_per_vector = len(faiss.serialize_index(index)) / n
+                snapshot = IndexSnapshot(
+                    index=index, id_map=id_map, vectors=vector_log,
+                    generation=(), load_seconds=0.0, load_rss_bytes=0,
+                )
+                factors = [int(f) for f in options['rerank_factors'].split(',')] if snapshot.lossy else [1]
+                for factor in factors:
+                    found, latencies = [], []
+                    for query in queries:
+                        t = time.perf_counter()
+                        _, positions = snapshot.search(query, k, 1, rerank_factor=factor)
+                        latencies.append(time.perf_counter() - t)
+                        found.append(list(positions))
+                    self.stdout.write(
+                        f"{storage:>8} {factor if factor > 1 else '-':>6} {build_seconds:>8.1f} {bytes_per_vector:>9.0f} "
+                        f"{recall_at_k(found, expected):>7.3f} {len(latencies) / sum(latencies):>7.0f} "
+                        f"{np.percentile(latencies, 99) * 1000:>8.2f}"
+                    )
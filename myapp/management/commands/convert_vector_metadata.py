@@ -0,0 +1,51 @@
+import os
+import pickle
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.models import DocumentChunk
+from myapp.services.id_map import VectorIdMap
+
+# Placeholder document ID for vectors whose chunk no longer exists
+MISSING_DOCUMENT_ID = uuid.UUID(int=0)
+
+
+class Command(BaseCommand):
+    help = "Convert the legacy pickled metadata.pkl into the memory-mapped vector ID map"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = settings.VECTOR_DB_PATH
+        metadata_path = os.path.join(path, 'metadata.pkl')
+        if not os.path.exists(metadata_path):
+            self.stdout.write("No metadata.pkl found; nothing to convert.")
+            return
+        if VectorIdMap.row_count(path) > 0:
+            self.stdout.write("Vector ID map already exists; leaving metadata.pkl untouched.")
+            return
+
+        with open(metadata_path, 'rb') as f:
+            metadata = pickle.load(f)
+        chunk_ids = metadata['chunk_ids']
+
+        # metadata['document_ids'] held one entry per document, not per
+        # vector, so recover each vector's document from its chunk instead
+        document_ids = {}
+        batch_size = options['batch_size']
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[start:start + batch_size]
+            document_ids.update(
+                (str(chunk_id), document_id)
+                for chunk_id, document_id in DocumentChunk.objects.filter(id__in=batch).values_list('id', 'document_id')
+            )
+
+        rows = VectorIdMap.append(
+            path,
+            chunk_ids=chunk_ids,
+            document_ids=[document_ids.get(str(chunk_id), MISSING_DOCUMENT_ID) for chunk_id in chunk_ids],
+            user_ids=[int(user_id) for user_id in metadata['user_ids']],
+        )
+        os.replace(metadata_path, metadata_path + '.bak')
+        self.stdout.write(f"Converted {rows} vectors; old metadata kept as metadata.pkl.bak")
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.services.embedding_cache import CachedEmbeddings
+
+
+class Command(BaseCommand):
+    help = "Show embedding cache hit rate and the provider calls and spend it saved"
+
+    def handle(self, *args, **options):
+        stats = CachedEmbeddings(provider=None, model_name=settings.EMBEDDING_MODEL).stats()
+        self.stdout.write(f"Hit rate:              {stats['hit_rate']:.1%} ({stats['hits']} hits, {stats['misses']} misses)")
+        self.stdout.write(f"Provider calls made:   {stats['provider_calls']}")
+        self.stdout.write(f"Provider calls saved:  {stats['skipped_calls']}")
+        self.stdout.write(f"Tokens saved (est.):   {stats['tokens_saved']}")
+        self.stdout.write(f"Dollars saved (est.):  ${stats['dollars_saved']:.4f}")
@@ -0,0 +1,128 @@
+import asyncio
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from myapp.models import Document
+from myapp.services import index_store, lexical_index
+from myapp.services.chunking import get_chunker
+from myapp.services.document_processor import DocumentProcessor
+from myapp.services.llm_service import LLMService
+from myapp.services.question_answering import QuestionAnsweringService
+from myapp.services.retrieval_service import RetrievalService
+from myapp.services.tokens import count_tokens
+from myapp.benchmarks.providers import FakeChatModel, FakeEmbeddings
+
+
+class Command(BaseCommand):
+    help = ("Load-test the question-answering path with stubbed embedding and LLM providers: "
+            "requests/sec of the async path versus a fixed pool of sync workers")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='10,100,1000')
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per run")
+        parser.add_argument('--sync-workers', type=int, default=9, help="Sync workers, like gunicorn --workers")
+        parser.add_argument('--embed-latency', type=float, default=0.05)
+        parser.add_argument('--llm-latency', type=float, default=0.5)
+        parser.add_argument('--chunks', type=int, default=200)
+
+    def handle(self, *args, **options):
+        vector_db_path = tempfile.mkdtemp(prefix='loadtest-vdb-')
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        # Every request should reach the stubbed providers rather than the
+        # answer cache or the question embedding cache
+        overrides = override_settings(
+            VECTOR_DB_PATH=vector_db_path,
+            MEDIA_ROOT=vector_db_path,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            QUERY_EMBEDDING_CACHE_SIZE=0,
+        )
+        overrides.enable()
+        index_store._store = lexical_index._store = None
+        try:
+            user, questions = self._seed(options['chunks'])
+            embeddings = FakeEmbeddings(latency=options['embed_latency'])
+            service = QuestionAnsweringService(
+                retrieval_service=RetrievalService(embedding_model=embeddings),
+                llm_service=LLMService(llm=FakeChatModel(latency=options['llm_latency'])),
+            )
+            service.retrieval_service.index_store.warm()
+
+            self.stdout.write(
+                f"embed {options['embed_latency'] * 1000:.0f} ms, LLM {options['llm_latency'] * 1000:.0f} ms, "
+                f"{options['sync_workers']} sync workers, {options['duration']:.0f} s per run"
+            )
+            self.stdout.write(f"{'clients':>8} {'mode':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+            for clients in [int(c) for c in options['clients'].split(',')]:
+                for mode in ('sync', 'async'):
+                    latencies, errors = asyncio.run(
+                        self._run(service, user, questions, mode, clients, options['duration'], options['sync_workers'])
+                    )
+                    latencies.sort()
+                    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+                    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+                    self.stdout.write(
+                        f"{clients:>8} {mode:>6} {len(latencies) / options['duration']:>8.1f} "
+                        f"{p50:>8.0f} {p99:>8.0f} {errors:>7}"
+                    )
+        finally:
+            overrides.disable()
+            index_store._store = lexical_index._store = None
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            shutil.rmtree(vector_db_path, ignore_errors=True)
+
+    def _seed(self, n_chunks: int):
+        """One user with one document processed like an upload; questions
+        repeat chunk texts so each one retrieves
+        """
+        user = User.objects.create_user(username='loadtest', password='loadtest')
+        texts = [f"Load test passage {i} about topic {i % 17}." for i in range(n_chunks)]
+        document = Document(title='Load test', document_type='txt', uploaded_by=user)
+        document.file.save('loadtest.txt', ContentFile('\n\n'.join(texts).encode()), save=False)
+        document.save()
+        # Chunks of one passage each
+        chunker = get_chunker('recursive', chunk_tokens=max(count_tokens(text) for text in texts), overlap_tokens=0)
+        if not DocumentProcessor(embedding_model=FakeEmbeddings(), chunker=chunker).process_document(document):
+            raise RuntimeError("Could not process the load test document")
+        return user, list(document.chunks.order_by('chunk_index').values_list('content', flat=True))
+
+    async def _run(self, service, user, questions, mode, clients, duration, sync_workers):
+        """Closed loop: each client asks again as soon as its answer arrives.
+
+        Sync requests queue for a fixed pool of threads, the way requests
+        queue for gunicorn sync workers; async requests run on the event loop.
+        """
+        latencies, errors = [], 0
+        pool = ThreadPoolExecutor(max_workers=sync_workers) if mode == 'sync' else None
+        loop = asyncio.get_running_loop()
+
+        async def client(i):
+            nonlocal errors
+            n = i
+            while True:
+                question = questions[n % len(questions)]
+                n += clients
+                start = time.perf_counter()
+                try:
+                    if pool:
+                        await loop.run_in_executor(pool, service.answer, user, question)
+                    else:
+                        await service.aanswer(user, question)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        tasks = [asyncio.create_task(client(i)) for i in range(clients)]
+        await asyncio.sleep(duration)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+        return latencies, errors
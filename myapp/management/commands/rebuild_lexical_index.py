@@ -0,0 +1,42 @@
+import os
+import shutil
+from itertools import islice
+from django.core.management.base import BaseCommand
+from myapp.models import DocumentChunk
+from myapp.services.lexical_index import LexicalIndexWriter, lexical_dir
+
+
+class Command(BaseCommand):
+    help = ("Build the lexical (BM25) index from every embedded chunk in the database and swap it in, "
+            "e.g. to backfill chunks ingested before hybrid search; pause ingest while it runs")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20000, help="Chunks per segment before merging")
+
+    def handle(self, *args, **options):
+        path = lexical_dir()
+        building = path + '.rebuild'
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        writer = LexicalIndexWriter(building)
+
+        chunks = (
+            DocumentChunk.objects.filter(embedding_stored=True)
+            .values_list('id', 'document__uploaded_by_id', 'content')
+            .iterator(chunk_size=options['batch_size'])
+        )
+        total = 0
+        while batch := list(islice(chunks, options['batch_size'])):
+            chunk_ids, user_ids, texts = zip(*batch)
+            total += writer.add(chunk_ids, user_ids, texts)
+            while writer.needs_merge():
+                writer.merge()
+
+        # Readers keep the old segments they have mapped until they reload
+        retired = path + '.old'
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, retired)
+        os.replace(building, path)
+        shutil.rmtree(retired, ignore_errors=True)
+        self.stdout.write(f"Indexed {total} chunks")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querylog',
+            name='time_to_first_token',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_querylog_prompt_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querylog',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
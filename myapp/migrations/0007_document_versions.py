@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:02
+
+import hashlib
+from django.db import migrations, models
+
+
+def hash_chunks(apps, schema_editor):
+    """Fingerprint existing chunks as DocumentProcessor does, so the next
+    version of their document can keep them
+    """
+    DocumentChunk = apps.get_model('myapp', 'DocumentChunk')
+    batch = []
+    for chunk in DocumentChunk.objects.filter(content_hash='').only('id', 'content').iterator(chunk_size=2000):
+        chunk.content_hash = hashlib.sha256(' '.join(chunk.content.split()).encode('utf-8')).hexdigest()
+        batch.append(chunk)
+        if len(batch) == 2000:
+            DocumentChunk.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_querylog_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(hash_chunks, migrations.RunPython.noop),
+    ]
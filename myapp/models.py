@@ -7,6 +7,31 @@ from django.db import models
 from django.contrib.auth.models import User
 import uuid
 
+class IngestBatch(models.Model):
+    STATUSES = [
+        ('chunking', 'Chunking'),
+        ('embedding', 'Embedding'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUSES, default='chunking')
+    total_documents = models.IntegerField(default=0)
+    chunked_documents = models.IntegerField(default=0)
+    failed_documents = models.IntegerField(default=0)
+    total_chunks = models.IntegerField(default=0)
+    embedded_chunks = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Batch of {self.total_documents} documents ({self.status})"
+
 class Document(models.Model):
     DOCUMENT_TYPES = [
         ('pdf', 'PDF'),
@@ -23,6 +48,9 @@ class Document(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
     total_chunks = models.IntegerField(default=0)
+    # Bumped by each upload of a new file for the document
+    version = models.PositiveIntegerField(default=1)
+    batch = models.ForeignKey(IngestBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='documents')
     
     class Meta:
         ordering = ['-uploaded_at']
@@ -36,6 +64,13 @@ class DocumentChunk(models.Model):
     content = models.TextField()
     chunk_index = models.IntegerField()
     page_number = models.IntegerField(null=True, blank=True)
+    # UTF-8 byte offsets into the extracted document text
+    start_offset = models.BigIntegerField(null=True, blank=True)
+    end_offset = models.BigIntegerField(null=True, blank=True)
+    token_count = models.IntegerField(null=True, blank=True)
+    # SHA-256 of the whitespace-normalized content; a new version of the
+    # document reuses the vectors of chunks whose hash it still has
+    content_hash = models.CharField(max_length=64, blank=True, default='')
     embedding_stored = models.BooleanField(default=False)
     
     class Meta:
@@ -52,6 +87,12 @@ class QueryLog(models.Model):
     answer = models.TextField()
     sources = models.JSONField(default=list)
     response_time = models.FloatField()  # in seconds
+    time_to_first_token = models.FloatField(null=True, blank=True)  # streamed answers only, in seconds
+    # Estimated prompt size and the time taken to pack its context; empty for cached answers
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    context_packing_time = models.FloatField(null=True, blank=True)  # in seconds
+    # Seconds per stage (embed_query, vector_search, hydrate, llm, ...) and in total
+    stage_timings = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
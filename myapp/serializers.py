@@ -1,7 +1,17 @@
 from rest_framework import serializers
-from .models import Document, QueryLog
+from .models import Document, IngestBatch, QueryLog
 import os
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+
+DOCUMENT_TYPE_BY_EXTENSION = {
+    '.pdf': 'pdf',
+    '.docx': 'docx',
+    '.md': 'md',
+    '.txt': 'txt'
+}
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -26,7 +36,7 @@ class DocumentUploadSerializer(serializers.ModelSerializer):
     
     def validate_file(self, value):
         # Validate file size (max 10MB)
-        if value.size > 100 * 1024 * 1024:
+        if value.size > MAX_UPLOAD_BYTES:
             raise serializers.ValidationError("File size must be less than 100MB")
         
         # Validate file extension
@@ -49,28 +59,48 @@ class DocumentUploadSerializer(serializers.ModelSerializer):
         
         # Extract document type from file extension
         file_extension = os.path.splitext(filename)[1].lower()
-        document_type_mapping = {
-            '.pdf': 'pdf',
-            '.docx': 'docx',
-            '.md': 'md',
-            '.txt': 'txt'
-        }
-        document_type = document_type_mapping.get(file_extension, 'txt')
+        document_type = DOCUMENT_TYPE_BY_EXTENSION.get(file_extension, 'txt')
         
         # Create document with extracted information
         document = Document.objects.create(
             title=title,
             file=file,
             document_type=document_type,
-            uploaded_by=self.context['request'].user
+            uploaded_by=self.context['request'].user,
+            batch=validated_data.get('batch'),
         )
         
         return document
 
+    def update(self, instance, validated_data):
+        """A new version of the document: its file is replaced, its title kept"""
+        file = validated_data['file']
+        instance.file = file
+        instance.document_type = DOCUMENT_TYPE_BY_EXTENSION.get(os.path.splitext(file.name)[1].lower(), 'txt')
+        instance.version += 1
+        instance.processed = False
+        instance.save()
+        # The previous file is deleted by process_document_task once this one is processed
+        return instance
+
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = ['id', 'title', 'document_type', 'uploaded_at', 'processed', 'total_chunks']
+        fields = ['id', 'title', 'document_type', 'uploaded_at', 'processed', 'total_chunks', 'version']
+
+class IngestBatchSerializer(serializers.ModelSerializer):
+    chunks_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = IngestBatch
+        fields = [
+            'id', 'status', 'total_documents', 'chunked_documents', 'failed_documents',
+            'total_chunks', 'embedded_chunks', 'chunks_per_second', 'created_at', 'completed_at',
+        ]
+
+    def get_chunks_per_second(self, batch):
+        elapsed = ((batch.completed_at or timezone.now()) - batch.created_at).total_seconds()
+        return round(batch.embedded_chunks / elapsed, 1) if elapsed > 0 else None
 
 class QuestionSerializer(serializers.Serializer):
     question = serializers.CharField(max_length=1000)
@@ -78,4 +108,5 @@ class QuestionSerializer(serializers.Serializer):
 class QueryLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = QueryLog
-        fields = ['id', 'question', 'answer', 'sources', 'response_time', 'created_at']
+        fields = ['id', 'question', 'answer', 'sources', 'response_time', 'time_to_first_token', 'prompt_tokens',
+                  'context_packing_time', 'stage_timings', 'created_at']
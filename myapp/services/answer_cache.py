@@ -0,0 +1,146 @@
+import logging
+import time
+import numpy as np
+from typing import Iterable, List, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from ..models import DocumentChunk
+from .embedding_cache import increment_counters
+
+logger = logging.getLogger(__name__)
+
+STATS_KEYS = ('hits', 'misses', 'stale')
+
+
+class SemanticAnswerCache:
+    """Reuses a user's recent answers for questions that mean the same thing.
+
+    Each user has one cache entry holding the normalized embeddings of the
+    questions they recently had answered, as a float32 matrix, next to the
+    answers. A new question is compared against all of them with one matrix
+    product and the best match above `threshold` is returned, as long as every
+    chunk the answer was generated from still exists. Chunks are never
+    changed in place: a new version of a document is stored as new chunks
+    and the previous ones are removed once it is processed, so answers built
+    from the previous version (even in the meantime) stop matching then, as
+    do answers built on a deleted document.
+
+    Entries expire after `ttl` seconds and the least recently used are evicted
+    past `max_entries` per user. Concurrent writers for the same user can
+    overwrite each other's additions, which only costs a future miss.
+    """
+
+    def __init__(self, cache_alias: Optional[str] = None, threshold: Optional[float] = None,
+                 ttl: Optional[int] = None, max_entries: Optional[int] = None):
+        self.cache = caches[cache_alias or settings.SEMANTIC_CACHE_ALIAS]
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl = settings.SEMANTIC_CACHE_TTL if ttl is None else ttl
+        self.max_entries = settings.SEMANTIC_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+
+    def lookup(self, user_id: int, question_embedding: np.ndarray) -> Optional[dict]:
+        """Cached {"answer", "sources"} for a similar question, or None"""
+        query = np.asarray(question_embedding, dtype=np.float32).reshape(-1)
+        entries, vectors = self._load(user_id, query.shape[0])
+        if not entries:
+            self._record(misses=1)
+            return None
+
+        scores = vectors @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self._record(misses=1)
+            return None
+
+        entry = entries[best]
+        if not self._chunks_exist(entry.get('chunk_ids', [])):
+            # The supporting documents changed since this answer was cached
+            del entries[best]
+            self._save(user_id, entries, np.delete(vectors, best, axis=0))
+            self._record(misses=1, stale=1)
+            return None
+
+        entry['last_used'] = time.time()
+        self._save(user_id, entries, vectors)
+        self._record(hits=1)
+        return {"answer": entry['answer'], "sources": entry['sources']}
+
+    def store(self, user_id: int, question_embedding: np.ndarray, response: dict, chunk_ids: Iterable):
+        """Cache an answer generated from the chunks `chunk_ids`"""
+        query = np.asarray(question_embedding, dtype=np.float32).reshape(-1)
+        entries, vectors = self._load(user_id, query.shape[0])
+        now = time.time()
+        entries.append({
+            'answer': response['answer'],
+            'sources': response['sources'],
+            'chunk_ids': [str(chunk_id) for chunk_id in chunk_ids],
+            'expires_at': now + self.ttl,
+            'last_used': now,
+        })
+        vectors = np.vstack([vectors, query[None, :]])
+
+        if len(entries) > self.max_entries:
+            keep = np.argsort([-entry['last_used'] for entry in entries], kind='stable')[:self.max_entries]
+            keep.sort()
+            entries = [entries[i] for i in keep]
+            vectors = vectors[keep]
+        self._save(user_id, entries, vectors)
+
+    async def alookup(self, user_id: int, question_embedding: np.ndarray) -> Optional[dict]:
+        return await sync_to_async(self.lookup)(user_id, question_embedding)
+
+    async def astore(self, user_id: int, question_embedding: np.ndarray, response: dict, chunk_ids: Iterable):
+        await sync_to_async(self.store, thread_sensitive=False)(user_id, question_embedding, response, list(chunk_ids))
+
+    def invalidate(self, user_id: int):
+        try:
+            self.cache.delete(self._key(user_id))
+        except Exception:
+            logger.warning("Could not invalidate semantic answer cache", exc_info=True)
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"sac:user:{user_id}"
+
+    def _load(self, user_id: int, dimension: int):
+        """Unexpired entries and their (n, dimension) question matrix"""
+        try:
+            blob = self.cache.get(self._key(user_id))
+        except Exception:
+            logger.warning("Semantic answer cache unavailable", exc_info=True)
+            blob = None
+        # A changed embedding model makes old vectors incomparable
+        if not blob or blob['dimension'] != dimension:
+            return [], np.empty((0, dimension), dtype=np.float32)
+
+        vectors = np.frombuffer(blob['vectors'], dtype=np.float32).reshape(-1, dimension)
+        now = time.time()
+        live = [i for i, entry in enumerate(blob['entries']) if entry['expires_at'] > now]
+        return [blob['entries'][i] for i in live], vectors[live]
+
+    def _save(self, user_id: int, entries: List[dict], vectors: np.ndarray):
+        blob = {'dimension': vectors.shape[1], 'vectors': vectors.astype(np.float32).tobytes(), 'entries': entries}
+        try:
+            self.cache.set(self._key(user_id), blob, self.ttl)
+        except Exception:
+            logger.warning("Could not write to semantic answer cache", exc_info=True)
+
+    @staticmethod
+    def _chunks_exist(chunk_ids: List[str]) -> bool:
+        # Entries cached while document versions were recorded instead have none
+        if not chunk_ids:
+            return False
+        return DocumentChunk.objects.filter(id__in=chunk_ids).count() == len(set(chunk_ids))
+
+    def _record(self, **counts):
+        increment_counters(self.cache, {f"sac:stats:{name}": delta for name, delta in counts.items()})
+
+    def stats(self) -> dict:
+        """Hits, misses and stale matches across all workers"""
+        try:
+            raw = self.cache.get_many([f"sac:stats:{name}" for name in STATS_KEYS])
+        except Exception:
+            raw = {}
+        counts = {name: raw.get(f"sac:stats:{name}", 0) for name in STATS_KEYS}
+        lookups = counts['hits'] + counts['misses']
+        return {**counts, 'hit_rate': counts['hits'] / lookups if lookups else 0.0}
@@ -0,0 +1,161 @@
+import glob
+import logging
+import os
+import shutil
+import uuid
+import zipfile
+import numpy as np
+from typing import Iterable, Iterator, List, Optional, Tuple
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F
+from django.utils import timezone
+from ..models import Document, DocumentChunk, IngestBatch
+from .document_processor import DocumentProcessor
+from .id_map import unpack_uuid, uuid_array
+from .index_writer import IndexWriter
+from .lexical_index import LexicalIndexWriter
+from .metrics import get_metrics
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip',)
+
+
+def expand_uploads(files: Iterable, max_member_bytes: int) -> Iterator[Tuple[Optional[ContentFile], Optional[dict]]]:
+    """Yield (file, None) for each uploaded file, unpacking .zip archives
+    into their members one at a time, or (None, error) for archives and
+    members that cannot be used
+    """
+    for file in files:
+        if os.path.splitext(file.name)[1].lower() not in ARCHIVE_EXTENSIONS:
+            yield file, None
+            continue
+        try:
+            with zipfile.ZipFile(file) as archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or not name or name.startswith('.') or member.filename.startswith('__MACOSX/'):
+                        continue
+                    if member.file_size > max_member_bytes:
+                        yield None, {'file': member.filename, 'error': "File is too large"}
+                        continue
+                    yield ContentFile(archive.read(member), name=name), None
+        except zipfile.BadZipFile:
+            yield None, {'file': file.name, 'error': "Not a valid zip archive"}
+
+
+def staging_dir(batch_id) -> str:
+    return os.path.join(settings.VECTOR_DB_PATH, 'ingest-staging', str(batch_id))
+
+
+def chunk_batch_document(batch_id, document_id) -> Optional[str]:
+    """Extract, chunk and store one document of a batch, counting it in the
+    batch's progress; returns the document ID, or None if it failed
+    """
+    document = Document.objects.get(id=document_id)
+    try:
+        chunks = DocumentProcessor().chunk_document(document)
+    except Exception:
+        logger.exception("Chunking document %s of ingest batch %s failed", document_id, batch_id)
+        document.chunks.all().delete()
+        IngestBatch.objects.filter(id=batch_id).update(failed_documents=F('failed_documents') + 1)
+        return None
+    IngestBatch.objects.filter(id=batch_id).update(
+        chunked_documents=F('chunked_documents') + 1, total_chunks=F('total_chunks') + chunks,
+    )
+    return str(document_id)
+
+
+def embedding_groups(batch_id) -> List[List[str]]:
+    """IDs of the batch's chunks in groups of BULK_EMBED_CHUNKS, filled
+    across document boundaries so small files share provider batches
+    """
+    # Documents that failed to chunk have had their chunks removed
+    chunk_ids = [
+        str(chunk_id) for chunk_id in DocumentChunk.objects.filter(document__batch_id=batch_id)
+        .order_by('document_id', 'chunk_index').values_list('id', flat=True)
+    ]
+    size = settings.BULK_EMBED_CHUNKS
+    return [chunk_ids[start:start + size] for start in range(0, len(chunk_ids), size)]
+
+
+def embed_and_stage(batch_id, part: int, chunk_ids: List[str], embedding_model=None) -> int:
+    """Embed one group of chunks and stage the vectors, with their IDs, in
+    the batch's staging directory for `commit_batch`; returns the chunk count
+    """
+    chunks = list(
+        DocumentChunk.objects.filter(id__in=chunk_ids).select_related('document').order_by('document_id', 'chunk_index')
+    )
+    processor = DocumentProcessor(embedding_model=embedding_model)
+    embeddings = processor.embed_chunks(chunks)
+
+    directory = staging_dir(batch_id)
+    os.makedirs(directory, exist_ok=True)
+    part_path = os.path.join(directory, f'{part:06d}.npz')
+    retried = os.path.exists(part_path)
+    with open(part_path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            vectors=embeddings,
+            chunk_ids=uuid_array(chunk.id for chunk in chunks),
+            document_ids=uuid_array(chunk.document_id for chunk in chunks),
+            user_ids=np.array([chunk.document.uploaded_by_id for chunk in chunks], dtype=np.int64),
+            model=np.array(processor.model_name),
+        )
+    os.replace(part_path + '.tmp', part_path)
+
+    if not retried:
+        IngestBatch.objects.filter(id=batch_id).update(embedded_chunks=F('embedded_chunks') + len(chunks))
+    return len(chunks)
+
+
+def commit_batch(batch_id, document_ids: List[str]) -> int:
+    """Append every staged vector of the batch to the vector store in a
+    single write, and the batch's chunks to the lexical index as one
+    segment, then mark its documents processed. The staged vectors are
+    held in memory together, so BULK_INGEST_MAX_FILES bounds a batch.
+    Returns the number of vectors appended.
+    """
+    directory = staging_dir(batch_id)
+    parts = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.npz'))):
+        with np.load(path) as part:
+            parts.append(dict(part))
+    appended = 0
+    if parts:
+        # Parts embedded by different workers must agree on the model
+        models = {str(part['model']) for part in parts if 'model' in part}
+        if len(models) > 1:
+            raise ValueError(f"Batch {batch_id} was embedded with more than one model: {sorted(models)}")
+        vectors = np.concatenate([part['vectors'] for part in parts])
+        with span('ingest_write'):
+            IndexWriter().append(
+                vectors,
+                chunk_ids=[unpack_uuid(value) for part in parts for value in part['chunk_ids']],
+                document_ids=[unpack_uuid(value) for part in parts for value in part['document_ids']],
+                user_ids=np.concatenate([part['user_ids'] for part in parts]).tolist(),
+                model=models.pop() if models else None,
+            )
+            appended = len(vectors)
+
+            chunks = list(DocumentChunk.objects.filter(document__batch_id=batch_id).values_list(
+                'id', 'document__uploaded_by_id', 'content',
+            ))
+            chunk_ids, user_ids, texts = zip(*chunks) if chunks else ((), (), ())
+            LexicalIndexWriter().add(chunk_ids, user_ids, texts)
+
+    DocumentChunk.objects.filter(document__batch_id=batch_id).update(embedding_stored=True)
+    Document.objects.filter(id__in=document_ids).update(processed=True)
+    get_metrics().inc('vectormind_ingest_documents_total', len(document_ids), result='processed')
+    IngestBatch.objects.filter(id=batch_id).update(
+        status='completed' if document_ids else 'failed', completed_at=timezone.now(),
+    )
+    shutil.rmtree(directory, ignore_errors=True)
+    return appended
+
+
+def fail_batch(batch_id):
+    IngestBatch.objects.filter(id=batch_id).update(status='failed', completed_at=timezone.now())
+    shutil.rmtree(staging_dir(batch_id), ignore_errors=True)
@@ -0,0 +1,176 @@
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .tokens import codepoints, token_spans
+
+# Strength of the gap in front of a token, strongest first: a blank line, the
+# end of a sentence, a line break, plain whitespace, or no gap at all
+PARAGRAPH, SENTENCE, LINE, WORD, NONE = range(5)
+SENTENCE_END = [ord(char) for char in '.!?']
+NEWLINE = ord('\n')
+
+
+class Chunk(NamedTuple):
+    content: str
+    page_number: Optional[int]
+    # UTF-8 byte offsets into the document text (its pages concatenated)
+    start: int
+    end: int
+    token_count: int
+
+
+class FixedTokenChunker:
+    """Splits text into chunks of at most `chunk_tokens` estimated tokens,
+    each chunk repeating up to `overlap_tokens` from the end of the previous
+    one (capped at half the chunk).
+
+    Tokens and the gaps between them are found in one vectorized pass over
+    each page, and every cut moves forward by at least a quarter chunk, so
+    chunking runs in linear time over text of any length and always
+    terminates. Subclasses choose where in a full window to cut and where the overlap
+    starts; this one cuts every `chunk_tokens` tokens.
+    """
+
+    def __init__(self, chunk_tokens: int = 256, overlap_tokens: int = 0):
+        if chunk_tokens < 1:
+            raise ValueError("chunk_tokens must be at least 1")
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("overlap_tokens must be at least 0 and less than chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def chunk_pages(self, pages: Iterable[Tuple[str, int]]) -> Iterator[Chunk]:
+        """Chunk (text, page number) pairs as they stream in; chunks never span pages"""
+        base = 0
+        for text, page_number in pages:
+            starts, ends = _ByteOffsets(text), _ByteOffsets(text)
+            for start, end, token_count in self.split(text):
+                yield Chunk(text[start:end], page_number, base + starts.at(start), base + ends.at(end), token_count)
+            base += ends.at(len(text))
+
+    def split(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield (start, end, token count) for each chunk, as character offsets into `text`"""
+        codes = codepoints(text)
+        starts, ends = token_spans(codes)
+        levels = _gap_levels(codes, starts, ends)
+        boundaries = self._boundaries(levels)
+
+        first = emitted = 0
+        # While tokens remain past a full chunk, a cut right in front of token
+        # `first + chunk_tokens` still gives a full chunk
+        while first + self.chunk_tokens < len(starts):
+            cut = self._cut(first, first + self.chunk_tokens, emitted, boundaries)
+            yield int(starts[first]), int(ends[cut - 1]), cut - first
+            first, emitted = self._overlap_start(levels, first, cut), cut
+
+        if len(starts) > emitted:
+            yield int(starts[first]), int(ends[-1]), len(starts) - first
+
+    def _boundaries(self, levels: np.ndarray) -> Dict[int, np.ndarray]:
+        return {}
+
+    def _cut(self, first: int, index: int, emitted: int, boundaries: Dict[int, np.ndarray]) -> int:
+        """Index of the token the chunk starting at token `first` ends in front of"""
+        return index
+
+    def _overlap_start(self, levels: np.ndarray, first: int, cut: int) -> int:
+        """Index of the first token of the chunk after tokens [first, cut)"""
+        return cut - min(self.overlap_tokens, (cut - first) // 2)
+
+
+class RecursiveChunker(FixedTokenChunker):
+    """Cuts at the strongest kind of boundary found in the second half of the
+    window (paragraph, then sentence, line and word), like a recursive
+    separator splitter, and starts the overlap on a boundary too
+    """
+
+    # Gap levels tried in turn; each also accepts any stronger gap
+    cut_levels = (PARAGRAPH, SENTENCE, LINE, WORD)
+
+    def _boundaries(self, levels):
+        # Tokens a chunk may start at, for each level tried
+        return {level: np.flatnonzero(levels <= level) for level in self.cut_levels}
+
+    def _cut(self, first, index, emitted, boundaries):
+        earliest = max(first + max(1, self.chunk_tokens // 2), emitted + 1)
+        for level in self.cut_levels:
+            candidates = boundaries[level]
+            latest = np.searchsorted(candidates, index, side='right') - 1
+            if latest >= 0 and candidates[latest] >= earliest:
+                return int(candidates[latest])
+        return index
+
+    def _overlap_start(self, levels, first, cut):
+        start = super()._overlap_start(levels, first, cut)
+        if start == cut:
+            return cut
+        # Earliest of the strongest gaps in the overlap, so it does not begin mid-word
+        strongest = int(np.argmin(levels[start:cut]))
+        return start + strongest if levels[start + strongest] <= WORD else start
+
+
+class SentenceChunker(RecursiveChunker):
+    """Packs whole sentences (paragraph breaks count as sentence ends) into
+    each chunk, falling back to a word boundary for sentences longer than
+    half a chunk
+    """
+
+    cut_levels = (SENTENCE, WORD)
+
+
+CHUNKERS = {
+    'fixed': FixedTokenChunker,
+    'sentence': SentenceChunker,
+    'recursive': RecursiveChunker,
+}
+
+
+def get_chunker(strategy: Optional[str] = None, chunk_tokens: Optional[int] = None,
+                overlap_tokens: Optional[int] = None) -> FixedTokenChunker:
+    """Instantiate a chunker by strategy name ('fixed', 'sentence',
+    'recursive') or dotted path to a chunker class, with sizes from settings
+    unless given
+    """
+    strategy = strategy or settings.CHUNKING_STRATEGY
+    chunker_class = CHUNKERS.get(strategy) or import_string(strategy)
+    return chunker_class(
+        chunk_tokens=chunk_tokens or settings.CHUNK_TOKENS,
+        overlap_tokens=settings.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens,
+    )
+
+
+def _gap_levels(codes: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Level of the gap in front of each token; the first token starts a paragraph"""
+    levels = np.full(len(starts), PARAGRAPH, dtype=np.uint8)
+    if len(starts) < 2:
+        return levels
+    previous_ends, next_starts = ends[:-1], starts[1:]
+    # Newlines are whitespace, so each lies in the gap before the next token
+    gap_of_newline = np.searchsorted(starts, np.flatnonzero(codes == NEWLINE))
+    newlines = np.bincount(gap_of_newline, minlength=len(starts) + 1)[1:len(starts)]
+    sentence_end = np.isin(codes[previous_ends - 1], SENTENCE_END)
+    levels[1:] = np.select(
+        [next_starts == previous_ends, newlines >= 2, sentence_end, newlines > 0],
+        [NONE, PARAGRAPH, SENTENCE, LINE],
+        default=WORD,
+    )
+    return levels
+
+
+class _ByteOffsets:
+    """Maps non-decreasing character offsets in `text` to UTF-8 byte offsets,
+    encoding each stretch of text once
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.ascii = text.isascii()
+        self.char = self.byte = 0
+
+    def at(self, char: int) -> int:
+        if self.ascii:
+            return char
+        self.byte += len(self.text[self.char:char].encode('utf-8', 'surrogatepass'))
+        self.char = char
+        return self.byte
@@ -0,0 +1,115 @@
+import time
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+from ..models import DocumentChunk
+from .tokens import count_tokens, iter_token_spans
+
+# Chunks stored before byte offsets were recorded have their overlap found by
+# matching text; shorter matches than this are taken as coincidence
+MIN_TEXT_OVERLAP = 16
+MAX_TEXT_OVERLAP = 2000
+
+
+class PackedContext(NamedTuple):
+    text: str
+    # The (chunk, score) pairs whose text made it into `text`
+    chunks: List[Tuple[DocumentChunk, float]]
+    dropped: int
+    tokens: int
+    seconds: float
+
+
+def overlap_chars(previous: DocumentChunk, following: DocumentChunk) -> int:
+    """Characters at the start of `following` that repeat the end of
+    `previous`, its neighbour in the same document
+    """
+    if None not in (previous.start_offset, previous.end_offset, following.start_offset):
+        overlap = previous.end_offset - following.start_offset
+        if overlap <= 0 or following.start_offset < previous.start_offset:
+            return 0
+        return len(following.content.encode('utf-8')[:overlap].decode('utf-8', 'ignore'))
+
+    # The longest overlap starts at the earliest place in the tail of
+    # `previous` where the start of `following` appears and runs to its end
+    text, head = previous.content, following.content[:MIN_TEXT_OVERLAP]
+    if len(head) < MIN_TEXT_OVERLAP:
+        return 0
+    position = text.find(head, max(0, len(text) - min(MAX_TEXT_OVERLAP, len(following.content))))
+    while position != -1:
+        if following.content.startswith(text[position:]):
+            return len(text) - position
+        position = text.find(head, position + 1)
+    return 0
+
+
+def _tokens(chunk: DocumentChunk, prefix: int, suffix: int) -> int:
+    """Estimated tokens of the chunk's text less `prefix` leading and
+    `suffix` trailing characters, from its stored count where there is one
+    """
+    content = chunk.content
+    if chunk.token_count is None:
+        return count_tokens(content[prefix:len(content) - suffix])
+    removed = count_tokens(content[:prefix]) if prefix else 0
+    if suffix:
+        removed += count_tokens(content[len(content) - suffix:])
+    return max(0, chunk.token_count - removed)
+
+
+def pack_context(relevant_chunks: List[Tuple[DocumentChunk, float]], budget: Optional[int] = None) -> PackedContext:
+    """Context for the LLM prompt from retrieved (chunk, score) pairs.
+
+    Chunks are taken best score first while their text fits in `budget`
+    estimated tokens (CONTEXT_TOKEN_BUDGET); one that does not fit is
+    skipped so a shorter one further down can still use the room, and the
+    best chunk is cut to the budget rather than left out. Neighbouring
+    chunks of one document are joined into a single passage with their
+    overlap removed, which also makes the overlap free when budgeting.
+    Passages are listed best first.
+    """
+    start_time = time.perf_counter()
+    budget = settings.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    picked: Dict[tuple, Tuple[DocumentChunk, float]] = {}
+    truncated: Dict[tuple, str] = {}
+    used = dropped = 0
+
+    for chunk, score in sorted(relevant_chunks, key=lambda pair: pair[1], reverse=True):
+        key = (chunk.document_id, chunk.chunk_index)
+        if key in picked:
+            continue
+        previous = picked.get((chunk.document_id, chunk.chunk_index - 1))
+        following = picked.get((chunk.document_id, chunk.chunk_index + 1))
+        tokens = _tokens(
+            chunk,
+            overlap_chars(previous[0], chunk) if previous else 0,
+            overlap_chars(chunk, following[0]) if following else 0,
+        )
+
+        if used + tokens <= budget:
+            used += tokens
+        elif not picked and budget > 0:
+            spans = list(islice(iter_token_spans(chunk.content), budget))
+            truncated[key] = chunk.content[:spans[-1][1]] if spans else ''
+            used = budget
+        else:
+            dropped += 1
+            continue
+        picked[key] = (chunk, score)
+
+    passages = []
+    for key in sorted(picked):
+        chunk, score = picked[key]
+        text = truncated.get(key, chunk.content)
+        last = passages[-1] if passages else None
+        if last and last['key'] == (key[0], key[1] - 1) and last['key'] not in truncated and key not in truncated:
+            last['text'] += text[overlap_chars(last['chunk'], chunk):]
+            last['score'] = max(last['score'], score)
+            last['key'], last['chunk'] = key, chunk
+        else:
+            passages.append({'key': key, 'chunk': chunk, 'text': text, 'score': score})
+    passages.sort(key=lambda passage: passage['score'], reverse=True)
+
+    headers = [f"Context {i}:\n" for i in range(1, len(passages) + 1)]
+    text = "\n".join(f"{header}{passage['text']}\n" for header, passage in zip(headers, passages))
+    kept = [pair for pair in relevant_chunks if (pair[0].document_id, pair[0].chunk_index) in picked]
+    return PackedContext(text, kept, dropped, used + count_tokens(''.join(headers)), time.perf_counter() - start_time)
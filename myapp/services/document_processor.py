@@ -1,68 +1,179 @@
 import PyPDF2
 import docx
+import hashlib
 import markdown
-from typing import List, Tuple
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import numpy as np
-#from sentence_transformers import SentenceTransformer
 import faiss
-import pickle
 import os
+import time
 from django.conf import settings
+from django.db.models import F, Max, Min
 from ..models import Document, DocumentChunk
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from .index_writer import IndexWriter
+from .lexical_index import LexicalIndexWriter
+from .chunking import Chunk, get_chunker
+from .retrieval_service import chunk_cache
+from .pdf_extraction import iter_pdf_pages
+from .embeddings import embedding_model_name, get_embedding_model
+from .embedding_cache import normalize_text
+from .embedding_pipeline import EmbeddingPipeline
+from .metrics import get_metrics
+from .tracing import record, span
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def content_hash(text: str) -> str:
+    """Fingerprint of a chunk's text that ignores changes in whitespace"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def remove_chunk_vectors(chunk_ids: List) -> int:
+    """Tombstone the chunks' vectors, remove them from the lexical index and
+    drop them from this worker's chunk cache; returns how many vectors were
+    removed
+    """
+    removed = IndexWriter().delete_chunks(chunk_ids)
+    LexicalIndexWriter().delete_chunks(chunk_ids)
+    for chunk_id in chunk_ids:
+        chunk_cache.discard(chunk_id)
+    return removed
+
+
+def remove_document_vectors(document: Document) -> int:
+    """Tombstone a document's vectors, remove its chunks from the lexical
+    index and drop them from this worker's chunk cache; returns how many
+    vectors were removed
+    """
+    removed = IndexWriter().delete_documents([document.id])
+    chunk_ids = list(document.chunks.values_list('id', flat=True))
+    LexicalIndexWriter().delete_chunks(chunk_ids)
+    for chunk_id in chunk_ids:
+        chunk_cache.discard(chunk_id)
+    return removed
+
 
 class DocumentProcessor:
-    def __init__(self):
-        #self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.embedding_model = GoogleGenerativeAIEmbeddings(model="models/embedding-001",api_key=os.environ.get("GOOGLE_API_KEY")) 
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+    def __init__(self, embedding_model=None, progress_callback=None, chunker=None):
+        self.embedding_model = embedding_model or get_embedding_model()
+        # Recorded with the vectors, so another model's cannot be mixed in
+        self.model_name = embedding_model_name(self.embedding_model)
+        # Called as progress_callback(embedded_chunks, total_chunks) during
+        # embedding; total_chunks is None until the whole document is chunked
+        self.progress_callback = progress_callback
+        self.chunker = chunker or get_chunker()
+        # Chunks stored and embedded together while the document streams in
+        self.ingest_batch_size = getattr(settings, 'INGEST_BATCH_SIZE', 500)
         
     def process_document(self, document: Document) -> bool:
-        """Process a document and store its chunks with embeddings"""
+        """Process a document and store its chunks with embeddings.
+
+        Pages stream through chunking, storage and embedding in batches of
+        `ingest_batch_size` chunks, so memory use does not grow with the
+        size of the document.
+        """
         try:
-            # Extract text with page numbers based on document type
-            if document.document_type == 'pdf':
-                pages_text = self._extract_pdf_text(document.file.path)
-            elif document.document_type == 'docx':
-                pages_text = self._extract_docx_text(document.file.path)
-            elif document.document_type == 'md':
-                pages_text = self._extract_markdown_text(document.file.path)
-            elif document.document_type == 'txt':
-                pages_text = self._extract_text_file(document.file.path)
-            else:
-                raise ValueError(f"Unsupported document type: {document.document_type}")
-            
-            # Create chunks with page tracking
-            chunks_with_pages = self._create_chunks_with_pages(pages_text)
-            
-            # Store chunks in database
-            self._store_chunks_with_pages(document, chunks_with_pages)
-            
-            # Create and store embeddings
-            self._create_embeddings(document)
+            total_chunks = 0
+            for chunks in self._iter_stored_chunks(document):
+                # Chunks kept from the previous version already have vectors
+                new_chunks = [chunk for chunk in chunks if not chunk.embedding_stored]
+                self._embed_chunks(document, new_chunks, embedded_before=total_chunks)
+                total_chunks += len(chunks)
+            if self.progress_callback:
+                self.progress_callback(total_chunks, total_chunks)
             
             # Mark document as processed
             document.processed = True
-            document.total_chunks = len(chunks_with_pages)
+            document.total_chunks = total_chunks
             document.save()
+            get_metrics().inc('vectormind_ingest_documents_total', result='processed')
             
             return True
             
         except Exception as e:
             print(f"Error processing document {document.id}: {str(e)}")
+            get_metrics().inc('vectormind_ingest_documents_total', result='failed')
             return False
+
+    def chunk_document(self, document: Document) -> int:
+        """Extract, chunk and store a document without embedding it; bulk
+        ingest embeds the chunks of many documents together afterwards.
+        Returns the number of chunks.
+        """
+        total_chunks = sum(len(chunks) for chunks in self._iter_stored_chunks(document))
+        document.total_chunks = total_chunks
+        document.save(update_fields=['total_chunks'])
+        return total_chunks
+
+    def _iter_stored_chunks(self, document: Document) -> Iterator[List[DocumentChunk]]:
+        """Store the document's chunks `ingest_batch_size` at a time as pages
+        are extracted, yielding each stored batch.
+
+        When the document was processed before (a new version of it was
+        uploaded), chunks whose content hash matches one of the previous
+        version's take over that chunk's vector instead of being embedded
+        again, and come back with embedding_stored set. The previous chunks
+        left over are removed with their vectors after the last batch, so the
+        old version stays searchable until the new one is in the index.
+        """
+        # Extract text with page numbers based on document type
+        if document.document_type == 'pdf':
+            pages_text = self._extract_pdf_text(document.file.path)
+        elif document.document_type == 'docx':
+            pages_text = self._extract_docx_text(document.file.path)
+        elif document.document_type == 'md':
+            pages_text = self._extract_markdown_text(document.file.path)
+        elif document.document_type == 'txt':
+            pages_text = self._extract_text_file(document.file.path)
+        else:
+            raise ValueError(f"Unsupported document type: {document.document_type}")
+        
+        # Create chunks with page tracking
+        chunks_with_pages = self._create_chunks_with_pages(pages_text)
+
+        previous = self._previous_chunks(document)
+
+        total_chunks = 0
+        # Extraction and chunking run lazily, as each batch is pulled
+        start_time = time.perf_counter()
+        for batch in _batched(chunks_with_pages, self.ingest_batch_size):
+            chunks = self._store_chunks_with_pages(document, batch, start_index=total_chunks, previous=previous)
+            total_chunks += len(chunks)
+            record('ingest_chunk', time.perf_counter() - start_time)
+            yield chunks
+            start_time = time.perf_counter()
+
+        # Removed or changed since the previous version
+        stale = document.chunks.filter(chunk_index__lt=0)
+        stale_ids = list(stale.values_list('id', flat=True))
+        if stale_ids:
+            remove_chunk_vectors(stale_ids)
+            stale.delete()
+
+    def _previous_chunks(self, document: Document) -> Dict[str, List]:
+        """IDs of the document's chunks that have a vector, by content hash,
+        in document order. Every chunk of the document is moved to a negative
+        chunk_index, in the same order, so the new version's chunks can be
+        stored beside them.
+        """
+        bounds = document.chunks.aggregate(first=Min('chunk_index'), last=Max('chunk_index'))
+        if bounds['last'] is None:
+            return {}
+        document.chunks.update(chunk_index=F('chunk_index') - (bounds['last'] - min(bounds['first'], 0) + 1))
+        previous: Dict[str, List] = {}
+        for chunk_id, digest in (document.chunks.filter(embedding_stored=True)
+                                 .order_by('chunk_index').values_list('id', 'content_hash')):
+            previous.setdefault(digest, []).append(chunk_id)
+        return previous
     
-    def _extract_pdf_text(self, file_path: str) -> List[Tuple[str, int]]:
-        """Extract text from PDF file with page numbers"""
-        pages_text = []
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num, page in enumerate(pdf_reader.pages, 1):
-                text = page.extract_text()
-                if text.strip():  # Only add non-empty pages
-                    pages_text.append((text, page_num))
-        return pages_text
+    def _extract_pdf_text(self, file_path: str) -> Iterator[Tuple[str, int]]:
+        """Extract text from PDF file with page numbers, lazily, page range by page range"""
+        return iter_pdf_pages(file_path)
     
     def _extract_docx_text(self, file_path: str) -> List[Tuple[str, int]]:
         """Extract text from DOCX file with estimated page numbers"""
@@ -94,104 +205,111 @@ class DocumentProcessor:
             text = file.read()
             return [(text, 1)]  # Single page for text files
     
-    def _create_chunks(self, text: str) -> List[str]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + self.chunk_size
-            
-            # Try to end at a sentence boundary
-            if end < len(text):
-                # Look for sentence endings
-                for i in range(end, start + self.chunk_size // 2, -1):
-                    if text[i] in '.!?':
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - self.chunk_overlap
-            
-        return chunks
-    
-    def _create_chunks_with_pages(self, pages_text: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+    def _create_chunks_with_pages(self, pages_text: Iterable[Tuple[str, int]]) -> Iterator[Chunk]:
         """Split text into overlapping chunks while preserving page numbers"""
-        chunks_with_pages = []
-        
-        for page_text, page_num in pages_text:
-            # Split current page into chunks
-            page_chunks = self._create_chunks(page_text)
-            
-            # Add page number to each chunk from this page
-            for chunk in page_chunks:
-                chunks_with_pages.append((chunk, page_num))
-        
-        return chunks_with_pages
+        return self.chunker.chunk_pages(pages_text)
     
-    def _store_chunks_with_pages(self, document: Document, chunks_with_pages: List[Tuple[str, int]]):
-        """Store chunks with page numbers in database"""
-        chunk_objects = []
-        for i, (chunk_content, page_num) in enumerate(chunks_with_pages):
-            chunk_objects.append(
-                DocumentChunk(
-                    document=document,
-                    content=chunk_content,
-                    chunk_index=i,
-                    page_number=page_num
-                )
+    def _store_chunks_with_pages(self, document: Document, chunks: List[Chunk], start_index: int = 0,
+                                 previous: Optional[Dict[str, List]] = None) -> List[DocumentChunk]:
+        """Store chunks with page numbers and offsets in database. A chunk
+        whose content hash is in `previous` takes over that (popped) chunk's
+        vector instead of being embedded.
+        """
+        chunk_objects, kept = [], {}
+        for i, chunk in enumerate(chunks, start_index):
+            digest = content_hash(chunk.content)
+            chunk_object = DocumentChunk(
+                document=document,
+                content=chunk.content,
+                chunk_index=i,
+                page_number=chunk.page_number,
+                start_offset=chunk.start,
+                end_offset=chunk.end,
+                token_count=chunk.token_count,
+                content_hash=digest,
             )
-        
+            matches = previous.get(digest) if previous else None
+            if matches:
+                kept[chunk_object.id] = matches.pop(0)
+            chunk_objects.append(chunk_object)
+
         DocumentChunk.objects.bulk_create(chunk_objects)
+        if kept:
+            self._reuse_vectors(document, [chunk for chunk in chunk_objects if chunk.id in kept], kept)
+        return chunk_objects
+
+    def _reuse_vectors(self, document: Document, chunks: List[DocumentChunk], kept: Dict):
+        """Store the vectors of the previous chunks `kept` maps each chunk's
+        ID to under the chunk's own ID, and remove the previous chunks.
+
+        A kept chunk has the same text but may have moved, so it is a new row
+        rather than the previous one updated: a chunk ID always names the same
+        content and position, and rows cached by ID in any worker never go stale.
+        """
+        writer = IndexWriter()
+        found, vectors = writer.read_vectors([kept[chunk.id] for chunk in chunks])
+        found = set(found)
+        # A previous chunk whose vector is gone is embedded again instead
+        chunks = [chunk for chunk in chunks if kept[chunk.id] in found]
+        if not chunks:
+            return
+        chunk_ids = [chunk.id for chunk in chunks]
+        writer.append(
+            vectors,
+            chunk_ids=chunk_ids,
+            document_ids=[document.id] * len(chunks),
+            user_ids=[document.uploaded_by_id] * len(chunks),
+            model=self.model_name,
+        )
+        LexicalIndexWriter().add(chunk_ids, [document.uploaded_by_id] * len(chunks), [chunk.content for chunk in chunks])
+        DocumentChunk.objects.filter(id__in=chunk_ids).update(embedding_stored=True)
+        for chunk in chunks:
+            chunk.embedding_stored = True
+
+        previous_ids = [kept[chunk_id] for chunk_id in chunk_ids]
+        remove_chunk_vectors(previous_ids)
+        DocumentChunk.objects.filter(id__in=previous_ids).delete()
+        get_metrics().inc('vectormind_ingest_chunks_reused_total', len(chunks))
     
-    def _create_embeddings(self, document: Document):
-        """Create embeddings for document chunks and store in a single FAISS index"""
-        chunks = DocumentChunk.objects.filter(document=document)
+    def _embed_chunks(self, document: Document, chunks: List[DocumentChunk], embedded_before: int = 0):
+        """Embed chunks and append them to the vector store"""
+        if not chunks:
+            return
+        embeddings = self.embed_chunks(chunks, embedded_before=embedded_before)
+
+        # Append the vectors with one (chunk, document, user) row each; the
+        # serving index picks them up from the delta until the next merge
+        with span('ingest_write'):
+            IndexWriter().append(
+                embeddings,
+                chunk_ids=[chunk.id for chunk in chunks],
+                document_ids=[document.id] * len(chunks),
+                user_ids=[document.uploaded_by_id] * len(chunks),
+                model=self.model_name,
+            )
+            LexicalIndexWriter().add(
+                [chunk.id for chunk in chunks], [document.uploaded_by_id] * len(chunks), [chunk.content for chunk in chunks],
+            )
+
+            # Mark chunks as having embeddings stored
+            DocumentChunk.objects.filter(id__in=[chunk.id for chunk in chunks]).update(embedding_stored=True)
+
+    def embed_chunks(self, chunks: List[DocumentChunk], embedded_before: int = 0) -> np.ndarray:
+        """L2-normalized embeddings of the chunks' content, one row per chunk"""
         texts = [chunk.content for chunk in chunks]
 
-        # Generate embeddings
-        embeddings_list = self.embedding_model.embed_documents(texts)
-        
-        # Convert to numpy array
-        embeddings = np.array(embeddings_list, dtype=np.float32)
+        # Generate embeddings in concurrent, rate-limit-aware batches
+        progress = None
+        if self.progress_callback:
+            progress = lambda embedded, total: self.progress_callback(embedded_before + embedded, None)
+        pipeline = EmbeddingPipeline(self.embedding_model, progress_callback=progress)
+        with span('ingest_embed'):
+            embeddings = pipeline.embed(texts)
+        get_metrics().inc('vectormind_ingest_chunks_total', len(texts))
         
-        # Common index and metadata paths
-        index_path = os.path.join(settings.VECTOR_DB_PATH, 'index.faiss')
-        metadata_path = os.path.join(settings.VECTOR_DB_PATH, 'metadata.pkl')
-
         dimension = embeddings.shape[1] if len(embeddings) > 0 else 0
         print(f"Embedding dimension: {dimension}")
         
-        # Load or create FAISS index
-        if os.path.exists(index_path):
-            index = faiss.read_index(index_path)
-        else:
-            index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-
         # Normalize embeddings for cosine similarity
         faiss.normalize_L2(embeddings)
-        index.add(embeddings)
-
-        # Save index
-        faiss.write_index(index, index_path)
-
-        # Load or create metadata
-        if os.path.exists(metadata_path):
-            with open(metadata_path, 'rb') as f:
-                metadata = pickle.load(f)
-        else:
-            metadata = {'chunk_ids': [], 'document_ids': [], 'user_ids': []}
-
-        # Update metadata
-        metadata['chunk_ids'].extend([str(chunk.id) for chunk in chunks])
-        metadata['document_ids'].append(str(document.id))
-        metadata['user_ids'].extend([str(chunk.document.uploaded_by.id) for chunk in chunks])
-
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(metadata, f)
-
-        # Mark chunks as having embeddings stored
-        chunks.update(embedding_stored=True)
\ No newline at end of file
+        return embeddings
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+STATS_KEYS = ('hits', 'misses', 'hit_chars', 'skipped_calls', 'provider_calls')
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so reflowed copies of a chunk share a cache entry"""
+    return ' '.join(text.split())
+
+
+def embedding_cache_key(model_name: str, text: str, task: str = 'document') -> str:
+    """Cache key of the embedding of `text` as a 'document' or a 'query'.
+
+    Providers such as Gemini embed the two differently, so a question is
+    never served a chunk's vector. Document keys are the same as before
+    tasks were part of the key, so cached chunk vectors stay valid.
+    """
+    if task != 'document':
+        model_name = f"{model_name}\0{task}"
+    digest = hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+    return f"emb:{digest}"
+
+
+def embed_queries(embedding_model, texts: List[str]) -> List[List[float]]:
+    """Query embeddings of several questions in one provider call.
+
+    LangChain has no batched `embed_query`, so providers that take a task
+    type (Gemini) get `embed_documents(task_type='retrieval_query')`.
+    Others (the local models, the fakes) embed questions as documents, which
+    for them is what `embed_query` does anyway.
+    """
+    if hasattr(embedding_model, 'embed_queries'):
+        return embedding_model.embed_queries(texts)
+    if 'task_type' in inspect.signature(embedding_model.embed_documents).parameters:
+        return embedding_model.embed_documents(texts, task_type='retrieval_query')
+    return embedding_model.embed_documents(texts)
+
+
+def increment_counters(cache, deltas: Dict[str, int]):
+    """Add to shared counters in `cache`, creating them as needed.
+
+    On Redis every counter goes out in one pipelined round trip (INCRBY
+    creates missing keys); other backends fall back to incr/add per counter.
+    Failures are ignored, since the counters only feed stats.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    try:
+        if isinstance(cache, RedisCache):
+            pipeline = cache._cache.get_client(write=True).pipeline(transaction=False)
+            for key, delta in deltas.items():
+                pipeline.incrby(cache.make_and_validate_key(key), delta)
+            pipeline.execute()
+            return
+        for key, delta in deltas.items():
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # First increment: the counter does not exist yet
+                cache.add(key, delta, None)
+    except Exception:
+        return
+
+
+class CachedEmbeddings:
+    """Content-addressed cache in front of an embedding provider.
+
+    Vectors are keyed by a hash of (model name, task, normalized text) and stored as
+    float32 bytes in the EMBEDDING_CACHE_ALIAS cache (Redis by default, whose
+    maxmemory-policy handles LRU eviction). Only texts missing from the cache
+    are sent to the provider, and duplicates within a call are sent once.
+    Cache outages degrade to calling the provider directly.
+    """
+
+    def __init__(self, provider, model_name: str, cache_alias: Optional[str] = None, timeout: Optional[int] = None):
+        self.provider = provider
+        self.model_name = model_name
+        self.cache = caches[cache_alias or settings.EMBEDDING_CACHE_ALIAS]
+        self.timeout = settings.EMBEDDING_CACHE_TIMEOUT if timeout is None else timeout
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, 'document', self.provider.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], 'query', lambda texts: [self.provider.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """embed_query for several questions, sent to the provider in one call"""
+        return self._embed(texts, 'query', lambda missing: embed_queries(self.provider, missing))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        async def embed(missing):
+            if hasattr(self.provider, 'aembed_documents'):
+                return await self.provider.aembed_documents(missing)
+            return await asyncio.to_thread(self.provider.embed_documents, missing)
+        return await self._aembed(texts, 'document', embed)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def embed(missing):
+            if hasattr(self.provider, 'aembed_query'):
+                return [await self.provider.aembed_query(missing[0])]
+            return [await asyncio.to_thread(self.provider.embed_query, missing[0])]
+        return (await self._aembed([text], 'query', embed))[0]
+
+    def _embed(self, texts: List[str], task: str, embed) -> List[List[float]]:
+        """Vectors of `texts` from the cache, calling embed(missing texts) for the rest"""
+        keys = [embedding_cache_key(self.model_name, text, task) for text in texts]
+        cached = self._get_many(set(keys))
+        missing, hit_chars = self._missing(keys, texts, cached)
+        if missing:
+            embedded = embed(list(missing.values()))
+            fresh = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, embedded)}
+            self._set_many(fresh)
+            cached.update(fresh)
+        self._record_lookup(len(texts), len(missing), hit_chars)
+        return [cached[key].tolist() for key in keys]
+
+    async def _aembed(self, texts: List[str], task: str, embed) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model_name, text, task) for text in texts]
+        cached = await sync_to_async(self._get_many, thread_sensitive=False)(set(keys))
+        missing, hit_chars = self._missing(keys, texts, cached)
+        if missing:
+            embedded = await embed(list(missing.values()))
+            fresh = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, embedded)}
+            await sync_to_async(self._set_many, thread_sensitive=False)(fresh)
+            cached.update(fresh)
+        await sync_to_async(self._record_lookup, thread_sensitive=False)(len(texts), len(missing), hit_chars)
+        return [cached[key].tolist() for key in keys]
+
+    @staticmethod
+    def _missing(keys: List[str], texts: List[str], cached: Dict[str, np.ndarray]) -> Tuple[Dict[str, str], int]:
+        """Texts to send to the provider (one per key) and characters served
+        from the cache or from a duplicate earlier in the same call
+        """
+        missing: Dict[str, str] = {}
+        hit_chars = 0
+        for key, text in zip(keys, texts):
+            if key in cached or key in missing:
+                hit_chars += len(text)
+            else:
+                missing[key] = text
+        return missing, hit_chars
+
+    def _record_lookup(self, total: int, missed: int, hit_chars: int):
+        self._record(
+            hits=total - missed,
+            misses=missed,
+            hit_chars=hit_chars,
+            skipped_calls=0 if missed else 1,
+            provider_calls=1 if missed else 0,
+        )
+
+    def _get_many(self, keys) -> Dict[str, np.ndarray]:
+        try:
+            raw = self.cache.get_many(list(keys))
+        except Exception:
+            logger.warning("Embedding cache unavailable; embedding without it", exc_info=True)
+            return {}
+        return {key: np.frombuffer(value, dtype=np.float32) for key, value in raw.items()}
+
+    def _set_many(self, vectors: Dict[str, np.ndarray]):
+        try:
+            self.cache.set_many({key: vector.tobytes() for key, vector in vectors.items()}, self.timeout)
+        except Exception:
+            logger.warning("Could not write to embedding cache", exc_info=True)
+
+    def _record(self, **counts):
+        increment_counters(self.cache, {f"emb:stats:{name}": delta for name, delta in counts.items()})
+
+    def stats(self) -> dict:
+        """Hit rate and the provider calls / spend it avoided, across all workers"""
+        try:
+            raw = self.cache.get_many([f"emb:stats:{name}" for name in STATS_KEYS])
+        except Exception:
+            raw = {}
+        counts = {name: raw.get(f"emb:stats:{name}", 0) for name in STATS_KEYS}
+        lookups = counts['hits'] + counts['misses']
+        # Rough token estimate of ~4 characters per token
+        tokens_saved = counts['hit_chars'] / 4
+        return {
+            **counts,
+            'hit_rate': counts['hits'] / lookups if lookups else 0.0,
+            'tokens_saved': int(tokens_saved),
+            'dollars_saved': tokens_saved / 1000 * settings.EMBEDDING_COST_PER_1K_TOKENS,
+        }
@@ -0,0 +1,143 @@
+import time
+import random
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Callable, Iterator, List, Optional, Tuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether a provider exception signals HTTP 429 / quota exhaustion"""
+    for attr in ('code', 'status_code', 'status'):
+        value = getattr(error, attr, None)
+        if callable(value):
+            continue
+        if value == 429 or str(value) == '429':
+            return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'resource_exhausted' in message or 'rate limit' in message
+
+
+class AdaptiveLimiter:
+    """Caps concurrent provider calls, halving the cap on each rate-limit
+    response and growing it back by one after a full window of successes.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_in_flight:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def record_rate_limited(self):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+
+class EmbeddingPipeline:
+    """Embeds texts in batches with a bounded number of concurrent calls.
+
+    Batches are sent from a thread pool; at most `max_in_flight` provider
+    calls run at once, fewer while the provider is rate limiting. Rate-limited
+    batches are retried with exponential backoff and jitter, other errors
+    propagate. `progress_callback(done, total)` is called as batches finish.
+    """
+
+    def __init__(self, provider, batch_size: Optional[int] = None, max_in_flight: Optional[int] = None,
+                 max_retries: Optional[int] = None, backoff_seconds: Optional[float] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None):
+        self.provider = provider
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.max_in_flight = max_in_flight or settings.EMBEDDING_MAX_IN_FLIGHT
+        self.max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = settings.EMBEDDING_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.progress_callback = progress_callback
+        self.rate_limited_calls = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed all texts, returning a float32 array in input order"""
+        batches = [embeddings for _, embeddings in self.iter_batches(texts)]
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(batches)
+
+    def iter_batches(self, texts: List[str]) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield (offset, embeddings) per batch, in input order, as soon as
+        each batch and all batches before it are done.
+        """
+        total = len(texts)
+        limiter = AdaptiveLimiter(self.max_in_flight)
+        done = 0
+        pending = deque()
+        offsets = iter(range(0, total, self.batch_size))
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='embed') as executor:
+            def submit_next() -> bool:
+                offset = next(offsets, None)
+                if offset is None:
+                    return False
+                batch = texts[offset:offset + self.batch_size]
+                pending.append((offset, executor.submit(self._embed_batch, batch, limiter)))
+                return True
+
+            # Keep a bounded window of batches queued so memory stays flat
+            for _ in range(self.max_in_flight * 2):
+                if not submit_next():
+                    break
+
+            while pending:
+                offset, future = pending.popleft()
+                embeddings = future.result()
+                submit_next()
+                done += len(embeddings)
+                if self.progress_callback:
+                    self.progress_callback(done, total)
+                yield offset, embeddings
+
+    def _embed_batch(self, batch: List[str], limiter: AdaptiveLimiter) -> np.ndarray:
+        attempt = 0
+        while True:
+            try:
+                with limiter:
+                    embeddings = self.provider.embed_documents(batch)
+                limiter.record_success()
+                return np.asarray(embeddings, dtype=np.float32)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                self.rate_limited_calls += 1
+                limiter.record_rate_limited()
+                delay = self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+                logger.warning("Embedding batch rate limited, retrying in %.2fs (attempt %d)", delay, attempt + 1)
+                time.sleep(delay)
+                attempt += 1
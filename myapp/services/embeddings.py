@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .embedding_cache import CachedEmbeddings
+
+
+def get_embedding_model():
+    """Instantiate the embedding provider configured in settings.
+
+    EMBEDDING_PROVIDER is a dotted path to a class exposing LangChain's
+    `embed_documents(texts)` / `embed_query(text)` interface, so a local or
+    fake provider can be swapped in without touching the services. Unless
+    EMBEDDING_CACHE_ENABLED is off, the provider is wrapped in the
+    content-addressed embedding cache.
+    """
+    provider_class = import_string(settings.EMBEDDING_PROVIDER)
+    options = dict(getattr(settings, 'EMBEDDING_PROVIDER_OPTIONS', {}))
+    options.setdefault('model', settings.EMBEDDING_MODEL)
+    provider = provider_class(**options)
+    if settings.EMBEDDING_CACHE_ENABLED:
+        return CachedEmbeddings(provider, model_name=options['model'])
+    return provider
+
+
+def embedding_model_name(embedding_model) -> str:
+    """Name of the model behind a provider, as recorded in the vector store"""
+    return (
+        getattr(embedding_model, 'model_name', None) or getattr(embedding_model, 'model', None)
+        or settings.EMBEDDING_MODEL
+    )
+
+
+def warm_embedding_model(embedding_model) -> float:
+    """Load a local provider's model before the first request or task, so
+    neither pays for it; returns the seconds taken (0 for remote providers)
+    """
+    provider = getattr(embedding_model, 'provider', embedding_model)
+    if not settings.EMBEDDING_WARMUP or not hasattr(provider, 'warm'):
+        return 0.0
+    return provider.warm()
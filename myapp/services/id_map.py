@@ -0,0 +1,145 @@
+import os
+import uuid
+import numpy as np
+from typing import Iterable, List
+
+UUID_DTYPE = np.dtype('S16')
+USER_ID_DTYPE = np.dtype('<i4')
+
+# Column name -> (file name, dtype). Row i of every column describes vector i.
+COLUMNS = {
+    'chunk_ids': ('chunk_ids.uuid', UUID_DTYPE),
+    'document_ids': ('document_ids.uuid', UUID_DTYPE),
+    'user_ids': ('user_ids.i32', USER_ID_DTYPE),
+}
+
+
+def uuid_array(values: Iterable) -> np.ndarray:
+    """Pack UUIDs (or their string forms) into a fixed-width 16-byte array"""
+    return np.array([_as_uuid(value).bytes for value in values], dtype=UUID_DTYPE)
+
+
+def unpack_uuid(value: bytes) -> uuid.UUID:
+    """One UUID of an array from uuid_array"""
+    # Fixed-width byte strings drop trailing NULs
+    return uuid.UUID(bytes=bytes(value).ljust(16, b'\0'))
+
+
+def _as_uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class VectorIdMap:
+    """Maps FAISS vector positions to chunk, document and user IDs.
+
+    Each column is a flat binary file of fixed-width rows, opened as a
+    read-only NumPy memmap, so loading costs O(1) regardless of corpus size
+    and pages are shared between processes. New rows are appended to the end
+    of each file; existing rows are never rewritten.
+    """
+
+    def __init__(self, chunk_ids: np.ndarray, document_ids: np.ndarray, user_ids: np.ndarray):
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.user_ids = user_ids
+
+    @classmethod
+    def empty(cls) -> 'VectorIdMap':
+        return cls(*(np.empty(0, dtype=dtype) for _, dtype in COLUMNS.values()))
+
+    @classmethod
+    def load(cls, path) -> 'VectorIdMap':
+        """Memory-map the columns under path, trimmed to their common length"""
+        columns = [_memmap(os.path.join(path, filename), dtype) for filename, dtype in COLUMNS.values()]
+        rows = min(len(column) for column in columns)
+        return cls(*(column[:rows] for column in columns))
+
+    @staticmethod
+    def exists(path) -> bool:
+        return all(os.path.exists(os.path.join(path, filename)) for filename, _ in COLUMNS.values())
+
+    @staticmethod
+    def append(path, chunk_ids: Iterable, document_ids: Iterable, user_ids: Iterable[int]) -> int:
+        """Append one row per vector to every column; returns the new row count"""
+        values = {
+            'chunk_ids': uuid_array(chunk_ids),
+            'document_ids': uuid_array(document_ids),
+            'user_ids': np.asarray(list(user_ids), dtype=USER_ID_DTYPE),
+        }
+        if len({len(column) for column in values.values()}) != 1:
+            raise ValueError("chunk_ids, document_ids and user_ids must have the same length")
+
+        # A previous append interrupted half-way leaves columns of unequal
+        # length; cut them back so the new rows line up again
+        rows = VectorIdMap.row_count(path)
+        for name, (filename, dtype) in COLUMNS.items():
+            file_path = os.path.join(path, filename)
+            with open(file_path, 'ab') as f:
+                f.truncate(rows * dtype.itemsize)
+                f.write(values[name].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return rows + len(values['user_ids'])
+
+    @staticmethod
+    def truncate(path, rows: int):
+        """Drop every row from `rows` on, in all columns"""
+        for filename, dtype in COLUMNS.values():
+            file_path = os.path.join(path, filename)
+            if os.path.exists(file_path) and os.path.getsize(file_path) > rows * dtype.itemsize:
+                with open(file_path, 'r+b') as f:
+                    f.truncate(rows * dtype.itemsize)
+                    os.fsync(f.fileno())
+
+    @staticmethod
+    def row_count(path) -> int:
+        counts = []
+        for filename, dtype in COLUMNS.values():
+            try:
+                counts.append(os.path.getsize(os.path.join(path, filename)) // dtype.itemsize)
+            except FileNotFoundError:
+                counts.append(0)
+        return min(counts)
+
+    def take(self, positions: np.ndarray) -> 'VectorIdMap':
+        """In-memory copy holding only the rows at positions, in that order"""
+        return VectorIdMap(*(np.asarray(column[positions]) for column in self._columns()))
+
+    def save(self, path):
+        """Write every column to path, replacing any existing files"""
+        for column, (filename, _) in zip(self._columns(), COLUMNS.values()):
+            with open(os.path.join(path, filename), 'wb') as f:
+                f.write(np.ascontiguousarray(column).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _columns(self):
+        return [getattr(self, name) for name in COLUMNS]
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def chunk_id(self, position: int) -> uuid.UUID:
+        return unpack_uuid(self.chunk_ids[position])
+
+    def chunk_ids_at(self, positions: Iterable[int]) -> List[uuid.UUID]:
+        return [self.chunk_id(position) for position in positions]
+
+    def positions_for_documents(self, document_ids: Iterable) -> np.ndarray:
+        """Vector positions belonging to any of document_ids"""
+        return np.flatnonzero(np.isin(self.document_ids, uuid_array(document_ids)))
+
+    def positions_for_chunks(self, chunk_ids: Iterable) -> np.ndarray:
+        """Vector positions of any of chunk_ids"""
+        return np.flatnonzero(np.isin(self.chunk_ids, uuid_array(chunk_ids)))
+
+
+def _memmap(file_path: str, dtype: np.dtype) -> np.ndarray:
+    try:
+        rows = os.path.getsize(file_path) // dtype.itemsize
+    except FileNotFoundError:
+        rows = 0
+    if rows == 0:
+        # np.memmap cannot map an empty file
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(rows,))
@@ -0,0 +1,216 @@
+import math
+import faiss
+import numpy as np
+from typing import Optional
+from django.conf import settings
+
+# Index types selectable through VECTOR_INDEX_TYPE (or 'auto' by corpus size)
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq')
+
+# How the index stores each vector, selectable through VECTOR_INDEX_STORAGE:
+# exact float32, half precision, 8-bit scalar quantization or product
+# quantization. Anything but float32 is lossy, so searches re-rank their
+# candidates against the exact vectors on disk.
+STORAGE_TYPES = ('float32', 'fp16', 'sq8', 'pq')
+
+# Vectors needed to train the 256-centroid PQ codebooks (39 points each)
+PQ_MIN_TRAINING_VECTORS = 256 * 39
+
+# Corpus sizes at which VECTOR_INDEX_TYPE='auto' moves to the next index type
+DEFAULT_AUTO_THRESHOLDS = {
+    'hnsw': 50_000,
+    'ivf_flat': 500_000,
+    'ivf_pq': 5_000_000,
+}
+
+# IVF indexes are rebuilt once the corpus outgrows the list count they were
+# trained for by this factor
+IVF_RETRAIN_FACTOR = 4
+
+# Upper bound on vectors used to train IVF centroids / PQ codebooks
+MAX_TRAINING_VECTORS = 256 * 1024
+
+
+def choose_index_type(ntotal: int) -> str:
+    """Index type to use for a corpus of ntotal vectors"""
+    index_type = getattr(settings, 'VECTOR_INDEX_TYPE', 'auto')
+    if index_type == 'auto':
+        thresholds = getattr(settings, 'VECTOR_INDEX_AUTO_THRESHOLDS', DEFAULT_AUTO_THRESHOLDS)
+        index_type = 'flat'
+        for candidate in INDEX_TYPES[1:]:
+            if candidate in thresholds and ntotal >= thresholds[candidate] and _trainable(candidate, ntotal):
+                index_type = candidate
+        return index_type
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported VECTOR_INDEX_TYPE: {index_type}")
+    # Stay exact until there are enough points to train the IVF centroids
+    return index_type if _trainable(index_type, ntotal) else 'flat'
+
+
+def _trainable(index_type: str, ntotal: int) -> bool:
+    return not index_type.startswith('ivf') or ntotal >= ideal_nlist(ntotal) * 39
+
+
+def ideal_nlist(ntotal: int) -> int:
+    """Number of IVF inverted lists for ntotal vectors (~4 * sqrt(N))"""
+    return max(1, min(65536, int(4 * math.sqrt(max(ntotal, 1)))))
+
+
+def choose_storage(index_type: str, ntotal: int) -> str:
+    """Vector storage to use for an index_type index of ntotal vectors"""
+    if index_type == 'ivf_pq':
+        return 'pq'
+    storage = getattr(settings, 'VECTOR_INDEX_STORAGE', 'float32')
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unsupported VECTOR_INDEX_STORAGE: {storage}")
+    # Stay exact until there are enough points to train the PQ codebooks
+    if storage == 'pq' and ntotal < PQ_MIN_TRAINING_VECTORS:
+        return 'float32'
+    return storage
+
+
+def choose_layout(ntotal: int) -> tuple:
+    """(index type, storage) to use for a corpus of ntotal vectors"""
+    index_type = choose_index_type(ntotal)
+    storage = choose_storage(index_type, ntotal)
+    # An IVF index over PQ codes is IVF-PQ, whichever way it was asked for
+    if index_type == 'ivf_flat' and storage == 'pq':
+        index_type = 'ivf_pq'
+    return index_type, storage
+
+
+def pq_subquantizers(dimension: int) -> int:
+    """Largest PQ sub-quantizer count dividing dimension, ~16 dims per code byte"""
+    target = max(1, dimension // 16)
+    for m in range(target, 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def factory_string(index_type: str, dimension: int, ntotal: int, storage: str = 'float32') -> str:
+    codec = {
+        'float32': 'Flat',
+        'fp16': 'SQfp16',
+        'sq8': 'SQ8',
+        'pq': f'PQ{pq_subquantizers(dimension)}',
+    }.get(storage)
+    if codec is None:
+        raise ValueError(f"Unsupported vector storage: {storage}")
+    if index_type == 'flat':
+        # IndexPQ takes no search parameters, so no ID selector; one inverted
+        # list holding every code is the same exhaustive scan and does
+        return 'IVF1,' + codec if storage == 'pq' else codec
+    if index_type == 'hnsw':
+        return 'HNSW32' if storage == 'float32' else f'HNSW32,{codec}'
+    if index_type == 'ivf_flat':
+        return f'IVF{ideal_nlist(ntotal)},{codec}'
+    if index_type == 'ivf_pq':
+        return f'IVF{ideal_nlist(ntotal)},PQ{pq_subquantizers(dimension)}'
+    raise ValueError(f"Unsupported index type: {index_type}")
+
+
+def build_index(vectors: np.ndarray, index_type: Optional[str] = None, storage: Optional[str] = None):
+    """Create, train and fill an inner-product index for normalized vectors"""
+    ntotal, dimension = vectors.shape
+    index_type = index_type or choose_index_type(ntotal)
+    storage = storage or choose_storage(index_type, ntotal)
+    index = faiss.index_factory(
+        dimension, factory_string(index_type, dimension, ntotal, storage), faiss.METRIC_INNER_PRODUCT,
+    )
+    if not index.is_trained:
+        if ntotal > MAX_TRAINING_VECTORS:
+            sample = np.random.default_rng(0).choice(ntotal, MAX_TRAINING_VECTORS, replace=False)
+            index.train(vectors[np.sort(sample)])
+        else:
+            index.train(vectors)
+    if ntotal:
+        index.add(vectors)
+    prepare_for_serving(index)
+    return index
+
+
+def index_type_of(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVF) and index.nlist == 1:
+        return 'flat'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    return 'flat'
+
+
+def storage_of(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return 'pq'
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return 'fp16' if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
+    return 'float32'
+
+
+def is_lossy(index) -> bool:
+    """Whether the index scores against approximations of the stored vectors"""
+    return storage_of(index) != 'float32'
+
+
+def needs_migration(index, ntotal: Optional[int] = None) -> bool:
+    """Whether a corpus of ntotal vectors (default: the index's own size) has
+    outgrown the index's type or IVF training, or the configured storage changed
+    """
+    ntotal = index.ntotal if ntotal is None else ntotal
+    if (index_type_of(index), storage_of(index)) != choose_layout(ntotal):
+        return True
+    ivf = _ivf_or_none(index) if index_type_of(index).startswith('ivf') else None
+    return ivf is not None and ideal_nlist(ntotal) > ivf.nlist * IVF_RETRAIN_FACTOR
+
+
+def reconstruct_all(index) -> np.ndarray:
+    if index.ntotal == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    prepare_for_serving(index)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def read_for_serving(file_path: str, mmap: bool = True):
+    """Load an index for searching.
+
+    Memory-mapped, the index's vectors, codes and inverted lists stay
+    read-only pages of the file, shared through the page cache by every
+    process on the host that maps it instead of copied into each one.
+    """
+    index = faiss.read_index(file_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0)
+    prepare_for_serving(index)
+    return index
+
+
+def prepare_for_serving(index):
+    """Enable reconstruction by position on IVF indexes"""
+    ivf = _ivf_or_none(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def search_parameters(index, selector=None, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """SearchParameters for index with optional ID filter and per-query tuning"""
+    index_type = index_type_of(index)
+    if _ivf_or_none(index) is not None:
+        nprobe = nprobe or getattr(settings, 'VECTOR_SEARCH_NPROBE', 16)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    if index_type == 'hnsw':
+        ef_search = ef_search or getattr(settings, 'VECTOR_SEARCH_EF', 64)
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _ivf_or_none(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
@@ -0,0 +1,334 @@
+import faiss
+import numpy as np
+import os
+import time
+import logging
+import threading
+import resource
+from typing import Dict, Optional, Tuple
+from django.conf import settings
+from . import index_factory
+from .id_map import VectorIdMap, uuid_array
+from .index_writer import INDEX_FILE, TOMBSTONES_FILE, load_tombstones, load_vectors, read_manifest, store_dir
+from .snapshot_store import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+# Tenants with at most this many vectors are scored directly against their own
+# rows instead of running a filtered scan over the whole index
+SUBSET_SEARCH_MAX_VECTORS = 2048
+
+
+def resident_memory_bytes() -> int:
+    """Current resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Non-Linux fallback: peak RSS (reported in KB on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_memory() -> dict:
+    """Resident memory of this process in bytes, split into its proportional
+    share of pages it maps together with other processes (pss), pages only
+    it holds (private), and anonymous (heap) pages
+    """
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private', 'Private_Dirty': 'private', 'Anonymous': 'anonymous'}
+    usage = dict.fromkeys(fields.values(), 0)
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    usage[fields[name]] += int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return {'rss': resident_memory_bytes()}
+    return usage
+
+
+class IndexSnapshot:
+    """A FAISS index and its ID map as loaded from one on-disk generation.
+
+    `index` holds the first `base_count` vectors. When the memory-mapped
+    vector log is given, rows past the base index (the unmerged delta) are
+    scored exactly from it, and candidates from a quantized base index are
+    re-ranked against their exact vectors there. Positions in `tombstones` belong to deleted
+    vectors and are never returned. Snapshots are never mutated after
+    loading, so a search holding a reference keeps working while the store
+    swaps in a newer snapshot.
+    """
+
+    def __init__(self, index, id_map: VectorIdMap, generation: tuple, load_seconds: float, load_rss_bytes: int,
+                 vectors: Optional[np.ndarray] = None, tombstones: Optional[np.ndarray] = None,
+                 embedding_model: Optional[str] = None):
+        self.index = index
+        self.id_map = id_map
+        self.vectors = vectors
+        self.tombstones = tombstones if tombstones is not None else np.empty(0, dtype=np.int64)
+        self.lossy = index is not None and index_factory.is_lossy(index)
+        self.embedding_model = embedding_model
+        self.generation = generation
+        self.load_seconds = load_seconds
+        self.load_rss_bytes = load_rss_bytes
+        self.loaded_at = time.time()
+        self._user_positions: Optional[Dict[int, np.ndarray]] = None
+        self._selectors: Dict[int, object] = {}
+        self._positions_lock = threading.Lock()
+
+    @property
+    def base_count(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def ntotal(self) -> int:
+        stored = self.base_count
+        if self.vectors is not None:
+            stored = max(stored, len(self.vectors))
+        # Guard against vectors written ahead of their ID map rows
+        return min(stored, len(self.id_map))
+
+    @property
+    def dimension(self) -> Optional[int]:
+        if self.vectors is not None:
+            return self.vectors.shape[1]
+        return self.index.d if self.index is not None else None
+
+    def check_query(self, question_embedding: np.ndarray, model: Optional[str] = None):
+        """Raise ValueError for a question embedded by a different model than
+        the stored vectors, whose scores against them would be meaningless
+        """
+        if self.dimension is not None and question_embedding.shape[-1] != self.dimension:
+            raise ValueError(
+                f"Question embedding dimension {question_embedding.shape[-1]} does not match "
+                f"the vector store's {self.dimension}"
+            )
+        if model and self.embedding_model and model != self.embedding_model:
+            raise ValueError(
+                f"Questions are embedded with {model} but the vector store was built with {self.embedding_model}"
+            )
+
+    @property
+    def delta_count(self) -> int:
+        return max(0, self.ntotal - self.base_count)
+
+    @property
+    def live_count(self) -> int:
+        return self.ntotal - int(np.count_nonzero(self.tombstones < self.ntotal))
+
+    def user_positions(self, user_id: int) -> np.ndarray:
+        """Index positions of every live vector owned by user_id"""
+        return self.group_by_user().get(int(user_id), np.empty(0, dtype=np.int64))
+
+    def group_by_user(self) -> Dict[int, np.ndarray]:
+        """Group live positions by owner. IndexStore calls this while loading,
+        so snapshots it publishes never pay for it on a query; snapshots built
+        elsewhere group on first use.
+        """
+        if self._user_positions is None:
+            with self._positions_lock:
+                if self._user_positions is None:
+                    self._user_positions = self._group_positions_by_user()
+        return self._user_positions
+
+    def _group_positions_by_user(self) -> Dict[int, np.ndarray]:
+        user_ids = np.asarray(self.id_map.user_ids[:self.ntotal])
+        if len(user_ids) == 0:
+            return {}
+        # Deleted vectors are left out here, so neither the subset scan nor the
+        # IDSelector ever sees them and no top_k slot is spent on them
+        live = np.ones(len(user_ids), dtype=bool)
+        live[self.tombstones[self.tombstones < len(user_ids)]] = False
+        order = np.flatnonzero(live)
+        order = order[np.argsort(user_ids[order], kind='stable')]
+        users, starts = np.unique(user_ids[order], return_index=True)
+        groups = np.split(order.astype(np.int64), starts[1:])
+        return {int(user): positions for user, positions in zip(users, groups)}
+
+    def search(self, query: np.ndarray, top_k: int, user_id: int,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               rerank_factor: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top_k among user_id's vectors for a single normalized query.
+
+        Returns (scores, positions), best first. Small tenants are scored
+        directly against their own rows; larger ones use an IDSelector so
+        FAISS skips other tenants' vectors during the scan. nprobe/ef_search
+        tune IVF/HNSW indexes for this query only. A quantized index returns
+        rerank_factor * top_k candidates (default VECTOR_RERANK_FACTOR),
+        which are re-scored exactly; 1 keeps its approximate scores.
+        """
+        positions = self.user_positions(user_id)
+        k = min(top_k, len(positions))
+        if k == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        query = query.reshape(-1)
+        if len(positions) <= SUBSET_SEARCH_MAX_VECTORS:
+            return self._top_k(self.vectors_at(positions) @ query, positions, k)
+
+        # Base rows go through the index, delta rows are scored exactly
+        in_base = positions[positions < self.base_count]
+        in_delta = positions[positions >= self.base_count]
+        scores = [self.vectors_at(in_delta) @ query]
+        found = [in_delta]
+        if len(in_base):
+            params = index_factory.search_parameters(
+                self.index, self._selector(user_id, in_base), nprobe=nprobe, ef_search=ef_search,
+            )
+            depth = k
+            if self.lossy:
+                if rerank_factor is None:
+                    rerank_factor = getattr(settings, 'VECTOR_RERANK_FACTOR', 4)
+                depth = k * max(1, rerank_factor)
+            base_scores, indices = self.index.search(query.reshape(1, -1), min(depth, len(in_base)), params=params)
+            hit = indices[0] >= 0
+            base_scores, indices = base_scores[0][hit], indices[0][hit]
+            if depth > k:
+                # Ascending positions read the vector log front to back
+                indices = np.sort(indices)
+                base_scores = self.vectors_at(indices) @ query
+            scores.append(base_scores)
+            found.append(indices)
+        scores, found = np.concatenate(scores), np.concatenate(found)
+        return self._top_k(scores, found, min(k, len(found)))
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, positions: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if k == 0:
+            return scores[:0], positions[:0]
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return scores[best], positions[best]
+
+    def vectors_at(self, positions: np.ndarray) -> np.ndarray:
+        """Exact stored vectors at positions"""
+        if self.vectors is not None and len(self.vectors) >= self.ntotal:
+            return np.asarray(self.vectors[positions])
+        if len(positions) == 0:
+            return np.empty((0, self.index.d), dtype=np.float32)
+        return self.index.reconstruct_batch(positions)
+
+    def chunk_positions(self, chunk_ids, user_id: int) -> np.ndarray:
+        """Positions of chunk_ids among user_id's live vectors, -1 where absent"""
+        positions = self.user_positions(user_id)
+        wanted = uuid_array(chunk_ids)
+        stored = np.asarray(self.id_map.chunk_ids[positions])
+        found = np.full(len(wanted), -1, dtype=np.int64)
+        hit = np.flatnonzero(np.isin(stored, wanted))
+        order = np.argsort(wanted)
+        found[order[np.searchsorted(wanted, stored[hit], sorter=order)]] = positions[hit]
+        return found
+
+    def _selector(self, user_id: int, positions: np.ndarray):
+        selector = self._selectors.get(int(user_id))
+        if selector is None:
+            selector = faiss.IDSelectorBatch(positions)
+            self._selectors[int(user_id)] = selector
+        return selector
+
+
+class IndexStore(SnapshotStore):
+    """Per-process holder of the serving FAISS index.
+
+    The index is loaded once per worker and shared by every request. With
+    VECTOR_INDEX_MMAP it is memory-mapped read-only, so gunicorn and Celery
+    workers on one host share a single copy in the page cache. The files
+    on disk are re-checked at most every `reload_interval` seconds; when they
+    change, a fresh snapshot is loaded on a background thread and swapped in
+    with a single reference assignment.
+    """
+
+    name = 'FAISS index'
+
+    def __init__(self, path=None, reload_interval: Optional[float] = None):
+        super().__init__(path or settings.VECTOR_DB_PATH, reload_interval)
+
+    def warm(self) -> IndexSnapshot:
+        """Load the index eagerly, e.g. from a worker start hook"""
+        return self.get_snapshot()
+
+    def _current_generation(self) -> tuple:
+        """Identify the on-disk version: the generation directory, the base
+        index file `index.faiss` points to, row count and tombstones.
+
+        Within a generation a new base index is published as a new file and
+        the other files are append-only, so these change whenever anything
+        visible does.
+        """
+        directory = store_dir(self.path)
+        index_path = os.path.realpath(os.path.join(directory, INDEX_FILE))
+        return (
+            directory,
+            (index_path,) + self._stat(index_path),
+            VectorIdMap.row_count(directory),
+            self._stat(os.path.join(directory, TOMBSTONES_FILE))[1],
+        )
+
+    def _load(self, generation: tuple) -> IndexSnapshot:
+        rss_before = resident_memory_bytes()
+        start_time = time.perf_counter()
+
+        # Every file is read from the generation directory the generation
+        # names, even if compaction switches `current` meanwhile
+        directory, (index_path, *_) = generation[:2]
+        index = None
+        if os.path.exists(index_path):
+            index = index_factory.read_for_serving(index_path, mmap=getattr(settings, 'VECTOR_INDEX_MMAP', True))
+        manifest = read_manifest(directory)
+        dimension = manifest.get('dimension') or (index.d if index is not None else None)
+
+        snapshot = IndexSnapshot(
+            index=index,
+            id_map=VectorIdMap.load(directory),
+            vectors=load_vectors(directory, dimension) if dimension else None,
+            tombstones=load_tombstones(directory),
+            embedding_model=manifest.get('embedding_model'),
+            generation=generation,
+            load_seconds=0.0,
+            load_rss_bytes=0,
+        )
+        # The argsort over every owner runs here, on the reload thread, rather
+        # than on the first filtered query after each swap
+        snapshot.group_by_user()
+        snapshot.load_seconds = time.perf_counter() - start_time
+        snapshot.load_rss_bytes = max(0, resident_memory_bytes() - rss_before)
+        logger.info(
+            "Loaded FAISS index (%d vectors, %d unmerged, %d deleted) in %.3fs, +%.1f MB resident",
+            snapshot.ntotal, snapshot.delta_count, snapshot.ntotal - snapshot.live_count, snapshot.load_seconds, snapshot.load_rss_bytes / 2**20,
+        )
+        return snapshot
+
+    def stats(self) -> dict:
+        """Load cost of the current snapshot and of this process"""
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'vectors': snapshot.ntotal if snapshot else 0,
+            'index_type': index_factory.index_type_of(snapshot.index) if snapshot and snapshot.index else None,
+            'index_storage': index_factory.storage_of(snapshot.index) if snapshot and snapshot.index else None,
+            'embedding_model': snapshot.embedding_model if snapshot else None,
+            'unmerged_vectors': snapshot.delta_count if snapshot else 0,
+            'deleted_vectors': snapshot.ntotal - snapshot.live_count if snapshot else 0,
+            'load_seconds': snapshot.load_seconds if snapshot else None,
+            'load_rss_bytes': snapshot.load_rss_bytes if snapshot else None,
+            'loaded_at': snapshot.loaded_at if snapshot else None,
+            'reload_count': self.reload_count,
+            'mmap': getattr(settings, 'VECTOR_INDEX_MMAP', True),
+            'process_rss_bytes': resident_memory_bytes(),
+            'process_memory': process_memory(),
+        }
+
+
+_store: Optional[IndexStore] = None
+_store_lock = threading.Lock()
+
+
+def get_index_store() -> IndexStore:
+    """Process-wide IndexStore singleton"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = IndexStore()
+    return _store
@@ -0,0 +1,427 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import faiss
+import numpy as np
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+from django.conf import settings
+from . import index_factory
+from .id_map import COLUMNS, VectorIdMap, uuid_array
+
+logger = logging.getLogger(__name__)
+
+# Symlink to the newest versioned index file, e.g. index.000042.faiss
+INDEX_FILE = 'index.faiss'
+INDEX_VERSION_PATTERN = re.compile(r'index\.(\d{6})\.faiss')
+VECTORS_FILE = 'vectors.f32'
+TOMBSTONES_FILE = 'tombstones.i64'
+MANIFEST_FILE = 'manifest.json'
+VECTOR_DTYPE = np.dtype('<f4')
+TOMBSTONE_DTYPE = np.dtype('<i8')
+
+# Every data file of one generation
+STORE_FILES = (INDEX_FILE, VECTORS_FILE, TOMBSTONES_FILE, MANIFEST_FILE) + tuple(
+    filename for filename, _ in COLUMNS.values()
+)
+
+# Symlink under VECTOR_DB_PATH naming the generation directory in use, and
+# where compaction writes new generations
+CURRENT_LINK = 'current'
+GENERATIONS_DIR = 'generations'
+
+
+def store_dir(path) -> str:
+    """Directory holding the store files: the generation `current` points to,
+    or path itself for stores that have never been compacted
+    """
+    link = os.path.join(path, CURRENT_LINK)
+    return os.path.realpath(link) if os.path.islink(link) else str(path)
+
+
+def read_manifest(directory) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_atomic(file_path: str, data: bytes):
+    """Replace file_path with data so readers see either the old or the new file"""
+    tmp_path = f"{file_path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    _fsync_dir(os.path.dirname(file_path))
+
+
+def index_versions(directory) -> List[str]:
+    """Names of the versioned index files in directory, oldest first"""
+    try:
+        return sorted(name for name in os.listdir(directory) if INDEX_VERSION_PATTERN.fullmatch(name))
+    except FileNotFoundError:
+        return []
+
+
+def publish_index(directory, index) -> str:
+    """Write index as the next versioned file in directory and atomically
+    repoint the `index.faiss` symlink at it.
+
+    Index files are never rewritten, so readers that memory-mapped an older
+    version keep a consistent view of it. Versions before the previous one
+    are removed; a reader still mapping one keeps it alive until it unmaps.
+    """
+    versions = index_versions(directory)
+    version = int(INDEX_VERSION_PATTERN.fullmatch(versions[-1]).group(1)) + 1 if versions else 1
+    name = f'index.{version:06d}.faiss'
+    faiss.write_index(index, os.path.join(directory, name))
+    _fsync_file(os.path.join(directory, name))
+    replace_symlink(os.path.join(directory, INDEX_FILE), name)
+    for old in versions[:-1]:
+        os.remove(os.path.join(directory, old))
+    return name
+
+
+def replace_symlink(link: str, target: str):
+    """Point link at target in one rename, replacing whatever link was"""
+    tmp_link = f"{link}.tmp.{os.getpid()}"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+    _fsync_dir(os.path.dirname(link))
+
+
+def load_vectors(directory, dimension: int) -> np.ndarray:
+    """Read-only memmap of the (rows, dimension) vector log"""
+    file_path = os.path.join(directory, VECTORS_FILE)
+    row_bytes = dimension * VECTOR_DTYPE.itemsize
+    try:
+        rows = os.path.getsize(file_path) // row_bytes
+    except FileNotFoundError:
+        rows = 0
+    if rows == 0:
+        return np.empty((0, dimension), dtype=VECTOR_DTYPE)
+    return np.memmap(file_path, dtype=VECTOR_DTYPE, mode='r', shape=(rows, dimension))
+
+
+def load_tombstones(directory) -> np.ndarray:
+    """Sorted, unique positions of deleted vectors"""
+    try:
+        return np.unique(np.fromfile(os.path.join(directory, TOMBSTONES_FILE), dtype=TOMBSTONE_DTYPE))
+    except FileNotFoundError:
+        return np.empty(0, dtype=TOMBSTONE_DTYPE)
+
+
+@contextmanager
+def file_lock(file_path: str, blocking: bool = True):
+    """Hold an exclusive lock file; yields False if non-blocking and taken"""
+    with open(file_path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fsync_file(file_path: str):
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class IndexWriter:
+    """Single writer for the on-disk vector store.
+
+    Ingest appends normalized vectors to `vectors.f32` and their IDs to the
+    ID map columns while holding an exclusive file lock, so concurrent Celery
+    workers queue up instead of overwriting each other, and an ingest only
+    writes the new document's rows. Row i of the vector log and of the ID map
+    describe the same vector.
+
+    `index.faiss` holds the first `base_rows` vectors; rows after it form the
+    delta that readers scan exactly until `merge` folds it into a new base
+    index, published as a new versioned file that `index.faiss` is then
+    repointed at.
+
+    Deleting vectors appends their positions to `tombstones.i64`; readers
+    leave them out of every search. `compact` drops them for good by writing
+    a new generation directory and repointing the `current` symlink at it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.VECTOR_DB_PATH
+
+    def lock(self, name: str = 'writer', blocking: bool = True):
+        return file_lock(os.path.join(self.path, f'{name}.lock'), blocking)
+
+    def append(self, vectors: np.ndarray, chunk_ids: Iterable, document_ids: Iterable, user_ids: Iterable[int],
+               model: Optional[str] = None) -> int:
+        """Append normalized vectors and their IDs; returns the new row count.
+        `model` names the embedding model that produced the vectors; a store
+        built by another model, or of another dimension, raises ValueError.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
+        with self.lock():
+            directory = store_dir(self.path)
+            dimension = self._ensure_manifest(directory, vectors.shape[1], model)['dimension']
+            self._backfill_vector_log(directory)
+
+            # Cut back rows left by an interrupted append so all files line up
+            rows = self._aligned_rows(directory, dimension)
+            VectorIdMap.truncate(directory, rows)
+            with open(os.path.join(directory, VECTORS_FILE), 'ab') as f:
+                f.truncate(rows * dimension * VECTOR_DTYPE.itemsize)
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            return VectorIdMap.append(directory, chunk_ids, document_ids, user_ids)
+
+    def read_vectors(self, chunk_ids: Iterable) -> Tuple[List, np.ndarray]:
+        """The live vectors of whichever of chunk_ids have one, and those IDs,
+        in the order given, e.g. to store them again under new chunk IDs
+        """
+        chunk_ids = list(chunk_ids)
+        directory = store_dir(self.path)
+        dimension = read_manifest(directory).get('dimension')
+        if not dimension or not chunk_ids:
+            return [], np.empty((0, dimension or 0), dtype=VECTOR_DTYPE)
+        id_map = VectorIdMap.load(directory)
+        vectors = load_vectors(directory, dimension)
+        wanted = uuid_array(chunk_ids)
+        positions = np.flatnonzero(np.isin(id_map.chunk_ids[:len(vectors)], wanted))
+        positions = np.setdiff1d(positions, load_tombstones(directory))
+        position_of = {id_map.chunk_ids[position]: position for position in positions}
+        found = [(chunk_id, position_of[key]) for chunk_id, key in zip(chunk_ids, wanted) if key in position_of]
+        return [chunk_id for chunk_id, _ in found], np.array(vectors[[position for _, position in found]])
+
+    def delete_documents(self, document_ids: Iterable) -> int:
+        """Tombstone every vector of the given documents; returns how many"""
+        return self._delete(lambda id_map: id_map.positions_for_documents(document_ids))
+
+    def delete_chunks(self, chunk_ids: Iterable) -> int:
+        """Tombstone the vectors of the given chunks; returns how many"""
+        return self._delete(lambda id_map: id_map.positions_for_chunks(chunk_ids))
+
+    def _delete(self, find_positions) -> int:
+        with self.lock():
+            directory = store_dir(self.path)
+            positions = find_positions(VectorIdMap.load(directory))
+            positions = np.setdiff1d(positions, load_tombstones(directory)).astype(TOMBSTONE_DTYPE)
+            if len(positions):
+                with open(os.path.join(directory, TOMBSTONES_FILE), 'ab') as f:
+                    f.write(positions.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            return len(positions)
+
+    def delta_rows(self) -> int:
+        """Vectors appended since the base index was last merged"""
+        directory = store_dir(self.path)
+        manifest = read_manifest(directory)
+        if 'dimension' not in manifest:
+            return 0
+        return self._aligned_rows(directory, manifest['dimension']) - manifest.get('base_rows', 0)
+
+    def needs_merge(self) -> bool:
+        return self.delta_rows() >= getattr(settings, 'VECTOR_INDEX_MERGE_ROWS', 5000)
+
+    def dead_fraction(self) -> float:
+        """Share of stored vectors that are tombstoned"""
+        directory = store_dir(self.path)
+        rows = VectorIdMap.row_count(directory)
+        return len(load_tombstones(directory)) / rows if rows else 0.0
+
+    def needs_compaction(self) -> bool:
+        return self.dead_fraction() >= getattr(settings, 'VECTOR_INDEX_COMPACT_DEAD_FRACTION', 0.2)
+
+    def merge(self) -> bool:
+        """Fold the delta into a new base index, rebuilt if the configured
+        index layout changed; False if there was nothing to do or another
+        merge is already running.
+
+        Appends continue while the merge runs: it only reads rows that already
+        exist, and those are never rewritten.
+        """
+        with self.lock('merge', blocking=False) as acquired:
+            if not acquired:
+                return False
+            with self.lock():
+                directory = store_dir(self.path)
+                manifest = read_manifest(directory)
+                if 'dimension' not in manifest:
+                    return False
+                dimension = manifest['dimension']
+                self._backfill_vector_log(directory)
+                rows = self._aligned_rows(directory, dimension)
+
+            index_path = os.path.join(directory, INDEX_FILE)
+            vectors = load_vectors(directory, dimension)[:rows]
+            base = faiss.read_index(index_path) if os.path.exists(index_path) else None
+            base_rows = base.ntotal if base is not None else 0
+            migrate = base is None or index_factory.needs_migration(base, ntotal=rows)
+            # With no delta, only a change of index layout (e.g. of
+            # VECTOR_INDEX_STORAGE) is worth a rebuild
+            if rows <= base_rows and not (base is not None and migrate):
+                return False
+
+            if migrate:
+                # Rebuilt from the exact vectors, so no quantization error carries over
+                index = index_factory.build_index(np.ascontiguousarray(vectors))
+            else:
+                index_factory.prepare_for_serving(base)
+                base.add(np.ascontiguousarray(vectors[base_rows:]))
+                index = base
+
+            publish_index(directory, index)
+            with self.lock():
+                self._write_manifest(directory, {**read_manifest(directory), 'base_rows': index.ntotal})
+            logger.info("Merged %d delta vectors into a %s (%s) index of %d", rows - base_rows,
+                        index_factory.index_type_of(index), index_factory.storage_of(index), index.ntotal)
+            return True
+
+    def compact(self) -> bool:
+        """Rewrite the store without tombstoned vectors; False if there were
+        none or a merge or compaction is already running.
+
+        The new index is built from the live vectors without blocking ingest.
+        Rows appended and tombstones added meanwhile are carried over under
+        the writer lock, then `current` is switched to the new generation in
+        one rename, so readers load either the old files or the new ones.
+        """
+        with self.lock('merge', blocking=False) as acquired:
+            if not acquired:
+                return False
+            with self.lock():
+                source = store_dir(self.path)
+                manifest = read_manifest(source)
+                if 'dimension' not in manifest:
+                    return False
+                dimension = manifest['dimension']
+                self._backfill_vector_log(source)
+                rows = self._aligned_rows(source, dimension)
+                dead = load_tombstones(source)
+            dead = dead[dead < rows]
+            if not len(dead):
+                return False
+
+            live = np.setdiff1d(np.arange(rows), dead)
+            index = index_factory.build_index(np.ascontiguousarray(load_vectors(source, dimension)[live]))
+
+            with self.lock():
+                # Keep live rows, then anything appended since they were read
+                keep = np.concatenate([live, np.arange(rows, self._aligned_rows(source, dimension))])
+                generation = manifest.get('generation', 0) + 1
+                target = os.path.join(self.path, GENERATIONS_DIR, f'{generation:06d}')
+                shutil.rmtree(target, ignore_errors=True)
+                os.makedirs(target)
+
+                VectorIdMap.load(source).take(keep).save(target)
+                self._write_file(os.path.join(target, VECTORS_FILE), np.ascontiguousarray(load_vectors(source, dimension)[keep]))
+                # Deletions made during the rebuild, renumbered to their new positions
+                late = np.setdiff1d(load_tombstones(source), dead)
+                late = late[np.isin(late, keep)]
+                self._write_file(os.path.join(target, TOMBSTONES_FILE), np.searchsorted(keep, late).astype(TOMBSTONE_DTYPE))
+                publish_index(target, index)
+                self._write_manifest(target, {**manifest, 'base_rows': index.ntotal, 'generation': generation})
+                _fsync_dir(target)
+                self._switch_current(target)
+
+            self._remove_old_generations(keep={target, source})
+            logger.info("Compacted vector store: dropped %d of %d vectors (generation %d)", len(dead), rows, generation)
+            return True
+
+    def _switch_current(self, target: str):
+        replace_symlink(os.path.join(str(self.path), CURRENT_LINK), os.path.relpath(target, self.path))
+
+    def _remove_old_generations(self, keep: set):
+        """Delete generations older than the previous one; readers may still
+        be loading the previous one, and open memmaps survive the unlink
+        """
+        keep = {os.path.realpath(directory) for directory in keep}
+        generations_dir = os.path.join(self.path, GENERATIONS_DIR)
+        for name in os.listdir(generations_dir):
+            directory = os.path.realpath(os.path.join(generations_dir, name))
+            if directory not in keep:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        # Files of a store that predates generations live in the root itself
+        if os.path.realpath(self.path) not in keep:
+            for filename in STORE_FILES + tuple(index_versions(self.path)):
+                file_path = os.path.join(self.path, filename)
+                if os.path.lexists(file_path):
+                    os.remove(file_path)
+
+    @staticmethod
+    def _write_file(file_path: str, array: np.ndarray):
+        with open(file_path, 'wb') as f:
+            f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _aligned_rows(self, directory, dimension: int) -> int:
+        return min(VectorIdMap.row_count(directory), len(load_vectors(directory, dimension)))
+
+    def _ensure_manifest(self, directory, dimension: int, model: Optional[str] = None) -> dict:
+        manifest = read_manifest(directory)
+        if 'dimension' not in manifest:
+            manifest = {**manifest, 'dimension': dimension, 'base_rows': self._base_rows_on_disk(directory)}
+            self._write_manifest(directory, manifest)
+        elif manifest['dimension'] != dimension:
+            raise ValueError(
+                f"Embedding dimension {dimension} does not match the vector store's {manifest['dimension']}"
+            )
+        if model and not manifest.get('embedding_model'):
+            # Stores written before models were recorded adopt the first one
+            manifest = {**manifest, 'embedding_model': model}
+            self._write_manifest(directory, manifest)
+        elif model and manifest['embedding_model'] != model:
+            raise ValueError(
+                f"Embeddings from {model} cannot be added to a vector store built with {manifest['embedding_model']}; "
+                f"switch models with a new VECTOR_DB_PATH and re-ingest the documents"
+            )
+        return manifest
+
+    @staticmethod
+    def _write_manifest(directory, manifest: dict):
+        write_atomic(os.path.join(directory, MANIFEST_FILE), json.dumps(manifest).encode())
+
+    @staticmethod
+    def _base_rows_on_disk(directory) -> int:
+        index_path = os.path.join(directory, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return 0
+        return faiss.read_index(index_path).ntotal
+
+    @staticmethod
+    def _backfill_vector_log(directory):
+        """Stores written before the vector log existed only have index.faiss;
+        recover its vectors once so the log covers every row
+        """
+        index_path = os.path.join(directory, INDEX_FILE)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if os.path.exists(vectors_path) or not os.path.exists(index_path):
+            return
+        vectors = index_factory.reconstruct_all(faiss.read_index(index_path))
+        write_atomic(vectors_path, np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE).tobytes())
+        logger.info("Recovered %d vectors from %s into %s", len(vectors), INDEX_FILE, VECTORS_FILE)
@@ -0,0 +1,473 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from .id_map import UUID_DTYPE, USER_ID_DTYPE, unpack_uuid, uuid_array
+from .index_writer import _fsync_dir, file_lock, write_atomic
+from .snapshot_store import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+DELETED_FILE = 'deleted.uuid'
+SEGMENTS_DIR = 'segments'
+
+# Words and numbers, and identifiers joined by - . / or _ ("ERR-4021",
+# "v2.3.1", "max_retries"); an identifier is indexed whole and by its parts
+TERM_PATTERN = re.compile(r"[^\W_]+(?:[-./_][^\W_]+)*")
+TERM_SEPARATORS = re.compile(r"[-./_]")
+
+# BM25 term frequency saturation and length normalization
+K1, B = 1.2, 0.75
+
+# Terms with fewer postings than this are never skipped as too common
+COMMON_TERM_MIN_POSTINGS = 1000
+
+# Postings per segment row above which scores are summed into a dense array
+DENSE_ACCUMULATOR_RATIO = 8
+
+# Per chunk (row), grouped by owner: its ID, owner and length in terms. Per (user, term) key,
+# sorted: the key's postings are rows[key_offsets[i]:key_offsets[i + 1]].
+# Per user: chunk count and total length, for BM25's corpus statistics.
+SEGMENT_ARRAYS = (
+    'chunk_ids', 'user_ids', 'lengths',
+    'key_users', 'key_terms', 'key_offsets', 'rows', 'tfs',
+    'stat_users', 'stat_docs', 'stat_lengths',
+)
+
+
+def lexical_dir(path=None) -> str:
+    return os.path.join(path or settings.VECTOR_DB_PATH, 'lexical')
+
+
+def lexical_terms(text: str) -> List[str]:
+    """Lowercased terms of `text`, identifiers followed by their parts"""
+    terms = []
+    for match in TERM_PATTERN.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        if not term.isalnum():
+            terms.extend(TERM_SEPARATORS.split(term))
+    return terms
+
+
+@lru_cache(maxsize=2**16)
+def term_hash(term: str) -> int:
+    """Stable 64-bit ID of a term, the same in every process"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+def query_hashes(question: str) -> np.ndarray:
+    return np.array([term_hash(term) for term in set(lexical_terms(question))], dtype=np.uint64)
+
+
+def analyze(texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Postings of the texts as (row, term hash, term frequency) arrays, and
+    each text's length in terms
+    """
+    rows, terms, tfs, lengths = [], [], [], []
+    for row, text in enumerate(texts):
+        counts = Counter(lexical_terms(text))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            rows.append(row)
+            terms.append(term_hash(term))
+            tfs.append(min(tf, 65535))
+    return (
+        np.array(rows, dtype=np.uint32), np.array(terms, dtype=np.uint64),
+        np.array(tfs, dtype=np.uint16), np.array(lengths, dtype=np.uint32),
+    )
+
+
+def build_segment(chunk_ids: np.ndarray, user_ids: np.ndarray, rows: np.ndarray, terms: np.ndarray,
+                  tfs: np.ndarray, lengths: np.ndarray) -> Dict[str, np.ndarray]:
+    """Segment arrays for the given rows and postings"""
+    # Rows are stored grouped by user, so each user's rows form one range
+    user_ids = np.asarray(user_ids, dtype=USER_ID_DTYPE)
+    row_order = np.argsort(user_ids, kind='stable')
+    new_row = np.empty(len(row_order), dtype=np.uint32)
+    new_row[row_order] = np.arange(len(row_order), dtype=np.uint32)
+    chunk_ids = np.asarray(chunk_ids, dtype=UUID_DTYPE)[row_order]
+    user_ids = user_ids[row_order]
+    lengths = np.asarray(lengths, dtype=np.uint32)[row_order]
+    rows = new_row[np.asarray(rows, dtype=np.int64)]
+    terms = np.asarray(terms, dtype=np.uint64)
+    posting_users = user_ids[rows]
+    order = np.lexsort((rows, terms, posting_users))
+    rows, terms, posting_users = rows[order], terms[order], posting_users[order]
+    tfs = np.asarray(tfs, dtype=np.uint16)[order]
+
+    new_key = np.ones(len(rows), dtype=bool)
+    new_key[1:] = (terms[1:] != terms[:-1]) | (posting_users[1:] != posting_users[:-1])
+    key_starts = np.flatnonzero(new_key)
+
+    stat_users, inverse = np.unique(user_ids, return_inverse=True)
+    return {
+        'chunk_ids': chunk_ids,
+        'user_ids': user_ids,
+        'lengths': lengths,
+        'key_users': posting_users[key_starts],
+        'key_terms': terms[key_starts],
+        'key_offsets': np.append(key_starts, len(rows)).astype(np.int64),
+        'rows': rows,
+        'tfs': tfs,
+        'stat_users': stat_users,
+        'stat_docs': np.bincount(inverse, minlength=len(stat_users)).astype(np.int64),
+        'stat_lengths': np.bincount(inverse, weights=lengths, minlength=len(stat_users)).astype(np.int64),
+    }
+
+
+def read_manifest(path) -> dict:
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'segments': [], 'next_segment': 0, 'retired': []}
+
+
+def load_deleted(path) -> np.ndarray:
+    """IDs of deleted chunks, sorted"""
+    try:
+        with open(os.path.join(path, DELETED_FILE), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return np.empty(0, dtype=UUID_DTYPE)
+    # Ignore a record still being appended
+    data = data[:len(data) - len(data) % UUID_DTYPE.itemsize]
+    return np.unique(np.frombuffer(data, dtype=UUID_DTYPE))
+
+
+def load_segment(path, name: str) -> Dict[str, np.ndarray]:
+    directory = os.path.join(path, SEGMENTS_DIR, name)
+    return {array: np.load(os.path.join(directory, f'{array}.npy'), mmap_mode='r') for array in SEGMENT_ARRAYS}
+
+
+class LexicalIndexWriter:
+    """Writer for the on-disk inverted index over chunk text.
+
+    Each `add` writes one immutable segment of .npy arrays and lists it in
+    `manifest.json`, so ingest only ever writes its own chunks. Deleting
+    chunks appends their IDs to `deleted.uuid`; readers mask them out and
+    `merge` drops them for good while folding the smallest segments into
+    one, once there are more than LEXICAL_MAX_SEGMENTS.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or lexical_dir()
+
+    def lock(self, name: str = 'writer', blocking: bool = True):
+        os.makedirs(self.path, exist_ok=True)
+        return file_lock(os.path.join(self.path, f'{name}.lock'), blocking)
+
+    def add(self, chunk_ids: Iterable, user_ids: Iterable[int], texts: Iterable[str]) -> int:
+        """Index chunks by their text; returns the number of chunks added"""
+        rows, terms, tfs, lengths = analyze(texts)
+        return self.add_postings(uuid_array(chunk_ids), user_ids, rows, terms, tfs, lengths)
+
+    def add_postings(self, chunk_ids: np.ndarray, user_ids, rows: np.ndarray, terms: np.ndarray,
+                     tfs: np.ndarray, lengths: np.ndarray) -> int:
+        """Write one segment from already analyzed chunks"""
+        if len(chunk_ids) == 0:
+            return 0
+        staged = self._stage(build_segment(chunk_ids, user_ids, rows, terms, tfs, lengths))
+        with self.lock():
+            manifest = read_manifest(self.path)
+            name = f"{manifest['next_segment']:06d}"
+            os.replace(staged, os.path.join(self.path, SEGMENTS_DIR, name))
+            manifest['segments'].append({'name': name, 'rows': len(chunk_ids)})
+            manifest['next_segment'] += 1
+            self._write_manifest(manifest)
+        return len(chunk_ids)
+
+    def delete_chunks(self, chunk_ids: Iterable) -> int:
+        chunk_ids = uuid_array(chunk_ids)
+        if len(chunk_ids) == 0:
+            return 0
+        with self.lock():
+            with open(os.path.join(self.path, DELETED_FILE), 'ab') as f:
+                f.write(chunk_ids.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return len(chunk_ids)
+
+    def needs_merge(self) -> bool:
+        return len(read_manifest(self.path)['segments']) > settings.LEXICAL_MAX_SEGMENTS
+
+    def merge(self) -> bool:
+        """Rewrite the smallest segments, without their deleted chunks, as one.
+
+        Enough segments are merged to bring the count down to half of
+        LEXICAL_MAX_SEGMENTS; small recent segments are merged often and
+        large old ones rarely. Ingest keeps adding segments meanwhile. The
+        replaced segments are removed at the following merge, so readers
+        still opening them are not cut off. Returns False if another merge
+        is running or there is nothing to merge.
+        """
+        with self.lock('merge', blocking=False) as acquired:
+            if not acquired:
+                return False
+            with self.lock():
+                manifest = read_manifest(self.path)
+                deleted = load_deleted(self.path)
+                deleted_bytes = self._deleted_size()
+            segments = sorted(manifest['segments'], key=lambda segment: segment['rows'])
+            count = len(segments) - settings.LEXICAL_MAX_SEGMENTS // 2 + 1
+            merged = [segment['name'] for segment in segments[:max(count, 2)]] if len(segments) > 1 else []
+            if not merged:
+                return False
+
+            arrays = self._merge_arrays([load_segment(self.path, name) for name in merged], deleted)
+            staged = self._stage(arrays) if len(arrays['chunk_ids']) else None
+
+            with self.lock():
+                manifest = read_manifest(self.path)
+                remaining = [segment for segment in manifest['segments'] if segment['name'] not in merged]
+                if staged:
+                    name = f"{manifest['next_segment']:06d}"
+                    os.replace(staged, os.path.join(self.path, SEGMENTS_DIR, name))
+                    remaining.append({'name': name, 'rows': len(arrays['chunk_ids'])})
+                    manifest['next_segment'] += 1
+                for name in manifest.get('retired', []):
+                    shutil.rmtree(os.path.join(self.path, SEGMENTS_DIR, name), ignore_errors=True)
+                manifest['segments'], manifest['retired'] = remaining, merged
+                self._prune_deleted(deleted, deleted_bytes, remaining)
+                self._write_manifest(manifest)
+        logger.info("Merged %d lexical index segments", len(merged))
+        return True
+
+    @staticmethod
+    def _merge_arrays(segments: List[Dict[str, np.ndarray]], deleted: np.ndarray) -> Dict[str, np.ndarray]:
+        chunk_ids, user_ids, lengths, rows, terms, tfs = [], [], [], [], [], []
+        base = 0
+        for segment in segments:
+            live = ~np.isin(segment['chunk_ids'], deleted)
+            # New row number of every live row
+            renumber = np.cumsum(live, dtype=np.int64) - 1 + base
+            posting_terms = np.repeat(np.asarray(segment['key_terms']), np.diff(segment['key_offsets']))
+            keep = live[segment['rows']]
+            rows.append(renumber[segment['rows'][keep]])
+            terms.append(posting_terms[keep])
+            tfs.append(np.asarray(segment['tfs'])[keep])
+            chunk_ids.append(segment['chunk_ids'][live])
+            user_ids.append(segment['user_ids'][live])
+            lengths.append(segment['lengths'][live])
+            base += int(live.sum())
+        return build_segment(*(np.concatenate(parts) for parts in (chunk_ids, user_ids, rows, terms, tfs, lengths)))
+
+    def _prune_deleted(self, deleted: np.ndarray, deleted_bytes: int, segments: List[dict]):
+        """Forget deleted IDs no remaining segment holds; IDs recorded since
+        the merge started are kept, as the merged segment may hold them
+        """
+        still_indexed = np.zeros(len(deleted), dtype=bool)
+        for segment in segments:
+            still_indexed |= np.isin(deleted, load_segment(self.path, segment['name'])['chunk_ids'])
+        deleted_path = os.path.join(self.path, DELETED_FILE)
+        recent = b''
+        if os.path.exists(deleted_path):
+            with open(deleted_path, 'rb') as f:
+                f.seek(deleted_bytes)
+                recent = f.read()
+        write_atomic(deleted_path, deleted[still_indexed].tobytes() + recent)
+
+    def _deleted_size(self) -> int:
+        try:
+            return os.path.getsize(os.path.join(self.path, DELETED_FILE))
+        except FileNotFoundError:
+            return 0
+
+    def _stage(self, arrays: Dict[str, np.ndarray]) -> str:
+        """Write segment arrays to a temporary directory, to be renamed into place"""
+        staged = os.path.join(self.path, SEGMENTS_DIR, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(staged)
+        for array in SEGMENT_ARRAYS:
+            with open(os.path.join(staged, f'{array}.npy'), 'wb') as f:
+                np.save(f, arrays[array])
+                f.flush()
+                os.fsync(f.fileno())
+        _fsync_dir(staged)
+        return staged
+
+    def _write_manifest(self, manifest: dict):
+        write_atomic(os.path.join(self.path, MANIFEST_FILE), json.dumps(manifest).encode())
+
+
+class LexicalSnapshot:
+    """The segments listed in one version of the manifest, with deleted
+    chunks masked. Never mutated after loading, so searches holding one keep
+    working while the store swaps in a newer snapshot.
+    """
+
+    def __init__(self, segments: List[Dict[str, np.ndarray]], deleted: np.ndarray, generation: tuple):
+        self.segments = segments
+        self.generation = generation
+        self.max_df_fraction = settings.LEXICAL_MAX_DF_FRACTION
+
+        # BM25 corpus statistics per user; like most engines these still
+        # count deleted chunks until a merge drops them
+        stats = [np.concatenate([segment[name] for segment in segments] or [np.empty(0, dtype=np.int64)])
+                 for name in ('stat_users', 'stat_docs', 'stat_lengths')]
+        self.users, inverse = np.unique(stats[0], return_inverse=True)
+        self.user_docs = np.bincount(inverse, weights=stats[1], minlength=len(self.users))
+        self.user_lengths = np.bincount(inverse, weights=stats[2], minlength=len(self.users))
+        average_lengths = self.user_lengths / np.maximum(self.user_docs, 1)
+
+        # Each row's BM25 length normalization, against its owner's average
+        self.norms = [
+            (K1 * (1 - B + B * segment['lengths'] / average_lengths[np.searchsorted(self.users, segment['user_ids'])]))
+            .astype(np.float32)
+            for segment in segments
+        ]
+        self.dead = [
+            np.flatnonzero(np.isin(segment['chunk_ids'], deleted)) if len(deleted) else None for segment in segments
+        ]
+
+    @property
+    def chunk_count(self) -> int:
+        return sum(len(segment['chunk_ids']) for segment in self.segments)
+
+    def user_stats(self, user_id: int) -> Tuple[int, int]:
+        """(chunks, total length in terms) of user_id's indexed chunks"""
+        at = int(np.searchsorted(self.users, user_id))
+        if at == len(self.users) or self.users[at] != user_id:
+            return 0, 0
+        return int(self.user_docs[at]), int(self.user_lengths[at])
+
+    def search(self, question: str, user_id: int, top_k: int) -> List[Tuple[uuid.UUID, float]]:
+        """(chunk_id, BM25 score) of user_id's best matching chunks, best first"""
+        return self.search_terms(query_hashes(question), user_id, top_k)
+
+    def search_terms(self, hashes: np.ndarray, user_id: int, top_k: int) -> List[Tuple[uuid.UUID, float]]:
+        docs, _ = self.user_stats(user_id)
+        hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+        if docs == 0 or len(hashes) == 0 or top_k <= 0:
+            return []
+
+        # Look up each term's postings for this user in every segment
+        postings = []
+        df = np.zeros(len(hashes))
+        # Of the segment's dtype, so searchsorted does not convert the whole array
+        user = np.array(user_id, dtype=USER_ID_DTYPE)
+        for index, segment in enumerate(self.segments):
+            key_users = segment['key_users']
+            low = int(np.searchsorted(key_users, user, side='left'))
+            high = int(np.searchsorted(key_users, user, side='right'))
+            if low == high:
+                continue
+            key_terms = segment['key_terms'][low:high]
+            at = np.searchsorted(key_terms, hashes)
+            found = at < len(key_terms)
+            found[found] = key_terms[at[found]] == hashes[found]
+            for term in np.flatnonzero(found):
+                start, end = segment['key_offsets'][low + at[term]:low + at[term] + 2]
+                df[term] += end - start
+                postings.append((index, term, int(start), int(end)))
+
+        idf = np.log1p((docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Terms in most of a large corpus barely change the ranking but have
+        # the longest posting lists
+        common = df > max(self.max_df_fraction * docs, COMMON_TERM_MIN_POSTINGS)
+
+        scores, chunk_ids = [], []
+        for index, segment in enumerate(self.segments):
+            terms = [(term, start, end) for i, term, start, end in postings if i == index and not common[term]]
+            if not terms:
+                continue
+            rows = np.concatenate([segment['rows'][start:end] for _, start, end in terms])
+            tf = np.concatenate([segment['tfs'][start:end] for _, start, end in terms]).astype(np.float32)
+            weight = np.repeat(idf[[term for term, _, _ in terms]], [end - start for _, start, end in terms])
+            contributions = weight * tf * (K1 + 1) / (tf + self.norms[index][rows])
+            # This user's rows, a contiguous range of the segment
+            first_row = int(np.searchsorted(segment['user_ids'], user, side='left'))
+            row_count = int(np.searchsorted(segment['user_ids'], user, side='right')) - first_row
+            dead = self.dead[index]
+            if dead is not None:
+                dead = dead[np.searchsorted(dead, first_row):np.searchsorted(dead, first_row + row_count)] - first_row
+            best, best_scores = self._best_rows(rows - first_row, contributions, row_count, dead, top_k)
+            best += first_row
+            scores.append(best_scores)
+            chunk_ids.append(segment['chunk_ids'][best])
+
+        if not scores:
+            return []
+        scores, chunk_ids = np.concatenate(scores), np.concatenate(chunk_ids)
+        best = _top_k(scores, top_k)
+        return [(unpack_uuid(chunk_ids[i]), float(scores[i])) for i in best]
+
+    @staticmethod
+    def _best_rows(rows: np.ndarray, contributions: np.ndarray, row_count: int, dead: Optional[np.ndarray],
+                   top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The top_k rows by summed contributions, and their scores, leaving
+        out deleted rows
+        """
+        if len(rows) * DENSE_ACCUMULATOR_RATIO > row_count:
+            # Summing into one slot per row beats sorting long posting lists
+            totals = np.bincount(rows, weights=contributions, minlength=row_count)
+            if dead is not None:
+                totals[dead] = 0
+            best = _top_k(totals, top_k)
+            return best, totals[best]
+        matched, inverse = np.unique(rows, return_inverse=True)
+        totals = np.bincount(inverse, weights=contributions)
+        if dead is not None:
+            alive = ~np.isin(matched, dead)
+            matched, totals = matched[alive], totals[alive]
+        best = _top_k(totals, top_k)
+        return matched[best], totals[best]
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest positive scores, best first"""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(len(scores))
+    best = best[scores[best] > 0]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+class LexicalStore(SnapshotStore):
+    """Per-process holder of the lexical index, reloaded the way IndexStore
+    reloads the FAISS index: the manifest and delete log are re-checked at
+    most every `reload_interval` seconds and, when they change, a snapshot
+    is loaded on a background thread and swapped in. Segments are
+    memory-mapped and reused across snapshots, so pages are shared between
+    workers and a reload only maps new segments.
+    """
+
+    name = 'lexical index'
+
+    def __init__(self, path=None, reload_interval: Optional[float] = None):
+        super().__init__(path or lexical_dir(), reload_interval)
+        self._segments: Dict[str, Dict[str, np.ndarray]] = {}
+
+    def _current_generation(self) -> tuple:
+        return tuple(self._stat(os.path.join(self.path, name)) for name in (MANIFEST_FILE, DELETED_FILE))
+
+    def _load(self, generation: tuple) -> LexicalSnapshot:
+        names = [segment['name'] for segment in read_manifest(self.path)['segments']]
+        segments = {name: self._segments.get(name) or load_segment(self.path, name) for name in names}
+        self._segments = segments
+        return LexicalSnapshot(list(segments.values()), load_deleted(self.path), generation)
+
+
+_store: Optional[LexicalStore] = None
+_store_lock = threading.Lock()
+
+
+def get_lexical_store() -> LexicalStore:
+    """Process-wide LexicalStore singleton"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LexicalStore()
+    return _store
@@ -1,9 +1,12 @@
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 from django.conf import settings
 from django.core.cache import cache
 import hashlib
 import json
 from ..models import DocumentChunk
+from .context_packing import PackedContext, pack_context
+from .tokens import count_tokens
+from .tracing import span
 
 from langchain.chat_models import init_chat_model
 from langchain.chains import LLMChain
@@ -15,9 +18,9 @@ load_dotenv()
 
 
 class LLMService:
-    def __init__(self):
+    def __init__(self, llm=None):
         # Initialize Gemini model via LangChain
-        self.llm = init_chat_model("gemini-1.5-flash", model_provider="google_genai",api_key=os.environ.get("GOOGLE_API_KEY"))
+        self.llm = llm or init_chat_model("gemini-1.5-flash", model_provider="google_genai",api_key=os.environ.get("GOOGLE_API_KEY"))
           
         self.max_tokens = 1000
         self.temperature = 0.1
@@ -31,33 +34,18 @@ class LLMService:
         if cached_response:
             return cached_response
 
-        # Prepare context from retrieved chunks
+        # Pack the retrieved chunks into the context token budget
         context = self._prepare_context(relevant_chunks)
 
-        # Define the prompt
-        prompt_template = PromptTemplate(
-            input_variables=["context", "question"],
-            template = (
-                "You are a precise and reliable assistant. "
-                "Answer the user's question strictly based on the provided context and also explain your answer. "
-                "Do not include any information that is not in the context. "
-                "If the answer cannot be found, say: 'I cannot find this information in the provided context.'\n\n"
-                "Avoid speculation.\n\n"
-                "Context:\n{context}\n\n"
-                "Question:\n{question}\n\n"
-                "Answer:"
-            )
-
-        )
-
-        chain = LLMChain(llm=self.llm, prompt=prompt_template)
+        chain = LLMChain(llm=self.llm, prompt=self._prompt_template())
 
         try:
             # Run the chain
-            answer = chain.run({"context": context, "question": question}).strip()
+            with span('llm'):
+                answer = chain.run({"context": context.text, "question": question}).strip()
 
-            # Prepare sources
-            sources = self._prepare_sources(relevant_chunks)
+            # Cite only the chunks the answer was given
+            sources = self._prepare_sources(context.chunks)
 
             result = {
                 "answer": answer,
@@ -68,7 +56,7 @@ class LLMService:
             # Cache the response for 1 hour
             cache.set(cache_key, result, 3600)
 
-            return result
+            return {**result, **self._context_stats(question, context)}
 
         except Exception as e:
             return {
@@ -77,14 +65,90 @@ class LLMService:
                 #"confidence": 0.0
             }
 
-    
-    def _prepare_context(self, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> str:
-        """Prepare context string from retrieved chunks"""
-        context_parts = []
-        for i, (chunk, score) in enumerate(relevant_chunks, 1):
-            context_parts.append(f"Context {i}:\n{chunk.content}\n")
-        
-        return "\n".join(context_parts)
+    async def agenerate_answer(self, question: str, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> dict:
+        """Async variant of generate_answer for the ASGI code path"""
+        cache_key = self._generate_cache_key(question, relevant_chunks)
+        cached_response = await cache.aget(cache_key)
+        if cached_response:
+            return cached_response
+
+        context = self._prepare_context(relevant_chunks)
+        chain = LLMChain(llm=self.llm, prompt=self._prompt_template())
+
+        try:
+            with span('llm'):
+                answer = (await chain.arun({"context": context.text, "question": question})).strip()
+            result = {
+                "answer": answer,
+                "sources": self._prepare_sources(context.chunks),
+            }
+            await cache.aset(cache_key, result, 3600)
+            return {**result, **self._context_stats(question, context)}
+
+        except Exception as e:
+            return {
+                "answer": f"I apologize, but I encountered an error while processing your question: {str(e)}",
+                "sources": []
+            }
+
+    async def astream_answer(self, question: str, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> AsyncIterator[dict]:
+        """Stream an answer as events: one 'sources' event, then 'token'
+        events as the model produces text. Answers not served from the cache
+        start with a 'context' event carrying the prompt's size and packing
+        time. The full answer is cached once the stream completes, exactly
+        like generate_answer.
+        """
+        cache_key = self._generate_cache_key(question, relevant_chunks)
+        cached_response = await cache.aget(cache_key)
+        if cached_response:
+            yield {"event": "sources", "data": cached_response["sources"]}
+            yield {"event": "token", "data": cached_response["answer"]}
+            return
+
+        context = self._prepare_context(relevant_chunks)
+        sources = self._prepare_sources(context.chunks)
+        yield {"event": "context", "data": self._context_stats(question, context)}
+        yield {"event": "sources", "data": sources}
+
+        prompt = self._prompt_template().format_prompt(context=context.text, question=question)
+        parts = []
+        try:
+            with span('llm'):
+                async for message_chunk in self.llm.astream(prompt):
+                    if message_chunk.content:
+                        parts.append(message_chunk.content)
+                        yield {"event": "token", "data": message_chunk.content}
+        except Exception as e:
+            yield {"event": "error", "data": f"I apologize, but I encountered an error while processing your question: {str(e)}"}
+            return
+
+        await cache.aset(cache_key, {"answer": "".join(parts).strip(), "sources": sources}, 3600)
+
+    def _prompt_template(self) -> PromptTemplate:
+        return PromptTemplate(
+            input_variables=["context", "question"],
+            template = (
+                "You are a precise and reliable assistant. "
+                "Answer the user's question strictly based on the provided context and also explain your answer. "
+                "Do not include any information that is not in the context. "
+                "If the answer cannot be found, say: 'I cannot find this information in the provided context.'\n\n"
+                "Avoid speculation.\n\n"
+                "Context:\n{context}\n\n"
+                "Question:\n{question}\n\n"
+                "Answer:"
+            )
+
+        )
+
+    def _prepare_context(self, relevant_chunks: List[Tuple[DocumentChunk, float]]) -> PackedContext:
+        """Context from retrieved chunks, merged and packed into CONTEXT_TOKEN_BUDGET"""
+        with span('context_packing'):
+            return pack_context(relevant_chunks)
+
+    def _context_stats(self, question: str, context: PackedContext) -> dict:
+        """Estimated prompt tokens and context packing seconds, for the QueryLog"""
+        prompt = self._prompt_template().format(context=context.text, question=question)
+        return {"prompt_tokens": count_tokens(prompt), "context_packing_time": context.seconds}
     
     def _create_prompt(self, question: str, context: str) -> str:
         """Create the prompt for the LLM"""
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from django.conf import settings
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Loaded models and inference pools, shared by every provider instance in the
+# process: services build a provider per task, a model is loaded once
+_encoders: Dict[tuple, object] = {}
+_executors: Dict[int, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+class LocalEmbeddings:
+    """Embedding provider running a sentence-transformers model on this
+    machine's CPU, so ingest and questions make no network round-trip.
+
+    Select it with EMBEDDING_PROVIDER = 'myapp.services.local_embeddings.LocalEmbeddings'
+    and EMBEDDING_MODEL naming the model; EMBEDDING_PROVIDER_OPTIONS is
+    passed through to SentenceTransformer (e.g. backend='onnx'). Needs the
+    optional `sentence-transformers` package unless an `encoder` with the
+    same `encode` method is given.
+
+    Texts are batched dynamically: sorted by length, so each batch pads to
+    similar lengths, and cut at `batch_size` texts or `max_batch_tokens`
+    estimated tokens. Batches run on `threads` inference threads. `warm`
+    loads the weights and runs one batch, from a worker start hook.
+    """
+
+    def __init__(self, model: Optional[str] = None, batch_size: Optional[int] = None,
+                 max_batch_tokens: Optional[int] = None, threads: Optional[int] = None, encoder=None, **options):
+        self.model = model or settings.EMBEDDING_MODEL
+        self.batch_size = batch_size or settings.LOCAL_EMBEDDING_BATCH_SIZE
+        self.max_batch_tokens = max_batch_tokens or settings.LOCAL_EMBEDDING_MAX_BATCH_TOKENS
+        self.threads = threads or settings.LOCAL_EMBEDDING_THREADS
+        self.options = options
+        self._encoder = encoder
+
+    @property
+    def encoder(self):
+        # Loaded on first use, or by warm(), so configuring the provider is cheap
+        if self._encoder is None:
+            key = (self.model, repr(sorted(self.options.items())))
+            with _lock:
+                if key not in _encoders:
+                    from sentence_transformers import SentenceTransformer
+                    _encoders[key] = SentenceTransformer(self.model, device='cpu', **self.options)
+                self._encoder = _encoders[key]
+        return self._encoder
+
+    def warm(self) -> float:
+        """Load the model and run a batch through it; returns the seconds taken"""
+        start = time.perf_counter()
+        self.embed_documents(['warm up'] * min(self.batch_size, 8))
+        seconds = time.perf_counter() - start
+        logger.info("Warmed up embedding model %s in %.2fs", self.model, seconds)
+        return seconds
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = self._batches(texts)
+        if len(batches) == 1 or self.threads <= 1:
+            results = [self._encode(texts, batch) for batch in batches]
+        else:
+            with _lock:
+                if self.threads not in _executors:
+                    _executors[self.threads] = ThreadPoolExecutor(self.threads, thread_name_prefix='local-embed')
+            results = list(_executors[self.threads].map(lambda batch: self._encode(texts, batch), batches))
+
+        vectors = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+        for batch, encoded in zip(batches, results):
+            vectors[batch] = encoded
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def _batches(self, texts: List[str]) -> List[np.ndarray]:
+        """Positions of texts grouped into batches, shortest texts first"""
+        lengths = np.array([count_tokens(text) for text in texts])
+        batches, current = [], []
+        for position in np.argsort(lengths, kind='stable'):
+            # Every text in a batch is padded to its longest, the current one
+            if current and (len(current) >= self.batch_size
+                            or (len(current) + 1) * lengths[position] > self.max_batch_tokens):
+                batches.append(np.array(current))
+                current = []
+            current.append(position)
+        batches.append(np.array(current))
+        return batches
+
+    def _encode(self, texts: List[str], batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.encoder.encode(
+            [texts[i] for i in batch], batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False,
+        ), dtype=np.float32)
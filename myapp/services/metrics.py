@@ -0,0 +1,309 @@
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from .index_writer import file_lock, write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets (plus +Inf)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (metric name, sorted label pairs)
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+Collector = Callable[[], Iterable[Tuple[str, dict, float]]]
+
+
+# Totals of exited processes, folded in from their files by `collect`
+ARCHIVE_FILE = 'archive.json'
+
+# Leads each file name. Containers sharing METRICS_DIR have their own pid
+# namespaces, so a process's liveness is only checked from its own host (the
+# container ID, in Docker)
+HOST_NAME = socket.gethostname()
+
+
+def series_key(name: str, labels: dict) -> SeriesKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def process_start(pid: int) -> Optional[str]:
+    """Start time of process pid in clock ticks since boot, which tells it
+    apart from a later process reusing the pid, or None if unknown
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesized command name; starttime is the 22nd overall
+            return f.read().rpartition(')')[2].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def process_alive(pid: int, start: str) -> bool:
+    """Whether the process that wrote a metrics file is still running. Files
+    named by pid alone, from before start times were recorded, are matched on
+    the pid.
+    """
+    current = process_start(pid)
+    if current is not None and start:
+        return current == start
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Latency histograms and counters of one process, shared with the
+    others writing to the same directory through files.
+
+    Gunicorn and Celery workers are separate processes, so each one writes
+    its cumulative values to `<directory>/<host>-<pid>-<start time>.json` at
+    most every `flush_interval` seconds, and `collect` adds up every
+    process's file. The start time keeps a process that reuses a pid from
+    overwriting the previous owner's totals. `collect` folds the files of
+    this host's exited processes into `archive.json` and deletes them, so counters never go
+    backwards when a worker is recycled and the directory does not grow
+    with every restart. Collectors are callables returning (name, labels,
+    value) counters that are read at each flush, for counts kept elsewhere
+    such as an LRU cache's hits.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: Optional[float] = None):
+        self.directory = str(directory or settings.METRICS_DIR)
+        self.flush_interval = settings.METRICS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Also run in a forked child, which must not report its parent's values
+        self._pid = os.getpid()
+        self._file_name = f'{HOST_NAME}-{self._pid}-{process_start(self._pid) or time.time_ns()}.json'
+        self._histograms: Dict[SeriesKey, list] = {}
+        self._counters: Dict[SeriesKey, float] = {}
+        self._flushed_at = time.monotonic()
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.observe_series(series_key(name, labels), seconds)
+
+    def observe_series(self, key: SeriesKey, seconds: float):
+        """observe() for a key from series_key, which callers on a hot path reuse"""
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+        self._maybe_flush()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = series_key(name, labels)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def register_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """This process's values, in the form written to its file"""
+        with self._lock:
+            histograms = [[name, dict(labels), counts[:], total] for (name, labels), (counts, total) in self._histograms.items()]
+            counters = [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+        for collector in self._collectors:
+            try:
+                counters.extend([name, {k: str(v) for k, v in labels.items()}, value] for name, labels, value in collector())
+            except Exception:
+                logger.warning("Metrics collector failed", exc_info=True)
+        return {'histograms': histograms, 'counters': counters}
+
+    def flush(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            file_path = os.path.join(self.directory, self._file_name)
+            with open(f'{file_path}.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(f'{file_path}.tmp', file_path)
+        except OSError:
+            logger.warning("Could not write metrics to %s", self.directory, exc_info=True)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at < self.flush_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._flushed_at < self.flush_interval:
+                return
+            self._flushed_at = time.monotonic()
+        self.flush()
+
+    def collect(self) -> Tuple[Dict[SeriesKey, list], Dict[SeriesKey, float]]:
+        """(histograms, counters) summed over every process writing to the
+        directory, this one with its current values
+        """
+        snapshots = [self.snapshot()]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Held while reading too, so no scrape sees a file both in the
+            # archive and on its own
+            with file_lock(os.path.join(self.directory, 'collect.lock')):
+                snapshots.extend(self._read_files())
+        except OSError:
+            logger.warning("Could not read metrics from %s", self.directory, exc_info=True)
+        return merge_snapshots(snapshots)
+
+    def fold_exited(self):
+        """Fold the files of this host's exited processes into the archive.
+
+        `collect` does this on every scrape; worker processes do it when they
+        start, so a host that never serves /metrics (a Celery container)
+        does not leave a file behind for every worker it restarts.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with file_lock(os.path.join(self.directory, 'collect.lock')):
+                self._fold_exited()
+        except OSError:
+            logger.warning("Could not fold metrics in %s", self.directory, exc_info=True)
+
+    def _read_files(self) -> List[dict]:
+        """Snapshots of the archive and of every other live process, after
+        folding the files of exited processes into the archive
+        """
+        archive, live = self._fold_exited()
+        return [archive] + [snapshot for snapshot in map(_read_json, live) if snapshot]
+
+    def _fold_exited(self) -> Tuple[dict, List[str]]:
+        """(archive, files of processes that may still be running); files
+        of other hosts' processes count as running, as their own host folds
+        them
+        """
+        archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+        archive = _read_json(archive_path) or {'histograms': [], 'counters': [], 'folded': []}
+        # Files already in the archive, in case deleting them failed last time
+        folded = set(archive.get('folded', []))
+        live, dead = [], []
+        for file_path in glob.glob(os.path.join(self.directory, '*.json')):
+            name = os.path.basename(file_path)
+            if name in (self._file_name, ARCHIVE_FILE) or name in folded:
+                continue
+            # <host>-<pid>-<start>, or <pid>-<start> and <pid> from before
+            # hosts and start times were recorded
+            parts = name[:-len('.json')].rsplit('-', 2)
+            host = parts[0] if len(parts) == 3 else HOST_NAME
+            pid, start = parts[-2:] if len(parts) > 1 else (parts[0], '')
+            try:
+                alive = host != HOST_NAME or process_alive(int(pid), start)
+            except ValueError:
+                continue
+            (live if alive else dead).append(file_path)
+
+        if dead:
+            histograms, counters = merge_snapshots([archive] + [snapshot for snapshot in map(_read_json, dead) if snapshot])
+            names = [os.path.basename(file_path) for file_path in dead]
+            archive = {
+                'histograms': [[name, dict(labels), counts, total] for (name, labels), (counts, total) in histograms.items()],
+                'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+                'folded': [name for name in folded if os.path.exists(os.path.join(self.directory, name))] + names,
+            }
+            write_atomic(archive_path, json.dumps(archive).encode())
+            for file_path in dead:
+                for path in (file_path, f'{file_path}.tmp'):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        return archive, live
+
+
+def _read_json(file_path: str) -> Optional[dict]:
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge_snapshots(snapshots: Iterable[dict]) -> Tuple[Dict[SeriesKey, list], Dict[SeriesKey, float]]:
+    """Sum the histograms and counters of several processes' snapshots"""
+    histograms: Dict[SeriesKey, list] = {}
+    counters: Dict[SeriesKey, float] = {}
+    for snapshot in snapshots:
+        for name, labels, counts, total in snapshot['histograms']:
+            merged = histograms.setdefault(series_key(name, labels), [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+        for name, labels, value in snapshot['counters']:
+            key = series_key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render(histograms: Dict[SeriesKey, list], counters: Dict[SeriesKey, float],
+           gauges: Dict[SeriesKey, float], help_text: Dict[str, str]) -> str:
+    """Prometheus text exposition format of the given series"""
+    lines = []
+
+    def header(name: str, kind: str):
+        if name in help_text:
+            lines.append(f"# HELP {name} {help_text[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def labels_text(labels, extra=()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+    for kind, series in (('counter', counters), ('gauge', gauges)):
+        for name in sorted({name for name, _ in series}):
+            header(name, kind)
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name == name:
+                    lines.append(f"{name}{labels_text(labels)} {_number(value)}")
+
+    for name in sorted({name for name, _ in histograms}):
+        header(name, 'histogram')
+        for (series_name, labels), (counts, total) in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{labels_text(labels)} {_number(total)}")
+            lines.append(f"{name}_count{labels_text(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Process-wide MetricsRegistry singleton"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
@@ -0,0 +1,91 @@
+import multiprocessing
+import PyPDF2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+
+# Readers opened by pool worker processes, reused across the page ranges
+# they are given so the page tree is only parsed once per worker
+_worker_readers: Dict[str, PyPDF2.PdfReader] = {}
+
+
+def count_pages(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def extract_pages(pdf_reader: PyPDF2.PdfReader, start: int, stop: int) -> List[Tuple[str, int]]:
+    """Text of pages [start, stop) as (text, 1-based page number), skipping
+    empty pages
+    """
+    pages_text = []
+    for page_num in range(start, min(stop, len(pdf_reader.pages))):
+        text = pdf_reader.pages[page_num].extract_text()
+        if text.strip():  # Only add non-empty pages
+            pages_text.append((text, page_num + 1))
+    _forget_parsed_objects(pdf_reader)
+    return pages_text
+
+
+def _forget_parsed_objects(pdf_reader: PyPDF2.PdfReader):
+    """Drop the content streams and resources the reader parsed for the pages
+    read so far, which it would otherwise keep for the rest of the document.
+
+    `resolved_objects` is PyPDF2's internal cache of parsed objects (a dict
+    in PyPDF2 3.x), re-parsed on demand once cleared. Should a release rename
+    or replace it, nothing is cleared and memory grows with the document as
+    it did before, but extraction still works.
+    """
+    resolved_objects = getattr(pdf_reader, 'resolved_objects', None)
+    if isinstance(resolved_objects, dict):
+        resolved_objects.clear()
+
+
+def _extract_in_worker(file_path: str, start: int, stop: int) -> List[Tuple[str, int]]:
+    pdf_reader = _worker_readers.get(file_path)
+    if pdf_reader is None:
+        # Passing an open file keeps PyPDF2 reading lazily instead of loading the whole file
+        pdf_reader = _worker_readers[file_path] = PyPDF2.PdfReader(open(file_path, 'rb'))
+    return extract_pages(pdf_reader, start, stop)
+
+
+def iter_pdf_pages(file_path: str, workers: Optional[int] = None,
+                   pages_per_task: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+    """Yield (text, page number) for each non-empty page, in page order.
+
+    Pages are extracted `pages_per_task` at a time and handed on before the
+    next range is read, so memory stays bounded by one range rather than the
+    whole document. With `workers` > 0 the ranges are extracted in a process
+    pool, at most two per worker in flight so a slow consumer does not let
+    finished pages pile up. A daemonic process, such as a Celery prefork
+    worker, cannot start a pool and extracts in-process instead.
+    """
+    workers = settings.PDF_EXTRACTION_WORKERS if workers is None else workers
+    pages_per_task = pages_per_task or settings.PDF_PAGES_PER_TASK
+
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        ranges = [(start, start + pages_per_task) for start in range(0, len(pdf_reader.pages), pages_per_task)]
+        if workers <= 0 or len(ranges) <= 1 or multiprocessing.current_process().daemon:
+            for start, stop in ranges:
+                yield from extract_pages(pdf_reader, start, stop)
+            return
+
+    yield from _iter_pages_in_pool(file_path, ranges, workers)
+
+
+def _iter_pages_in_pool(file_path: str, ranges: List[Tuple[int, int]], workers: int) -> Iterator[Tuple[str, int]]:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        remaining = iter(ranges)
+        for start, stop in remaining:
+            pending.append(executor.submit(_extract_in_worker, file_path, start, stop))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            pages_text = pending.popleft().result()
+            next_range = next(remaining, None)
+            if next_range is not None:
+                pending.append(executor.submit(_extract_in_worker, file_path, *next_range))
+            yield from pages_text
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+from django.conf import settings
+from .embedding_cache import embed_queries, embedding_cache_key
+from .embeddings import embedding_model_name, get_embedding_model
+from .lru import LRUCache
+from .metrics import get_metrics
+
+
+class QueryBatcher:
+    """Coalesces concurrent single-question embedding requests into one
+    provider call, made with the query task where the provider has one (see
+    `embed_queries`).
+
+    The first request of a batch waits up to `window` seconds for others to
+    join, or until `max_size` have. Requests for the same text share one
+    slot. At most `max_in_flight` batches are sent at a time; while all are
+    out, requests keep joining the next batch instead of queueing as many
+    small ones, so batches grow with load.
+    """
+
+    def __init__(self, embedding_model, window: float, max_size: int, max_in_flight: int):
+        self.embedding_model = embedding_model
+        self.window = window
+        self.max_size = max_size
+        self.max_in_flight = max_in_flight
+        self.requests = 0
+        self.batches = 0
+        # Cache key -> (text, future), in arrival order
+        self._pending: Dict[str, tuple] = {}
+        self._opened_at = 0.0
+        self._condition = threading.Condition()
+        self._slots = threading.Semaphore(max_in_flight)
+        self._pid = None
+
+    def submit(self, key: str, text: str) -> Future:
+        """Future for the embedding of text, identified by key"""
+        with self._condition:
+            self._start()
+            self.requests += 1
+            if key in self._pending:
+                return self._pending[key][1]
+            future = Future()
+            self._pending[key] = (text, future)
+            if len(self._pending) == 1:
+                self._opened_at = time.monotonic()
+                self._condition.notify()
+            elif len(self._pending) >= self.max_size:
+                self._condition.notify()
+            return future
+
+    def _start(self):
+        # Started lazily, and again in a forked child, which has no threads
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = {}
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._executor = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix='query-embed')
+        threading.Thread(target=self._collect, name='query-batcher', daemon=True).start()
+
+    def _collect(self):
+        while True:
+            self._slots.acquire()
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = self._opened_at + self.window
+                while len(self._pending) < self.max_size and (remaining := deadline - time.monotonic()) > 0:
+                    self._condition.wait(remaining)
+                # Requests past max_size have waited long enough: their batch
+                # is sent as soon as a slot is free
+                keys = list(self._pending)[:self.max_size]
+                batch = [self._pending.pop(key) for key in keys]
+                self.batches += 1
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[tuple]):
+        try:
+            vectors = embed_queries(self.embedding_model, [text for text, _ in batch])
+            if len(vectors) != len(batch):
+                raise ValueError(f"Embedding provider returned {len(vectors)} vectors for {len(batch)} texts")
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            self._slots.release()
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+class QueryEmbedder:
+    """Embeds questions for retrieval, cheapest source first: an in-process
+    LRU, then the provider through the micro-batcher (and, in front of the
+    provider, the shared embedding cache when it is enabled).
+
+    Vectors come back L2-normalized with shape (1, dimension) and are shared
+    between callers, so they are read-only.
+    """
+
+    def __init__(self, embedding_model=None, model_name: Optional[str] = None):
+        self.embedding_model = embedding_model or get_embedding_model()
+        self.model_name = model_name or embedding_model_name(self.embedding_model)
+        self.cache = LRUCache(settings.QUERY_EMBEDDING_CACHE_SIZE, ttl=settings.QUERY_EMBEDDING_CACHE_TTL)
+        self.batcher = None
+        self.batch_timeout = settings.QUERY_BATCH_TIMEOUT
+        if settings.QUERY_BATCH_WINDOW_MS > 0:
+            self.batcher = QueryBatcher(
+                self.embedding_model, settings.QUERY_BATCH_WINDOW_MS / 1000,
+                settings.QUERY_BATCH_MAX_SIZE, settings.QUERY_BATCH_MAX_IN_FLIGHT,
+            )
+
+    def embed(self, question: str) -> np.ndarray:
+        key = embedding_cache_key(self.model_name, question, 'query')
+        vector = self.cache.get(key)
+        if vector is None:
+            if self.batcher:
+                embedding = self.batcher.submit(key, question).result(timeout=self.batch_timeout)
+            else:
+                embedding = self.embedding_model.embed_query(question)
+            vector = self._store(key, embedding)
+        return vector
+
+    async def aembed(self, question: str) -> np.ndarray:
+        key = embedding_cache_key(self.model_name, question, 'query')
+        vector = self.cache.get(key)
+        if vector is None:
+            if self.batcher:
+                # Shielded so a timeout here does not cancel the future for
+                # other requests waiting on the same text
+                embedding = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(self.batcher.submit(key, question))), self.batch_timeout,
+                )
+            elif hasattr(self.embedding_model, 'aembed_query'):
+                embedding = await self.embedding_model.aembed_query(question)
+            else:
+                embedding = await asyncio.to_thread(self.embedding_model.embed_query, question)
+            vector = self._store(key, embedding)
+        return vector
+
+    def _store(self, key: str, embedding) -> np.ndarray:
+        vector = np.array([embedding], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        vector.flags.writeable = False
+        self.cache.set(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        """Cache hits and misses, and how many provider calls the batcher made for its requests"""
+        return {
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+            'batched_requests': self.batcher.requests if self.batcher else 0,
+            'batches': self.batcher.batches if self.batcher else 0,
+        }
+
+
+_embedder: Optional[QueryEmbedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_query_embedder() -> QueryEmbedder:
+    """Process-wide QueryEmbedder, so questions from every request share its cache and batches"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                embedder = QueryEmbedder()
+                get_metrics().register_collector(lambda: [
+                    ('vectormind_cache_hits_total', {'cache': 'query_embedding'}, embedder.cache.hits),
+                    ('vectormind_cache_misses_total', {'cache': 'query_embedding'}, embedder.cache.misses),
+                ])
+                _embedder = embedder
+    return _embedder
@@ -0,0 +1,103 @@
+import time
+from typing import Optional
+from django.conf import settings
+from ..models import QueryLog
+from .retrieval_service import RetrievalService
+from .llm_service import LLMService
+from .answer_cache import SemanticAnswerCache
+from .tracing import record, span, trace
+
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in the knowledge base to answer your question."
+
+
+class QuestionAnsweringService:
+    """Answers one question end to end: retrieval, answer generation and the
+    QueryLog entry. `answer` is the blocking path, `aanswer` the ASGI one.
+    The seconds spent in each stage are logged with the query.
+
+    Answers to paraphrases of a user's recent questions come from the
+    semantic answer cache without retrieval or an LLM call.
+    """
+
+    def __init__(self, retrieval_service: Optional[RetrievalService] = None, llm_service: Optional[LLMService] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None):
+        self.retrieval_service = retrieval_service or RetrievalService()
+        self._llm_service = llm_service
+        if answer_cache is None and settings.SEMANTIC_CACHE_ENABLED:
+            answer_cache = SemanticAnswerCache()
+        self.answer_cache = answer_cache
+
+    @property
+    def llm_service(self) -> LLMService:
+        # Only built when there is something to answer from
+        if self._llm_service is None:
+            self._llm_service = LLMService()
+        return self._llm_service
+
+    def answer(self, user, question: str) -> dict:
+        start_time = time.time()
+        with trace() as timings:
+            question_embedding = self.retrieval_service.embed_query(question)
+            response_data = None
+            if self.answer_cache:
+                with span('answer_cache'):
+                    response_data = self.answer_cache.lookup(user.id, question_embedding)
+
+            if response_data is None:
+                relevant_chunks = self.retrieval_service.retrieve_for_embedding(question_embedding, user_id=user.id, question=question)
+                if not relevant_chunks:
+                    response_data = {"answer": NO_RESULTS_ANSWER, "sources": []}
+                else:
+                    response_data = self.llm_service.generate_answer(question, relevant_chunks)
+                    if self.answer_cache and response_data["sources"]:
+                        self.answer_cache.store(user.id, question_embedding, response_data, self.chunk_ids(relevant_chunks))
+            response_data["response_time"] = time.time() - start_time
+            record('total', response_data["response_time"])
+
+        QueryLog.objects.create(
+            user=user,
+            question=question,
+            answer=response_data["answer"],
+            sources=response_data["sources"],
+            response_time=response_data["response_time"],
+            prompt_tokens=response_data.get("prompt_tokens"),
+            context_packing_time=response_data.get("context_packing_time"),
+            stage_timings=timings,
+        )
+        return response_data
+
+    async def aanswer(self, user, question: str) -> dict:
+        start_time = time.time()
+        with trace() as timings:
+            question_embedding = await self.retrieval_service.aembed_query(question)
+            response_data = None
+            if self.answer_cache:
+                with span('answer_cache'):
+                    response_data = await self.answer_cache.alookup(user.id, question_embedding)
+
+            if response_data is None:
+                relevant_chunks = await self.retrieval_service.aretrieve_for_embedding(question_embedding, user_id=user.id, question=question)
+                if not relevant_chunks:
+                    response_data = {"answer": NO_RESULTS_ANSWER, "sources": []}
+                else:
+                    response_data = await self.llm_service.agenerate_answer(question, relevant_chunks)
+                    if self.answer_cache and response_data["sources"]:
+                        await self.answer_cache.astore(user.id, question_embedding, response_data, self.chunk_ids(relevant_chunks))
+            response_data["response_time"] = time.time() - start_time
+            record('total', response_data["response_time"])
+
+        await QueryLog.objects.acreate(
+            user=user,
+            question=question,
+            answer=response_data["answer"],
+            sources=response_data["sources"],
+            response_time=response_data["response_time"],
+            prompt_tokens=response_data.get("prompt_tokens"),
+            context_packing_time=response_data.get("context_packing_time"),
+            stage_timings=timings,
+        )
+        return response_data
+
+    @staticmethod
+    def chunk_ids(relevant_chunks):
+        return [chunk.id for chunk, _ in relevant_chunks]
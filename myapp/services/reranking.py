@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Sequence
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def mmr(relevance: np.ndarray, vectors: np.ndarray, k: int, diversity: float = 0.3,
+        duplicate_threshold: Optional[float] = None) -> np.ndarray:
+    """Indices of up to k candidates chosen by maximal marginal relevance.
+
+    Each pick maximizes (1 - diversity) * relevance minus diversity times the
+    candidate's highest cosine similarity to those already picked, so a chunk
+    that mostly repeats a better one loses to one adding something new.
+    Candidates at least duplicate_threshold similar to a picked one are
+    dropped outright, which can return fewer than k. Vectors are
+    L2-normalized, relevance is on a [0, 1] scale.
+    """
+    count = len(relevance)
+    if count == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    picked = []
+    while len(picked) < k and available.any():
+        gain = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+        best = int(np.argmax(gain))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+        if duplicate_threshold is not None:
+            available &= similarity[best] < duplicate_threshold
+    return np.array(picked, dtype=np.int64)
+
+
+def unit_range(scores: np.ndarray) -> np.ndarray:
+    """scores rescaled to [0, 1]; all ones if they are equal"""
+    scores = np.asarray(scores, dtype=np.float32)
+    spread = float(scores.max() - scores.min()) if len(scores) else 0.0
+    if spread == 0.0:
+        return np.ones(len(scores), dtype=np.float32)
+    return (scores - scores.min()) / spread
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a sentence-transformers
+    cross-encoder. Needs the optional `sentence-transformers` package.
+    """
+
+    def __init__(self, model: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', **options):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model, **options)
+
+    def score(self, question: str, texts: Sequence[str]) -> List[float]:
+        return self.model.predict([(question, text) for text in texts])
+
+
+class BudgetedReranker:
+    """Runs a reranker's `score(question, texts)` on worker threads and waits
+    at most `budget` seconds for it.
+
+    A query whose scores are late, or that finds `max_in_flight` calls
+    already running, gets None and keeps its retrieval order; a late call
+    finishes in the background without holding up the request.
+    """
+
+    def __init__(self, reranker, budget: float, max_in_flight: int):
+        self.reranker = reranker
+        self.budget = budget
+        self.max_in_flight = max_in_flight
+        self.scored = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_in_flight, thread_name_prefix='rerank')
+
+    def score(self, question: str, texts: Sequence[str]) -> Optional[np.ndarray]:
+        future = self._submit(question, texts)
+        if future is None:
+            return None
+        try:
+            return self._scored(future.result(timeout=self.budget))
+        except FutureTimeoutError:
+            return self._timed_out()
+        except Exception:
+            logger.exception("Reranker failed; keeping retrieval order")
+            return None
+
+    async def ascore(self, question: str, texts: Sequence[str]) -> Optional[np.ndarray]:
+        future = self._submit(question, texts)
+        if future is None:
+            return None
+        try:
+            # shield: a timeout must not cancel the call, only stop waiting for it
+            return self._scored(await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.budget))
+        except asyncio.TimeoutError:
+            return self._timed_out()
+        except Exception:
+            logger.exception("Reranker failed; keeping retrieval order")
+            return None
+
+    def _submit(self, question: str, texts: Sequence[str]):
+        if not self._slots.acquire(blocking=False):
+            self.skipped += 1
+            return None
+        future = self._executor.submit(self.reranker.score, question, list(texts))
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _scored(self, scores) -> np.ndarray:
+        self.scored += 1
+        return np.asarray(scores, dtype=np.float32)
+
+    def _timed_out(self):
+        self.timeouts += 1
+        logger.info("Reranker exceeded its %.0f ms budget; keeping retrieval order", self.budget * 1000)
+        return None
+
+    def stats(self) -> dict:
+        return {'scored': self.scored, 'timeouts': self.timeouts, 'skipped': self.skipped}
+
+
+_reranker: Optional[BudgetedReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Optional[BudgetedReranker]:
+    """Process-wide reranker configured by RERANKER (a dotted path to a class
+    with `score(question, texts)`), or None when it is not set
+    """
+    global _reranker
+    if not settings.RERANKER:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                reranker = import_string(settings.RERANKER)(**getattr(settings, 'RERANKER_OPTIONS', {}))
+                _reranker = BudgetedReranker(
+                    reranker, settings.RERANKER_BUDGET_MS / 1000, settings.RERANKER_MAX_IN_FLIGHT,
+                )
+    return _reranker
@@ -1,63 +1,222 @@
-import faiss
-import pickle
-import os
+import asyncio
+import copy
 import numpy as np
-from typing import List, Tuple
-#from sentence_transformers import SentenceTransformer
+from asgiref.sync import sync_to_async
+from typing import Dict, Iterable, List, Optional, Tuple
 from django.conf import settings
 from ..models import Document, DocumentChunk
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from .index_store import get_index_store
+from .lexical_index import get_lexical_store
+from .query_embedding import QueryEmbedder, get_query_embedder
+from .reranking import get_reranker, mmr, unit_range
+from .lru import LRUCache
+from .metrics import get_metrics
+from .tracing import span
+
+# Recently returned chunks keyed by chunk ID, per process. Chunks never change
+# once stored; their documents do, so those are not cached with them
+chunk_cache = LRUCache(maxsize=getattr(settings, 'CHUNK_CACHE_SIZE', 2048))
+get_metrics().register_collector(lambda: [
+    ('vectormind_cache_hits_total', {'cache': 'chunk'}, chunk_cache.hits),
+    ('vectormind_cache_misses_total', {'cache': 'chunk'}, chunk_cache.misses),
+])
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[object, float]]], k: int = 60) -> List[Tuple[object, float]]:
+    """Merge (id, score) lists, each best first, scoring every ID by the sum
+    of 1 / (k + rank) over the lists it appears in; best first
+    """
+    fused: Dict[object, float] = {}
+    for ranking in rankings:
+        for rank, (item, _) in enumerate(ranking, 1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
 class RetrievalService:
-    def __init__(self):
+    def __init__(self, embedding_model=None, reranker=None):
         
-        self.embedding_model = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        # Questions are embedded through a per-process LRU and micro-batcher,
+        # shared by every request unless a model is passed in
+        self.query_embedder = QueryEmbedder(embedding_model) if embedding_model else get_query_embedder()
+        self.embedding_model = self.query_embedder.embedding_model
         self.similarity_threshold = 0.2  # Minimum similarity score to consider relevant
 
-        # Load single FAISS index and metadata
-        index_path = os.path.join(settings.VECTOR_DB_PATH, 'index.faiss')
-        metadata_path = os.path.join(settings.VECTOR_DB_PATH, 'metadata.pkl')
+        # FAISS index and ID map are loaded once per process and shared
+        self.index_store = get_index_store()
+        self.lexical_store = get_lexical_store()
+        # Optional model re-scoring candidates under RERANKER_BUDGET_MS
+        self.reranker = reranker or get_reranker()
+
+    def embed_query(self, question: str) -> np.ndarray:
+        """Normalized (1, dimension) embedding of the question, read-only"""
+        with span('embed_query'):
+            return self.query_embedder.embed(question)
+
+    async def aembed_query(self, question: str) -> np.ndarray:
+        """Async variant of embed_query"""
+        with span('embed_query'):
+            return await self.query_embedder.aembed(question)
 
-        if os.path.exists(index_path):
-            self.index = faiss.read_index(index_path)
-        else:
-            self.index = None
+    def retrieve_relevant_chunks(self, question: str, user_id: int, top_k: int = 5,
+                                 nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[DocumentChunk, float]]:
+        """Retrieve most relevant chunks for a given question and user_id.
 
-        if os.path.exists(metadata_path):
-            with open(metadata_path, 'rb') as f:
-                self.metadata = pickle.load(f)
-        else:
-            self.metadata = {'chunk_ids': [], 'document_ids': [], 'user_ids': []}
+        With HYBRID_SEARCH_ENABLED, BM25 matches on the question's words are
+        fused with the vector search results by reciprocal rank fusion, so
+        exact identifiers and rare terms are found even when their embedding
+        is not close. With MMR_ENABLED or a RERANKER, RETRIEVAL_CANDIDATES
+        are fetched and the top_k returned are picked from them for relevance
+        and diversity, best first, skipping near-duplicates of a chunk
+        already picked. nprobe / ef_search override the IVF / HNSW search
+        depth for this query.
+        """
+        return self.retrieve_for_embedding(self.embed_query(question), user_id, top_k, nprobe, ef_search, question)
 
-    def retrieve_relevant_chunks(self, question: str, user_id: str, top_k: int = 5) -> List[Tuple[DocumentChunk, float]]:
-        """Retrieve most relevant chunks for a given question and user_id"""
-        if self.index is None or not self.metadata['chunk_ids']:
+    def retrieve_for_embedding(self, question_embedding: np.ndarray, user_id: int, top_k: int = 5,
+                               nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                               question: Optional[str] = None) -> List[Tuple[DocumentChunk, float]]:
+        """retrieve_relevant_chunks for an already embedded question; hybrid
+        search needs the question text too, without it only vectors are searched
+        """
+        snapshot = self.index_store.get_snapshot()
+        if snapshot.ntotal == 0:
             return []
+        snapshot.check_query(question_embedding, self.query_embedder.model_name)
 
-        # Generate question embedding
-        #question_embedding = self.embedding_model.encode([question])
-        question_embedding_list = self.embedding_model.embed_query(question)
+        hits, positions = self._search_hybrid(
+            snapshot, question_embedding, question, user_id, self._candidates(top_k), nprobe, ef_search,
+        )
+        chunks = self.hydrate_chunks(chunk_id for chunk_id, _ in hits)
+        hits = [(chunk_id, score) for chunk_id, score in hits if chunk_id in chunks]
+        rerank_scores = None
+        if self.reranker and question and hits:
+            with span('rerank'):
+                rerank_scores = self.reranker.score(question, [chunks[chunk_id].content for chunk_id, _ in hits])
+        return self._select(snapshot, question_embedding, user_id, hits, positions, chunks, top_k, rerank_scores)
 
-        # Convert to numpy array and reshape for FAISS (needs 2D array)
-        question_embedding = np.array([question_embedding_list], dtype=np.float32)
+    async def aretrieve_relevant_chunks(self, question: str, user_id: int, top_k: int = 5,
+                                        nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[DocumentChunk, float]]:
+        """Async variant of retrieve_relevant_chunks: the embedding call is
+        awaited, the FAISS search runs in a worker thread and hydration goes
+        through the ORM's sync_to_async bridge.
+        """
+        return await self.aretrieve_for_embedding(await self.aembed_query(question), user_id, top_k, nprobe, ef_search, question)
 
-        faiss.normalize_L2(question_embedding)
+    async def aretrieve_for_embedding(self, question_embedding: np.ndarray, user_id: int, top_k: int = 5,
+                                      nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                                      question: Optional[str] = None) -> List[Tuple[DocumentChunk, float]]:
+        snapshot = self.index_store.get_snapshot()
+        if snapshot.ntotal == 0:
+            return []
+        snapshot.check_query(question_embedding, self.query_embedder.model_name)
+
+        hits, positions = await asyncio.to_thread(
+            self._search_hybrid, snapshot, question_embedding, question, user_id, self._candidates(top_k), nprobe, ef_search,
+        )
+        chunks = await sync_to_async(self.hydrate_chunks)([chunk_id for chunk_id, _ in hits])
+        hits = [(chunk_id, score) for chunk_id, score in hits if chunk_id in chunks]
+        rerank_scores = None
+        if self.reranker and question and hits:
+            with span('rerank'):
+                rerank_scores = await self.reranker.ascore(question, [chunks[chunk_id].content for chunk_id, _ in hits])
+        return await asyncio.to_thread(
+            self._select, snapshot, question_embedding, user_id, hits, positions, chunks, top_k, rerank_scores,
+        )
+
+    def _candidates(self, top_k: int) -> int:
+        """Hits to fetch for a top_k answer: more when they are re-ranked"""
+        if settings.MMR_ENABLED or self.reranker:
+            return max(top_k, settings.RETRIEVAL_CANDIDATES)
+        return top_k
+
+    def _search_hybrid(self, snapshot, question_embedding: np.ndarray, question: Optional[str], user_id: int,
+                       top_k: int, nprobe: Optional[int], ef_search: Optional[int]) -> Tuple[List[Tuple[object, float]], Dict]:
+        """Vector hits, fused with BM25 hits when hybrid search applies, and
+        the index positions of the vector hits by chunk ID
+        """
+        hybrid = bool(question and settings.HYBRID_SEARCH_ENABLED)
+        candidates = max(top_k, settings.HYBRID_CANDIDATES) if hybrid else top_k
+        with span('vector_search'):
+            dense = self._search(snapshot, question_embedding, user_id, candidates, nprobe, ef_search)
+        positions = {chunk_id: position for chunk_id, _, position in dense}
+        dense = [(chunk_id, score) for chunk_id, score, _ in dense]
+        if not hybrid:
+            return dense, positions
+        with span('lexical_search'):
+            lexical = self.lexical_store.get_snapshot().search(question, user_id, candidates)
+        return reciprocal_rank_fusion([dense, lexical], settings.HYBRID_RRF_K), positions
 
-        # Search
-        scores, indices = self.index.search(question_embedding.astype('float32'), min(top_k, self.index.ntotal))
+    def _search(self, snapshot, question_embedding: np.ndarray, user_id: int, top_k: int,
+                nprobe: Optional[int], ef_search: Optional[int]) -> List[Tuple[object, float, int]]:
+        """(chunk_id, score, position) hits above the similarity threshold"""
+        # Search only this user's vectors so all top_k slots belong to them
+        scores, positions = snapshot.search(question_embedding, top_k, user_id, nprobe=nprobe, ef_search=ef_search)
+        return [
+            (snapshot.id_map.chunk_id(idx), float(score), int(idx))
+            for score, idx in zip(scores, positions)
+            if score >= self.similarity_threshold
+        ]
 
-        all_results = []
+    def _select(self, snapshot, question_embedding: np.ndarray, user_id: int, hits: List[Tuple[object, float]],
+                positions: Dict, chunks: Dict, top_k: int,
+                rerank_scores: Optional[np.ndarray] = None) -> List[Tuple[DocumentChunk, float]]:
+        """Top_k of the candidate hits in the order they go to the LLM.
 
-        # Get corresponding chunks filtered by user_id
-        for score, idx in zip(scores[0], indices[0]):
-            if idx >= 0 and score >= self.similarity_threshold:
-                if self.metadata['user_ids'][idx] == user_id:
-                    chunk_id = self.metadata['chunk_ids'][idx]
-                    try:
-                        chunk = DocumentChunk.objects.get(id=chunk_id)
-                        all_results.append((chunk, float(score)))
-                    except DocumentChunk.DoesNotExist:
-                        continue
+        Relevance is the reranker's score when it answered in time, else the
+        retrieval score. MMR over the chunks' stored vectors then trades it
+        against similarity to the chunks already picked.
+        """
+        if not hits or not (settings.MMR_ENABLED or rerank_scores is not None):
+            return self._rank(hits, chunks, top_k)
+        with span('select'):
+            chunk_ids = [chunk_id for chunk_id, _ in hits]
+            found = np.array([positions.get(chunk_id, -1) for chunk_id in chunk_ids], dtype=np.int64)
+            # BM25-only hits were not among the vector results
+            missing = np.flatnonzero(found < 0)
+            if len(missing):
+                found[missing] = snapshot.chunk_positions([chunk_ids[i] for i in missing], user_id)
+            vectors = np.zeros((len(hits), question_embedding.shape[-1]), dtype=np.float32)
+            vectors[found >= 0] = snapshot.vectors_at(found[found >= 0])
+
+            relevance = rerank_scores if rerank_scores is not None else np.array([score for _, score in hits])
+            if settings.MMR_ENABLED:
+                picked = mmr(unit_range(relevance), vectors, top_k, settings.MMR_DIVERSITY, settings.MMR_DUPLICATE_THRESHOLD)
+            else:
+                picked = np.argsort(-relevance, kind='stable')[:top_k]
+            return [(chunks[chunk_ids[i]], hits[i][1]) for i in picked]
+
+    @staticmethod
+    def _rank(hits: List[Tuple[object, float]], chunks: Dict, top_k: int) -> List[Tuple[DocumentChunk, float]]:
+        # Chunks deleted since the index was built are skipped
+        all_results = [(chunks[chunk_id], score) for chunk_id, score in hits if chunk_id in chunks]
 
         # Sort by score and return top_k
         all_results.sort(key=lambda x: x[1], reverse=True)
         return all_results[:top_k]
+
+    def hydrate_chunks(self, chunk_ids: Iterable) -> Dict:
+        """Load chunks by ID, from the chunk cache where possible, with their
+        documents read fresh (one query by primary key), so a renamed or
+        re-uploaded document is never shown with its old title or version.
+        Chunks whose document was deleted are left out.
+        """
+        with span('hydrate'):
+            chunk_ids = list(chunk_ids)
+            chunks = chunk_cache.get_many(chunk_ids)
+            missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in chunks]
+            if missing:
+                loaded = DocumentChunk.objects.in_bulk(missing)
+                chunk_cache.set_many(loaded)
+                chunks.update(loaded)
+            documents = Document.objects.in_bulk({chunk.document_id for chunk in chunks.values()})
+            hydrated = {}
+            for chunk_id, chunk in chunks.items():
+                document = documents.get(chunk.document_id)
+                if document is None:
+                    continue
+                # Cached chunks are shared between requests; the copy gets its own document
+                chunk = copy.copy(chunk)
+                chunk.document = document
+                hydrated[chunk_id] = chunk
+            return hydrated
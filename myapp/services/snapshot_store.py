@@ -0,0 +1,87 @@
+import os
+import time
+import logging
+import threading
+from typing import Optional, Tuple
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """Per-process holder of an immutable snapshot of files on disk.
+
+    The first `get_snapshot` loads it; afterwards the files are re-checked at
+    most every `reload_interval` seconds and, when their generation changes,
+    a fresh snapshot is loaded on a background thread and swapped in with a
+    single reference assignment. Readers keep whichever snapshot they got,
+    so a reload never blocks or disturbs a search in progress.
+
+    Subclasses define `_current_generation`, a cheap fingerprint of the files
+    that changes whenever anything visible does, and `_load`, which builds a
+    snapshot (with a `generation` attribute) from them.
+    """
+
+    name = 'snapshot'
+
+    def __init__(self, path, reload_interval: Optional[float] = None):
+        self.path = path
+        if reload_interval is None:
+            reload_interval = getattr(settings, 'VECTOR_INDEX_RELOAD_INTERVAL', 2.0)
+        self.reload_interval = reload_interval
+
+        self._snapshot = None
+        self._last_check = 0.0
+        self._load_lock = threading.Lock()
+        self._reloading = False
+        self.reload_count = 0
+
+    def get_snapshot(self):
+        """Return the current snapshot, scheduling a reload if the files changed"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load(self._current_generation())
+                    self._last_check = time.monotonic()
+                return self._snapshot
+
+        now = time.monotonic()
+        if now - self._last_check >= self.reload_interval:
+            self._last_check = now
+            if self._current_generation() != snapshot.generation:
+                self._reload_in_background()
+        return snapshot
+
+    def _current_generation(self) -> tuple:
+        raise NotImplementedError
+
+    def _load(self, generation: tuple):
+        raise NotImplementedError
+
+    @staticmethod
+    def _stat(path: str) -> Tuple[int, int]:
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return (0, 0)
+
+    def _reload_in_background(self):
+        with self._load_lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, name=f'{type(self).__name__}-reload', daemon=True).start()
+
+    def _reload(self):
+        try:
+            snapshot = self._load(self._current_generation())
+            with self._load_lock:
+                self._snapshot = snapshot
+                self.reload_count += 1
+        except Exception:
+            logger.exception("Failed to reload %s from %s", self.name, self.path)
+        finally:
+            with self._load_lock:
+                self._reloading = False
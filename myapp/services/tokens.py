@@ -0,0 +1,62 @@
+import re
+from typing import Iterator, Tuple
+import numpy as np
+
+# Approximates a BPE tokenizer without loading one: words are cut into pieces
+# of at most six characters and each punctuation mark counts on its own
+TOKEN_PATTERN = re.compile(r"\w{1,6}|[^\w\s]")
+WORD_PIECE = 6
+
+SPACE, WORD, PUNCT = 0, 1, 2
+
+
+def iter_token_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """(start, end) character offsets of each estimated token in `text`"""
+    for match in TOKEN_PATTERN.finditer(text):
+        yield match.span()
+
+
+def count_tokens(text: str) -> int:
+    return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+
+def codepoints(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+
+def token_spans(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end offsets of the tokens TOKEN_PATTERN would match, for text
+    given as `codepoints(text)`, computed with array operations rather than
+    one regex match at a time
+    """
+    kinds = _ASCII_KINDS[np.minimum(codes, 128)]
+    non_ascii = codes >= 128
+    if non_ascii.any():
+        # Classify each distinct non-ASCII character once, the way `re` does
+        unique, inverse = np.unique(codes[non_ascii], return_inverse=True)
+        kinds[non_ascii] = np.array([_kind(chr(code)) for code in unique], dtype=np.uint8)[inverse]
+
+    # Word runs are cut into WORD_PIECE-character tokens; every punctuation
+    # character is a token of its own
+    edges = np.diff((kinds == WORD).view(np.int8), prepend=0, append=0)
+    run_starts, run_ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    pieces = (run_ends - run_starts + WORD_PIECE - 1) // WORD_PIECE
+    piece_index = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    word_starts = np.repeat(run_starts, pieces) + WORD_PIECE * piece_index
+    word_ends = np.minimum(word_starts + WORD_PIECE, np.repeat(run_ends, pieces))
+
+    # Mark first and last characters in place so both lists come out sorted
+    is_start, is_end = kinds == PUNCT, kinds == PUNCT
+    is_start[word_starts] = True
+    is_end[word_ends - 1] = True
+    starts, ends = np.flatnonzero(is_start), np.flatnonzero(is_end) + 1
+    return starts, ends
+
+
+def _kind(char: str) -> int:
+    if char.isalnum() or char == '_':
+        return WORD
+    return SPACE if char.isspace() else PUNCT
+
+
+_ASCII_KINDS = np.array([_kind(chr(code)) for code in range(128)] + [PUNCT], dtype=np.uint8)
@@ -0,0 +1,57 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+from .metrics import SeriesKey, get_metrics, series_key
+
+STAGE_METRIC = 'vectormind_stage_seconds'
+
+# Stage timings of the request being traced in this context; copied into
+# asyncio tasks and asyncio.to_thread calls, so their spans land in it too
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('stage_timings', default=None)
+_stage_keys: Dict[str, SeriesKey] = {}
+
+
+class trace:
+    """Collect the seconds spent in each stage of spans run inside the block
+    into a {stage: seconds} dict, e.g. for the request's QueryLog
+    """
+
+    def __init__(self, timings: Optional[Dict[str, float]] = None):
+        self.timings = {} if timings is None else timings
+
+    def __enter__(self) -> Dict[str, float]:
+        self._token = _timings.set(self.timings)
+        return self.timings
+
+    def __exit__(self, *exc_info):
+        try:
+            _timings.reset(self._token)
+        except ValueError:
+            # Left in another context, as when a streamed response is closed
+            pass
+
+
+class span:
+    """Time the block as `stage`: added to the current trace, if any, and
+    to the process's latency histogram for the stage
+    """
+    __slots__ = ('stage', '_start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter() - self._start)
+
+
+def record(stage: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    key = _stage_keys.get(stage)
+    if key is None:
+        key = _stage_keys.setdefault(stage, series_key(STAGE_METRIC, {'stage': stage}))
+    get_metrics().observe_series(key, seconds)
@@ -1,13 +1,107 @@
-from celery import shared_task
+from celery import chord, shared_task
+from .services import bulk_ingest
 from .services.document_processor import DocumentProcessor
-from .models import Document
+from .services.index_writer import IndexWriter
+from .services.lexical_index import LexicalIndexWriter
+from .models import Document, IngestBatch
+
+@shared_task(bind=True)
+def process_document_task(self, document_id, replaced_file=None):
+    def report_progress(embedded, total):
+        self.update_state(state='PROGRESS', meta={'document_id': str(document_id), 'embedded': embedded, 'total': total})
 
-@shared_task
-def process_document_task(document_id):
     try:
         document = Document.objects.get(id=document_id)
-        processor = DocumentProcessor()
+        processor = DocumentProcessor(progress_callback=report_progress)
         success = processor.process_document(document)
+        if success:
+            schedule_index_maintenance()
+            # The previous version's file is kept until this one is processed;
+            # chunks hold their own text, so nothing needs it afterwards
+            if replaced_file and replaced_file != document.file.name:
+                document.file.storage.delete(replaced_file)
         return success
     except Document.DoesNotExist:
         return False
+
+
+@shared_task
+def chunk_document_task(batch_id, document_id):
+    """Bulk ingest, first stage: extract and chunk one file of the batch"""
+    return bulk_ingest.chunk_batch_document(batch_id, document_id)
+
+
+@shared_task
+def embed_ingest_batch_task(chunked_document_ids, batch_id):
+    """Chord callback once every file of the batch is chunked: embed the
+    chunks in groups that span files, then commit them all at once
+    """
+    document_ids = [document_id for document_id in chunked_document_ids if document_id]
+    IngestBatch.objects.filter(id=batch_id).update(status='embedding')
+    commit = commit_ingest_batch_task.si(batch_id, document_ids).on_error(fail_ingest_batch_task.si(batch_id))
+    groups = bulk_ingest.embedding_groups(batch_id)
+    if not groups:
+        commit.delay()
+        return
+    chord([embed_chunks_task.si(batch_id, part, chunk_ids) for part, chunk_ids in enumerate(groups)])(commit)
+
+
+@shared_task
+def embed_chunks_task(batch_id, part, chunk_ids):
+    return bulk_ingest.embed_and_stage(batch_id, part, chunk_ids)
+
+
+@shared_task
+def commit_ingest_batch_task(batch_id, document_ids):
+    """Append the batch's staged vectors to the index in one write"""
+    appended = bulk_ingest.commit_batch(batch_id, document_ids)
+    schedule_index_maintenance()
+    return appended
+
+
+@shared_task
+def fail_ingest_batch_task(batch_id):
+    bulk_ingest.fail_batch(batch_id)
+
+
+def start_bulk_ingest(batch: IngestBatch):
+    """Fan a batch out as a chord: every file is chunked in parallel, then
+    the chunks are embedded and committed together
+    """
+    batch_id = str(batch.id)
+    chord([
+        chunk_document_task.si(batch_id, str(document_id))
+        for document_id in batch.documents.values_list('id', flat=True)
+    ])(embed_ingest_batch_task.s(batch_id).on_error(fail_ingest_batch_task.si(batch_id)))
+
+
+@shared_task
+def merge_index_task():
+    """Fold vectors appended since the last merge into the base FAISS index"""
+    return IndexWriter().merge()
+
+
+@shared_task
+def compact_index_task():
+    """Rewrite the vector store without deleted vectors"""
+    return IndexWriter().compact()
+
+
+@shared_task
+def merge_lexical_index_task():
+    """Fold the smallest lexical index segments into one"""
+    return LexicalIndexWriter().merge()
+
+
+def schedule_index_maintenance():
+    """Queue a merge or compaction when the vector store or the lexical
+    index needs one
+    """
+    writer = IndexWriter()
+    if writer.needs_compaction():
+        # Compaction rebuilds the base index, merging the delta as well
+        compact_index_task.delay()
+    elif writer.needs_merge():
+        merge_index_task.delay()
+    if LexicalIndexWriter().needs_merge():
+        merge_lexical_index_task.delay()
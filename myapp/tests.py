@@ -1,3 +1,803 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from unittest.mock import patch
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from myapp.benchmarks.providers import FakeChatModel, FakeEmbeddings
+from myapp.models import Document, DocumentChunk
+from myapp.serializers import DocumentUploadSerializer
+from myapp.services.answer_cache import SemanticAnswerCache
+from myapp.services.chunking import CHUNKERS, get_chunker
+from myapp.services.context_packing import pack_context
+from myapp.services.document_processor import DocumentProcessor
+from myapp.services.embedding_cache import CachedEmbeddings
+from myapp.services.query_embedding import QueryBatcher
+from myapp.services.id_map import VectorIdMap
+from myapp.services.index_store import IndexStore
+from myapp.services.index_writer import IndexWriter, load_tombstones, store_dir
+from myapp.services.lexical_index import B, K1, LexicalIndexWriter, LexicalStore, lexical_dir, lexical_terms, read_manifest
+from myapp.services.llm_service import LLMService
+from myapp.services.metrics import ARCHIVE_FILE, HOST_NAME, MetricsRegistry
+from myapp.services.question_answering import QuestionAnsweringService
+from myapp.services.reranking import BudgetedReranker, mmr, unit_range
+from myapp.services.retrieval_service import RetrievalService, chunk_cache, reciprocal_rank_fusion
+from myapp.tasks import process_document_task
+from myapp.services.tokens import count_tokens, iter_token_spans
 
-# Create your tests here.
+# Characters the property cases draw from: words, sentence and line breaks,
+# bare punctuation, and multi-byte text
+ALPHABET = list("abcdefghij      ..!?,;\n\n\t") + ["é", "中文", "😀", "--", "  \n \n"]
+
+
+def check_chunks(chunker, pages):
+    """First violated property of `chunker` over `pages`, or None"""
+    document = ''.join(text for text, _ in pages).encode('utf-8', 'surrogatepass')
+    base = 0
+    for text, page_number in pages:
+        spans = list(iter_token_spans(text))
+        # Every cut advances by at least a quarter chunk, so this bounds the
+        # chunk count; a chunker that loops or stalls trips it
+        limit = len(spans) // max(1, chunker.chunk_tokens // 4) + 2
+        chunks = []
+        for chunk in chunker.chunk_pages([(text, page_number)]):
+            chunks.append(chunk)
+            if len(chunks) > limit:
+                return f"more than {limit} chunks for {len(spans)} tokens"
+
+        previous = None
+        for chunk in chunks:
+            start, end = chunk.start + base, chunk.end + base
+            if document[start:end].decode('utf-8', 'surrogatepass') != chunk.content:
+                return f"offsets {start}:{end} do not match the chunk text"
+            if chunk.page_number != page_number:
+                return "wrong page number"
+            if not 0 < chunk.token_count <= chunker.chunk_tokens:
+                return f"{chunk.token_count} tokens"
+            if count_tokens(chunk.content) != chunk.token_count:
+                return "token count does not match the content"
+            if previous is not None:
+                if chunk.start <= previous.start or chunk.end <= previous.end:
+                    return "chunks out of order"
+                shared = document[start:previous.end + base].decode('utf-8', 'surrogatepass')
+                if chunk.start < previous.end and count_tokens(shared) > chunker.overlap_tokens:
+                    return "overlap larger than overlap_tokens"
+            previous = chunk
+
+        # Every token lies inside some chunk
+        byte_at = np.cumsum([0] + [len(c.encode('utf-8', 'surrogatepass')) for c in text])
+        i = 0
+        for token_start, token_end in spans:
+            while i < len(chunks) and chunks[i].end < byte_at[token_end]:
+                i += 1
+            if i == len(chunks) or chunks[i].start > byte_at[token_start]:
+                return f"token at {token_start} not covered"
+        base += len(text.encode('utf-8', 'surrogatepass'))
+    return None
+
+
+class ChunkerPropertyTests(SimpleTestCase):
+    """Coverage, ordering, size, overlap, byte offset and termination
+    properties of every chunking strategy on random texts
+    """
+
+    cases = 500
+
+    def test_random_texts(self):
+        rng = np.random.default_rng(0)
+        for case in range(self.cases):
+            text = ''.join(rng.choice(ALPHABET, int(rng.integers(0, 3000))))
+            if case % 10 == 0:
+                text = 'x' * int(rng.integers(1, 20000))  # one long word, no boundaries at all
+            chunk_tokens = int(rng.integers(1, 65))
+            overlap_tokens = int(rng.integers(0, chunk_tokens))
+            # Split into a few pages at random points to exercise offsets across pages
+            cuts = sorted(rng.integers(0, len(text) + 1, int(rng.integers(0, 3))))
+            pages = [(text[a:b], n) for n, (a, b) in enumerate(zip([0] + cuts, cuts + [len(text)]), 1)]
+            for name, chunker_class in CHUNKERS.items():
+                with self.subTest(case=case, strategy=name, chunk_tokens=chunk_tokens, overlap=overlap_tokens):
+                    self.assertIsNone(check_chunks(chunker_class(chunk_tokens, overlap_tokens), pages))
+
+    def test_empty_pages(self):
+        for name, chunker_class in CHUNKERS.items():
+            with self.subTest(strategy=name):
+                self.assertEqual(list(chunker_class(32, 8).chunk_pages([('', 1), ('  \n\n ', 2)])), [])
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+
+class DocumentUpdateTests(TestCase):
+    """Uploading a new version of a document that is already being served"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vectormind-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        overrides = override_settings(
+            VECTOR_DB_PATH=self.directory,
+            MEDIA_ROOT=self.directory,
+            CHUNKING_STRATEGY='recursive',
+            CHUNK_TOKENS=128,
+            CHUNK_OVERLAP_TOKENS=16,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        chunk_cache.clear()
+        self.addCleanup(chunk_cache.clear)
+        self.embeddings = CountingEmbeddings(dimension=32)
+        self.user = User.objects.create_user(username='reader', password='reader')
+        rng = np.random.default_rng(0)
+        words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel']
+        self.paragraphs = [' '.join(rng.choice(words, 60)).capitalize() + '.' for _ in range(12)]
+        # One paragraph is rewritten and the first moves to the end
+        self.edited = self.paragraphs[1:] + self.paragraphs[:1]
+        self.edited[5] = 'Entirely new text about something else. ' * 10
+
+    def _create(self, paragraphs) -> Document:
+        document = Document(title='notes', document_type='txt', uploaded_by=self.user)
+        document.file.save('notes.txt', ContentFile('\n\n'.join(paragraphs).encode()), save=False)
+        document.save()
+        self._process(document)
+        return document
+
+    def _upload(self, document: Document, paragraphs) -> Document:
+        """Upload a new version the way `PUT api/doc/<id>` does, unprocessed"""
+        upload = SimpleUploadedFile('notes.txt', '\n\n'.join(paragraphs).encode())
+        serializer = DocumentUploadSerializer(document, data={'file': upload})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        return serializer.save()
+
+    def _process(self, document: Document):
+        self.assertTrue(DocumentProcessor(embedding_model=self.embeddings).process_document(document))
+
+    def _retrieval(self) -> RetrievalService:
+        retrieval = RetrievalService(embedding_model=self.embeddings)
+        # The process-wide stores may still point at another test's directory
+        retrieval.index_store = IndexStore(self.directory, reload_interval=0)
+        retrieval.lexical_store = LexicalStore(lexical_dir(self.directory), reload_interval=0)
+        return retrieval
+
+    def _live_chunk_ids(self, document: Document):
+        directory = store_dir(self.directory)
+        id_map = VectorIdMap.load(directory)
+        positions = id_map.positions_for_documents([document.id])
+        return id_map.chunk_ids_at(np.setdiff1d(positions, load_tombstones(directory)))
+
+    def test_hydrate_through_warm_cache_after_update(self):
+        document = self._create(self.paragraphs)
+        retrieval = self._retrieval()
+        old_ids = self._live_chunk_ids(document)
+        warm = retrieval.hydrate_chunks(old_ids)
+        self.assertEqual(len(warm), len(old_ids))
+
+        self._process(self._upload(document, self.edited))
+        # The update ran in a Celery worker; a web worker's cache still holds
+        # every chunk it hydrated before
+        chunk_cache.set_many(warm)
+
+        live_ids = self._live_chunk_ids(document)
+        hydrated = retrieval.hydrate_chunks(live_ids)
+        current = {chunk.id: chunk for chunk in document.chunks.all()}
+        self.assertEqual(set(hydrated), set(current))
+        for chunk_id, chunk in hydrated.items():
+            self.assertEqual(
+                (chunk.chunk_index, chunk.page_number, chunk.start_offset, chunk.end_offset, chunk.content),
+                (current[chunk_id].chunk_index, current[chunk_id].page_number, current[chunk_id].start_offset,
+                 current[chunk_id].end_offset, current[chunk_id].content),
+            )
+            self.assertEqual(chunk.document.version, 2)
+        # Only chunks whose text changed were embedded again
+        previous = {chunk.content for chunk in warm.values()}
+        changed = [chunk for chunk in current.values() if chunk.content not in previous]
+        self.assertLess(len(changed), len(current))
+        self.assertEqual(self.embeddings.texts, len(old_ids) + len(changed))
+
+    def test_cached_chunks_get_the_current_document(self):
+        document = self._create(self.paragraphs)
+        retrieval = self._retrieval()
+        chunk_ids = self._live_chunk_ids(document)
+        self.assertEqual({chunk.document.title for chunk in retrieval.hydrate_chunks(chunk_ids).values()}, {'notes'})
+
+        Document.objects.filter(id=document.id).update(title='renamed', version=7)
+        hits = chunk_cache.hits
+        hydrated = retrieval.hydrate_chunks(chunk_ids)
+        self.assertEqual(chunk_cache.hits, hits + len(chunk_ids))
+        self.assertEqual({(chunk.document.title, chunk.document.version) for chunk in hydrated.values()}, {('renamed', 7)})
+
+        # A document deleted without going through remove_document_vectors
+        Document.objects.filter(id=document.id).delete()
+        self.assertEqual(retrieval.hydrate_chunks(chunk_ids), {})
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        EMBEDDING_PROVIDER='myapp.benchmarks.providers.FakeEmbeddings',
+        EMBEDDING_PROVIDER_OPTIONS={'dimension': 32},
+        EMBEDDING_MODEL='fake-embedding',
+        EMBEDDING_CACHE_ENABLED=False,
+    )
+    def test_answers_given_while_processing_retire(self):
+        document = self._create(self.paragraphs)
+        answers = SemanticAnswerCache(cache_alias='default')
+        retrieval = self._retrieval()
+        qa_service = QuestionAnsweringService(retrieval, LLMService(llm=FakeChatModel()), answers)
+        question = document.chunks.order_by('chunk_index').first().content
+
+        # The new version is uploaded; until it is processed the previous one
+        # is served, and answers built from it are cached
+        old_file = document.file.name
+        document = self._upload(document, self.edited)
+        self.assertEqual(document.version, 2)
+        qa_service.answer(self.user, question)
+        self.assertIsNotNone(answers.lookup(self.user.id, retrieval.embed_query(question)))
+        self.assertTrue(document.file.storage.exists(old_file))
+
+        # Without the Redis result backend and broker, progress and index
+        # maintenance are not reported or queued
+        with patch.object(process_document_task, 'update_state'), patch('myapp.tasks.schedule_index_maintenance'):
+            self.assertTrue(process_document_task.apply(args=[document.id], kwargs={'replaced_file': old_file}).get())
+        self.assertIsNone(answers.lookup(self.user.id, retrieval.embed_query(question)))
+        self.assertEqual(answers.stats()['stale'], 1)
+        self.assertFalse(document.file.storage.exists(old_file))
+        self.assertTrue(document.file.storage.exists(document.file.name))
+
+
+class MetricsFileTests(SimpleTestCase):
+    """Processes sharing METRICS_DIR from several containers"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vectormind-metrics-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def _write(self, name, value):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump({'histograms': [], 'counters': [['vectormind_test_total', {}, value]]}, f)
+
+    def test_only_own_host_files_are_folded(self):
+        registry = MetricsRegistry(self.directory, flush_interval=3600)
+        # No process has this pid here; in another container it may be running
+        dead_pid = 2 ** 22 + 1
+        self._write(f'{HOST_NAME}-{dead_pid}-1.json', 1)
+        self._write(f'other-container-{dead_pid}-1.json', 10)
+        self._write(f'{dead_pid}-1.json', 100)
+
+        _, counters = registry.collect()
+        self.assertEqual(counters[('vectormind_test_total', ())], 111)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([
+            ARCHIVE_FILE, 'collect.lock', f'other-container-{dead_pid}-1.json',
+        ]))
+        # Folded totals are counted once, the other host's file again
+        _, counters = registry.collect()
+        self.assertEqual(counters[('vectormind_test_total', ())], 111)
+
+
+class TaskEmbeddings(FakeEmbeddings):
+    """Embeds queries apart from documents, as Gemini's task types do"""
+
+    def embed_query(self, text):
+        return self.embed_documents([f'query: {text}'])[0]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([f'query: {text}']))[0]
+
+
+class TaskTypeEmbeddings(FakeEmbeddings):
+    """Takes a Gemini-style task_type, recording the ones it was called with"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.task_types = []
+
+    def embed_documents(self, texts, task_type=None):
+        self.task_types.append(task_type)
+        return super().embed_documents([f'{task_type}: {text}' for text in texts])
+
+    def embed_query(self, text):
+        return self.embed_documents([text], task_type='retrieval_query')[0]
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedEmbeddingsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.provider = TaskEmbeddings(dimension=8)
+        self.embeddings = CachedEmbeddings(self.provider, model_name='fake', cache_alias='default')
+        caches['default'].clear()
+
+    def test_queries_use_the_query_task_and_their_own_keys(self):
+        text = 'What is the refund policy?'
+        document = self.embeddings.embed_documents([text])[0]
+        query = self.embeddings.embed_query(text)
+        self.assertEqual(query, self.provider.embed_query(text))
+        self.assertNotEqual(query, document)
+        calls = self.provider.calls
+        self.assertEqual(self.embeddings.embed_query(text), query)
+        self.assertEqual(self.embeddings.embed_documents([text])[0], document)
+        self.assertEqual(self.provider.calls, calls)
+
+    def test_async_query(self):
+        text = 'What is the refund policy?'
+        query = asyncio.run(self.embeddings.aembed_query(text))
+        self.assertEqual(query, self.provider.embed_query(text))
+        calls = self.provider.calls
+        self.assertEqual(self.embeddings.embed_query(text), query)
+        self.assertEqual(self.provider.calls, calls)
+
+    def test_batched_questions_use_the_query_task(self):
+        provider = TaskTypeEmbeddings(dimension=8)
+        embeddings = CachedEmbeddings(provider, model_name='fake', cache_alias='default')
+        batcher = QueryBatcher(embeddings, window=0.05, max_size=8, max_in_flight=1)
+        texts = ['first question', 'second question']
+        futures = [batcher.submit(text, text) for text in texts]
+        vectors = [future.result(timeout=5) for future in futures]
+        self.assertEqual(provider.task_types, ['retrieval_query'])
+        self.assertEqual(vectors, [provider.embed_query(text) for text in texts])
+        # Cached under the same keys as single questions
+        self.assertEqual(embeddings.embed_query(texts[0]), vectors[0])
+        self.assertEqual(provider.task_types, ['retrieval_query'] * 3)
+
+
+class IndexWriterTests(SimpleTestCase):
+    """Appends, deletes, merges and compaction of the on-disk vector store,
+    as IndexStore serves them
+    """
+
+    dimension = 16
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vectormind-index-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        overrides = override_settings(VECTOR_DB_PATH=self.directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # Search through the FAISS index and the delta rather than scanning
+        # each user's few vectors directly
+        patcher = patch('myapp.services.index_store.SUBSET_SEARCH_MAX_VECTORS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer = IndexWriter(self.directory)
+        self.rng = np.random.default_rng(0)
+
+    def _append(self, n, user_id=1, document_id=None):
+        vectors = self.rng.standard_normal((n, self.dimension)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        chunk_ids = [uuid.uuid4() for _ in range(n)]
+        self.writer.append(vectors, chunk_ids, [document_id or uuid.uuid4()] * n, [user_id] * n, model='fake')
+        return chunk_ids, vectors
+
+    def _snapshot(self):
+        return IndexStore(self.directory, reload_interval=3600).get_snapshot()
+
+    @staticmethod
+    def _search(snapshot, vector, k=1, user_id=1):
+        _, positions = snapshot.search(vector, k, user_id)
+        return snapshot.id_map.chunk_ids_at(positions)
+
+    def test_append_then_search(self):
+        base_ids, base_vectors = self._append(20)
+        other_ids, other_vectors = self._append(5, user_id=2)
+        self.assertTrue(self.writer.merge())
+        delta_ids, delta_vectors = self._append(10)
+
+        snapshot = self._snapshot()
+        self.assertEqual((snapshot.base_count, snapshot.delta_count), (25, 10))
+        for chunk_id, vector in zip(base_ids + delta_ids, np.concatenate([base_vectors, delta_vectors])):
+            self.assertEqual(self._search(snapshot, vector), [chunk_id])
+        # Only the asking user's vectors are searched
+        for vector in other_vectors:
+            self.assertFalse(set(self._search(snapshot, vector, k=30)) & set(other_ids))
+        self.assertEqual(set(self._search(snapshot, other_vectors[0], k=30, user_id=2)), set(other_ids))
+
+    def test_delete_hides_vectors(self):
+        document_id = uuid.uuid4()
+        kept_ids, _ = self._append(10, document_id=document_id)
+        deleted_document = uuid.uuid4()
+        document_ids, document_vectors = self._append(10, document_id=deleted_document)
+        self.assertTrue(self.writer.merge())
+        chunk_ids, chunk_vectors = self._append(5)
+
+        self.assertEqual(self.writer.delete_documents([deleted_document]), 10)
+        self.assertEqual(self.writer.delete_chunks(chunk_ids[:2]), 2)
+        self.assertEqual(self.writer.delete_chunks(chunk_ids[:2]), 0)
+
+        snapshot = self._snapshot()
+        self.assertEqual(snapshot.live_count, 13)
+        deleted = set(document_ids + chunk_ids[:2])
+        for vector in np.concatenate([document_vectors, chunk_vectors[:2]]):
+            self.assertFalse(set(self._search(snapshot, vector, k=25)) & deleted)
+        self.assertEqual(set(self._search(snapshot, chunk_vectors[2], k=25)), set(kept_ids + chunk_ids[2:]))
+        self.assertEqual(self.writer.read_vectors(chunk_ids)[0], chunk_ids[2:])
+
+    def test_compaction_keeps_survivors_and_drops_tombstones(self):
+        chunk_ids, vectors = self._append(30)
+        self.assertTrue(self.writer.merge())
+        self.writer.delete_chunks(chunk_ids[::3])
+        self.assertTrue(self.writer.needs_compaction())
+
+        self.assertTrue(self.writer.compact())
+        self.assertFalse(self.writer.compact())
+        self.assertEqual(len(load_tombstones(store_dir(self.directory))), 0)
+        self.assertEqual(self.writer.dead_fraction(), 0.0)
+
+        snapshot = self._snapshot()
+        survivors = [i for i in range(30) if i % 3]
+        self.assertEqual((snapshot.ntotal, snapshot.base_count), (20, 20))
+        self.assertEqual(set(snapshot.id_map.chunk_ids_at(range(snapshot.ntotal))), {chunk_ids[i] for i in survivors})
+        for i in survivors:
+            self.assertEqual(self._search(snapshot, vectors[i]), [chunk_ids[i]])
+        found, stored = self.writer.read_vectors([chunk_ids[i] for i in survivors])
+        self.assertEqual(found, [chunk_ids[i] for i in survivors])
+        np.testing.assert_array_equal(stored, vectors[survivors])
+
+    def test_merge_while_a_snapshot_is_served(self):
+        chunk_ids, vectors = self._append(20)
+        self.assertTrue(self.writer.merge())
+        store = IndexStore(self.directory, reload_interval=3600)
+        served = store.get_snapshot()
+        expected = [self._search(served, vector, k=5) for vector in vectors]
+
+        # Searches keep running on the served snapshot while the writer
+        # appends and merges
+        failures, done = [], threading.Event()
+
+        def search():
+            while not done.is_set():
+                for vector, result in zip(vectors, expected):
+                    if self._search(served, vector, k=5) != result:
+                        failures.append(result)
+
+        searcher = threading.Thread(target=search)
+        searcher.start()
+        try:
+            new_ids, new_vectors = self._append(10)
+            self.assertTrue(self.writer.merge())
+        finally:
+            done.set()
+            searcher.join()
+        self.assertEqual(failures, [])
+        self.assertEqual(served.ntotal, 20)
+        self.assertFalse(set(self._search(served, new_vectors[0], k=20)) & set(new_ids))
+
+        store._reload()
+        current = store.get_snapshot()
+        self.assertIsNot(current, served)
+        self.assertEqual((current.base_count, current.delta_count), (30, 0))
+        for chunk_id, vector in zip(chunk_ids + new_ids, np.concatenate([vectors, new_vectors])):
+            self.assertEqual(self._search(current, vector), [chunk_id])
+
+
+class LexicalIndexTests(SimpleTestCase):
+    """BM25 search over the segments of the lexical index"""
+
+    texts = [
+        'the refund policy allows returns within thirty days',
+        'refund requests need the order number and the refund reason',
+        'shipping takes five days',
+        'error ERR-4021 means the payment was declined',
+        'the policy on shipping damage',
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vectormind-lexical-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.writer = LexicalIndexWriter(self.directory)
+
+    def _snapshot(self):
+        return LexicalStore(self.directory, reload_interval=3600).get_snapshot()
+
+    @staticmethod
+    def _bm25(question, texts):
+        """Reference BM25 scores of every text, by the textbook formula"""
+        documents = [lexical_terms(text) for text in texts]
+        average = sum(map(len, documents)) / len(documents)
+        scores = []
+        for words in documents:
+            score = 0.0
+            for term in set(lexical_terms(question)):
+                df = sum(term in other for other in documents)
+                tf = words.count(term)
+                if tf:
+                    idf = np.log1p((len(documents) - df + 0.5) / (df + 0.5))
+                    score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * len(words) / average))
+            scores.append(score)
+        return scores
+
+    def test_bm25_scores(self):
+        chunk_ids = [uuid.uuid4() for _ in self.texts]
+        self.writer.add(chunk_ids, [1] * len(self.texts), self.texts)
+        question = 'refund policy'
+        expected = self._bm25(question, self.texts)
+        results = self._snapshot().search(question, 1, 10)
+        self.assertEqual([chunk_id for chunk_id, _ in results],
+                         [chunk_ids[i] for i in np.argsort(expected)[::-1] if expected[i] > 0])
+        for chunk_id, score in results:
+            self.assertAlmostEqual(score, expected[chunk_ids.index(chunk_id)], places=5)
+
+    def test_identifiers_match_whole_and_by_parts(self):
+        chunk_ids = [uuid.uuid4() for _ in self.texts]
+        self.writer.add(chunk_ids, [1] * len(self.texts), self.texts)
+        snapshot = self._snapshot()
+        self.assertEqual(snapshot.search('err-4021', 1, 1)[0][0], chunk_ids[3])
+        self.assertEqual(snapshot.search('code 4021', 1, 1)[0][0], chunk_ids[3])
+
+    def test_only_the_users_chunks_are_searched(self):
+        mine = [uuid.uuid4() for _ in self.texts]
+        theirs = [uuid.uuid4() for _ in self.texts]
+        self.writer.add(mine[:3] + theirs, [1] * 3 + [2] * len(self.texts), self.texts[:3] + self.texts)
+        self.writer.add(mine[3:], [1] * 2, self.texts[3:])
+        snapshot = self._snapshot()
+        for question in ('refund policy', 'shipping', 'ERR-4021 declined'):
+            found = {chunk_id for chunk_id, _ in snapshot.search(question, 1, 10)}
+            self.assertTrue(found)
+            self.assertLessEqual(found, set(mine))
+        self.assertEqual(snapshot.user_stats(1), snapshot.user_stats(2))
+        self.assertEqual(snapshot.search('refund', 3, 10), [])
+
+    @override_settings(LEXICAL_MAX_SEGMENTS=2)
+    def test_merge_drops_deleted_chunks(self):
+        chunk_ids = [uuid.uuid4() for _ in self.texts]
+        for chunk_id, text in zip(chunk_ids, self.texts):
+            self.writer.add([chunk_id], [1], [text])
+        deleted = chunk_ids[1]
+        self.writer.delete_chunks([deleted])
+        before = self._snapshot().search('refund policy shipping', 1, 10)
+        self.assertNotIn(deleted, [chunk_id for chunk_id, _ in before])
+
+        self.assertTrue(self.writer.needs_merge())
+        while self.writer.needs_merge():
+            self.assertTrue(self.writer.merge())
+        self.assertLessEqual(len(read_manifest(self.directory)['segments']), 2)
+
+        # Merged, the index scores exactly like one built without the deleted chunk
+        live = [i for i in range(len(self.texts)) if chunk_ids[i] != deleted]
+        question = 'refund policy shipping'
+        expected = self._bm25(question, [self.texts[i] for i in live])
+        results = dict(self._snapshot().search(question, 1, 10))
+        self.assertEqual(set(results), {chunk_ids[i] for i, score in zip(live, expected) if score > 0})
+        for i, score in zip(live, expected):
+            if score > 0:
+                self.assertAlmostEqual(results[chunk_ids[i]], score, places=5)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+
+    def test_items_in_both_lists_rank_first(self):
+        dense = [('a', 0.9), ('b', 0.8), ('c', 0.7)]
+        lexical = [('c', 12.0), ('d', 9.0)]
+        fused = reciprocal_rank_fusion([dense, lexical], k=60)
+        self.assertEqual([item for item, _ in fused], ['c', 'a', 'b', 'd'])
+        self.assertAlmostEqual(dict(fused)['c'], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(dict(fused)['d'], 1 / 62)
+
+    def test_ranks_not_scores_decide(self):
+        # The lexical list's much larger scores carry no extra weight
+        fused = reciprocal_rank_fusion([[('a', 0.01)], [('b', 1000.0)]], k=1)
+        self.assertEqual(dict(fused), {'a': 0.5, 'b': 0.5})
+        self.assertEqual([item for item, _ in reciprocal_rank_fusion([[('a', 1), ('b', 1)], [('b', 1)]], k=1)], ['b', 'a'])
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SemanticAnswerCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        user = User.objects.create_user(username='asker', password='asker')
+        document = Document.objects.create(title='notes', file='documents/notes.txt', document_type='txt', uploaded_by=user)
+        self.chunk = DocumentChunk.objects.create(document=document, content='text', chunk_index=0)
+        self.user_id = user.id
+        self.rng = np.random.default_rng(0)
+        # A fixed clock, moved forward by the tests
+        clock = patch('myapp.services.answer_cache.time')
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+        self.clock.time.return_value = 1000.0
+
+    def _cache(self, **kwargs):
+        return SemanticAnswerCache(cache_alias='default', **{'threshold': 0.9, 'ttl': 60, 'max_entries': 10, **kwargs})
+
+    def _question(self, dimension=8):
+        vector = self.rng.standard_normal(dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _near(self, question, similarity):
+        """A unit vector at the given cosine similarity to question"""
+        other = self._question(len(question))
+        other -= (other @ question) * question
+        other /= np.linalg.norm(other)
+        return similarity * question + np.sqrt(1 - similarity ** 2) * other
+
+    def _store(self, cache, question, answer):
+        cache.store(self.user_id, question, {'answer': answer, 'sources': []}, [self.chunk.id])
+
+    def _answer(self, cache, question):
+        response = cache.lookup(self.user_id, question)
+        return response and response['answer']
+
+    def test_threshold(self):
+        cache = self._cache()
+        question = self._question()
+        self._store(cache, question, 'refunds')
+        self.assertEqual(self._answer(cache, question), 'refunds')
+        self.assertEqual(self._answer(cache, self._near(question, 0.95)), 'refunds')
+        self.assertIsNone(self._answer(cache, self._near(question, 0.85)))
+        # Another user never gets it
+        self.assertIsNone(cache.lookup(self.user_id + 1, question))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stale']), (2, 2, 0))
+
+    def test_entries_expire_after_ttl(self):
+        cache = self._cache()
+        question = self._question()
+        self._store(cache, question, 'refunds')
+        self.clock.time.return_value = 1059.0
+        self.assertEqual(self._answer(cache, question), 'refunds')
+        self.clock.time.return_value = 1061.0
+        self.assertIsNone(self._answer(cache, question))
+
+    def test_least_recently_used_are_evicted(self):
+        cache = self._cache(max_entries=3)
+        questions = [self._question() for _ in range(4)]
+        for i, question in enumerate(questions[:3]):
+            self.clock.time.return_value = 1000.0 + i
+            self._store(cache, question, f'answer {i}')
+        # Using the oldest entry makes the second one the least recently used
+        self.clock.time.return_value = 1010.0
+        self.assertEqual(self._answer(cache, questions[0]), 'answer 0')
+        self.clock.time.return_value = 1011.0
+        self._store(cache, questions[3], 'answer 3')
+
+        self.assertEqual([self._answer(cache, question) for question in questions],
+                         ['answer 0', None, 'answer 2', 'answer 3'])
+
+    def test_dimension_change_resets_the_entries(self):
+        cache = self._cache()
+        old, new = self._question(8), self._question(16)
+        self._store(cache, old, 'old model')
+        self.assertIsNone(self._answer(cache, new))
+        self._store(cache, new, 'new model')
+        self.assertEqual(self._answer(cache, new), 'new model')
+        self.assertIsNone(self._answer(cache, old))
+
+    def test_answers_from_deleted_chunks_are_stale(self):
+        cache = self._cache()
+        question = self._question()
+        self._store(cache, question, 'refunds')
+        self.chunk.delete()
+        self.assertIsNone(self._answer(cache, question))
+        self.assertEqual(cache.stats()['stale'], 1)
+
+
+class MMRTests(SimpleTestCase):
+    # A best chunk, a near copy of it, and a less relevant one on another topic
+    vectors = np.array([[1.0, 0.0, 0.0], [0.99, np.sqrt(1 - 0.99 ** 2), 0.0], [0.0, 0.0, 1.0]], dtype=np.float32)
+    relevance = np.array([1.0, 0.95, 0.6], dtype=np.float32)
+
+    def test_no_diversity_keeps_relevance_order(self):
+        self.assertEqual(mmr(self.relevance, self.vectors, 3, diversity=0.0).tolist(), [0, 1, 2])
+
+    def test_diversity_prefers_new_content_over_a_near_copy(self):
+        # Second pick: 0.7 * 0.6 for the other topic beats 0.7 * 0.95 - 0.3 * 0.99 for the copy
+        self.assertEqual(mmr(self.relevance, self.vectors, 3, diversity=0.3).tolist(), [0, 2, 1])
+        self.assertEqual(mmr(self.relevance, self.vectors, 2, diversity=0.3).tolist(), [0, 2])
+        # With little weight on diversity, the copy's relevance still wins
+        self.assertEqual(mmr(self.relevance, self.vectors, 3, diversity=0.1).tolist(), [0, 1, 2])
+
+    def test_duplicates_are_dropped(self):
+        self.assertEqual(mmr(self.relevance, self.vectors, 3, diversity=0.0, duplicate_threshold=0.98).tolist(), [0, 2])
+
+    def test_edge_cases(self):
+        self.assertEqual(mmr(np.empty(0), np.empty((0, 3)), 3).tolist(), [])
+        self.assertEqual(mmr(self.relevance, self.vectors, 0).tolist(), [])
+        np.testing.assert_allclose(unit_range(np.array([2.0, 4.0, 3.0])), [0.0, 1.0, 0.5])
+        np.testing.assert_array_equal(unit_range(np.array([5.0, 5.0])), [1.0, 1.0])
+
+
+class SlowReranker:
+    """Scores texts by length once `release` is set"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def score(self, question, texts):
+        self.release.wait(5)
+        if question == 'fail':
+            raise RuntimeError("reranker down")
+        return [len(text) for text in texts]
+
+
+class BudgetedRerankerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.model = SlowReranker()
+        self.reranker = BudgetedReranker(self.model, budget=0.05, max_in_flight=1)
+        self.addCleanup(self.model.release.set)
+
+    def test_scores_within_budget(self):
+        self.model.release.set()
+        np.testing.assert_array_equal(self.reranker.score('q', ['a', 'abc']), [1, 3])
+        np.testing.assert_array_equal(asyncio.run(self.reranker.ascore('q', ['ab'])), [2])
+        with self.assertLogs('myapp.services.reranking', 'ERROR'):
+            self.assertIsNone(self.reranker.score('fail', ['a']))
+        self.assertEqual(self.reranker.stats(), {'scored': 2, 'timeouts': 0, 'skipped': 0})
+
+    def test_late_scores_keep_retrieval_order(self):
+        self.assertIsNone(self.reranker.score('q', ['a']))
+        # The late call still holds the only slot, so the next query skips reranking
+        self.assertIsNone(asyncio.run(self.reranker.ascore('q', ['a'])))
+        self.assertEqual(self.reranker.stats(), {'scored': 0, 'timeouts': 1, 'skipped': 1})
+        self.model.release.set()
+        self.reranker._executor.shutdown(wait=True)
+        self.assertTrue(self.reranker._slots.acquire(blocking=False))
+
+
+class PackContextTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel']
+        self.text = ' '.join(rng.choice(words, 400)) + '.'
+        self.document_id = uuid.uuid4()
+        self.chunks = [
+            DocumentChunk(document_id=self.document_id, chunk_index=i, content=chunk.content, start_offset=chunk.start,
+                          end_offset=chunk.end, token_count=chunk.token_count)
+            for i, chunk in enumerate(get_chunker('recursive', chunk_tokens=40, overlap_tokens=10).chunk_pages([(self.text, 1)]))
+        ]
+
+    @staticmethod
+    def _passages(packed):
+        return [passage.split(':\n', 1)[1].rstrip('\n') for passage in packed.text.split('\nContext ')]
+
+    def test_neighbours_join_without_their_overlap(self):
+        packed = pack_context([(chunk, 1.0 - i / 100) for i, chunk in enumerate(self.chunks)], budget=10_000)
+        self.assertEqual(self._passages(packed), [self.text])
+        self.assertEqual(packed.dropped, 0)
+        # The overlap is not paid for twice
+        self.assertLessEqual(packed.tokens - count_tokens('Context 1:\n'), count_tokens(self.text) + len(self.chunks))
+
+    def test_overlap_found_by_text_without_offsets(self):
+        end = self.chunks[2].end_offset
+        for chunk in self.chunks:
+            chunk.start_offset = chunk.end_offset = None
+        packed = pack_context([(chunk, 1.0) for chunk in self.chunks[:3]], budget=10_000)
+        self.assertEqual(self._passages(packed), [self.text[:end]])
+
+    def test_budget_is_respected(self):
+        scored = [(chunk, float(score)) for chunk, score in zip(self.chunks, np.random.default_rng(1).random(len(self.chunks)))]
+        for budget in (45, 100, 200):
+            with self.subTest(budget=budget):
+                packed = pack_context(scored, budget=budget)
+                self.assertLessEqual(sum(count_tokens(passage) for passage in self._passages(packed)), budget)
+                self.assertGreater(packed.dropped, 0)
+                # The best chunk is always in
+                best = max(scored, key=lambda pair: pair[1])
+                self.assertIn(best, packed.chunks)
+                self.assertEqual(len(packed.chunks) + packed.dropped, len(scored))
+
+    def test_a_chunk_that_does_not_fit_makes_room_for_a_shorter_one(self):
+        long = DocumentChunk(document_id=uuid.uuid4(), chunk_index=0, content='word ' * 30, token_count=30)
+        short = DocumentChunk(document_id=uuid.uuid4(), chunk_index=0, content='word ' * 5, token_count=5)
+        packed = pack_context([(self.chunks[0], 0.9), (long, 0.8), (short, 0.7)], budget=self.chunks[0].token_count + 10)
+        self.assertEqual([chunk for chunk, _ in packed.chunks], [self.chunks[0], short])
+        self.assertEqual(packed.dropped, 1)
+
+    def test_best_chunk_is_cut_to_the_budget(self):
+        packed = pack_context([(self.chunks[0], 1.0), (self.chunks[5], 0.5)], budget=5)
+        (passage,) = self._passages(packed)
+        self.assertEqual(count_tokens(passage), 5)
+        self.assertTrue(self.chunks[0].content.startswith(passage))
+        self.assertEqual(packed.dropped, 1)
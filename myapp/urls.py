@@ -1,6 +1,6 @@
 
 
-from myapp.views import home, DocumentViewSet, KnowledgeAssistantViewSet,RegisterView
+from myapp.views import home, DocumentViewSet, IngestBatchViewSet, RegisterView, knowledge_assistant, ask_question_stream
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView
 
@@ -9,7 +9,11 @@ urlpatterns = [
     
     path('index', home, name='home'),
     path('doc', DocumentViewSet.as_view({'get': 'list', 'post': 'create'}), name='document-list'),
-    path('bot', KnowledgeAssistantViewSet.as_view({'post': 'ask_question', 'get': 'query_history'}), name='knowledge-assistant'),
+    path('doc/bulk', IngestBatchViewSet.as_view({'get': 'list', 'post': 'create'}), name='ingest-batch-list'),
+    path('doc/bulk/<uuid:pk>', IngestBatchViewSet.as_view({'get': 'retrieve'}), name='ingest-batch-detail'),
+    path('doc/<uuid:pk>', DocumentViewSet.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}), name='document-detail'),
+    path('bot', knowledge_assistant, name='knowledge-assistant'),
+    path('bot/stream', ask_question_stream, name='knowledge-assistant-stream'),
     
     #signin/signup
     path('register', RegisterView.as_view(), name='register'),
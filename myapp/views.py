@@ -1,15 +1,31 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action,api_view
 from rest_framework.response import Response
+import hmac
 import time
-from .models import Document, QueryLog
-from .services.document_processor import DocumentProcessor
-from .tasks import process_document_task
-from .services.retrieval_service import RetrievalService
-from .services.llm_service import LLMService
+import json
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
+from .models import Document, IngestBatch, QueryLog
+from .services.bulk_ingest import expand_uploads
+from .services.document_processor import DocumentProcessor, remove_document_vectors
+from .tasks import process_document_task, schedule_index_maintenance, start_bulk_ingest
+from .services.question_answering import QuestionAnsweringService, NO_RESULTS_ANSWER
+from .services.answer_cache import SemanticAnswerCache
+from .services.embedding_cache import CachedEmbeddings
+from .services.index_store import get_index_store
+from .services.metrics import get_metrics, render, series_key
+from .services.tracing import record, trace
 from .serializers import (
+    MAX_UPLOAD_BYTES,
     DocumentUploadSerializer, 
     DocumentSerializer, 
+    IngestBatchSerializer,
     QuestionSerializer, 
     QueryLogSerializer,
     UserSerializer
@@ -77,54 +93,89 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return Response(response_data, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
-class KnowledgeAssistantViewSet(viewsets.ViewSet):
-    
-    @action(detail=False, methods=['post'])
-    def ask_question(self, request):
-        """Main endpoint for asking questions"""
-        serializer = QuestionSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        
-        question = serializer.validated_data['question']
-        start_time = time.time()
-        
-        try:
-            # Retrieve relevant chunks with user_id filtering
-            retrieval_service = RetrievalService()
-            user_id = str(request.user.id)
-            relevant_chunks = retrieval_service.retrieve_relevant_chunks(question, user_id=user_id)
-            
-            if not relevant_chunks:
-                response_data = {
-                    "answer": "I couldn't find any relevant information in the knowledge base to answer your question.",
-                    "sources": [],
-                    # "confidence": 0.0,
-                    "response_time": time.time() - start_time
-                }
-            else:
-                # Generate answer using LLM
-                llm_service = LLMService()
-                response_data = llm_service.generate_answer(question, relevant_chunks)
-                response_data["response_time"] = time.time() - start_time
-            
-            # Log the query
-            QueryLog.objects.create(
-                user=request.user,
-                question=question,
-                answer=response_data["answer"],
-                sources=response_data["sources"],
-                response_time=response_data["response_time"]
+
+    def update(self, request, pk=None):
+        """Upload a new version of a document; only its new or changed
+        chunks are embedded again
+        """
+        document = self.get_object()
+        if 'file' not in request.FILES:
+            return Response(
+                {"error": "No file provided"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
+
+        serializer = DocumentUploadSerializer(
+            document,
+            data={'file': request.FILES['file']},
+            context={'request': request}
+        )
+
+        if serializer.is_valid():
+            replaced_file = document.file.name
+            document = serializer.save()
+            process_document_task.delay(document.id, replaced_file=replaced_file)
+
+            response_data = DocumentSerializer(document).data
+            response_data['message'] = f"Version {document.version} of '{document.title}' uploaded successfully. Processing started asynchronously."
             return Response(response_data, status=status.HTTP_200_OK)
-            
-        except Exception as e:
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def perform_destroy(self, instance):
+        """Delete the document along with its vectors"""
+        remove_document_vectors(instance)
+        instance.delete()
+        schedule_index_maintenance()
+
+
+class IngestBatchViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = IngestBatchSerializer
+
+    def get_queryset(self):
+        return IngestBatch.objects.filter(uploaded_by=self.request.user)
+
+    def create(self, request):
+        """Upload many documents at once, as several `files` and/or .zip
+        archives, and ingest them as one batch whose progress is polled at
+        doc/bulk/<id>
+        """
+        files = request.FILES.getlist('files')
+        if not files:
             return Response(
-                {"error": f"Internal server error: {str(e)}"}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "No files provided"},
+                status=status.HTTP_400_BAD_REQUEST
             )
+
+        batch = IngestBatch.objects.create(uploaded_by=request.user)
+        documents, errors = [], []
+        for file, error in expand_uploads(files, max_member_bytes=MAX_UPLOAD_BYTES):
+            if error:
+                errors.append(error)
+                continue
+            if len(documents) >= settings.BULK_INGEST_MAX_FILES:
+                errors.append({'file': file.name, 'error': f"More than {settings.BULK_INGEST_MAX_FILES} files"})
+                continue
+            serializer = DocumentUploadSerializer(data={'file': file}, context={'request': request})
+            if serializer.is_valid():
+                documents.append(serializer.save(batch=batch))
+            else:
+                errors.append({'file': file.name, 'error': serializer.errors['file']})
+
+        if not documents:
+            batch.delete()
+            return Response({"error": "No valid files provided", "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch.total_documents = len(documents)
+        batch.save(update_fields=['total_documents'])
+        start_bulk_ingest(batch)
+
+        response_data = IngestBatchSerializer(batch).data
+        response_data['documents'] = DocumentSerializer(documents, many=True).data
+        response_data['errors'] = errors
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+    
+class KnowledgeAssistantViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def query_history(self, request):
@@ -132,3 +183,214 @@ class KnowledgeAssistantViewSet(viewsets.ViewSet):
         queries = QueryLog.objects.filter(user=request.user)[:20]
         serializer = QueryLogSerializer(queries, many=True)
         return Response(serializer.data)
+
+
+async def _authenticate(request):
+    """Authenticate a plain async Django view with the JWT backend DRF uses.
+
+    Returns (user, None) on success or (None, error response).
+    """
+    try:
+        auth_result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except APIException as e:
+        return None, JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+    if auth_result is None:
+        return None, JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+    return auth_result[0], None
+
+
+async def _read_question(request):
+    """Validated question from a JSON body, or (None, error response)"""
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return None, JsonResponse({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = QuestionSerializer(data=payload)
+    if not serializer.is_valid():
+        return None, JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    return serializer.validated_data['question'], None
+
+
+_query_history_view = KnowledgeAssistantViewSet.as_view({'get': 'query_history'})
+
+
+@csrf_exempt
+async def knowledge_assistant(request):
+    """POST answers a question on the async path; GET returns query history"""
+    if request.method == 'POST':
+        return await ask_question(request)
+    return await sync_to_async(_query_history_view)(request)
+
+
+async def ask_question(request):
+    """Main endpoint for asking questions.
+
+    Runs without holding a thread while waiting on the embedding and LLM
+    providers, so one ASGI worker serves many questions concurrently.
+    """
+    user, error = await _authenticate(request)
+    if error:
+        return error
+    question, error = await _read_question(request)
+    if error:
+        return error
+
+    try:
+        response_data = await QuestionAnsweringService().aanswer(user, question)
+        return JsonResponse(response_data, status=status.HTTP_200_OK)
+    except Exception as e:
+        return JsonResponse(
+            {"error": f"Internal server error: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def _sse(event: str, data) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _no_results_events():
+    yield {"event": "sources", "data": []}
+    yield {"event": "token", "data": NO_RESULTS_ANSWER}
+
+
+async def _cached_answer_events(cached):
+    yield {"event": "sources", "data": cached["sources"]}
+    yield {"event": "token", "data": cached["answer"]}
+
+
+@csrf_exempt
+@require_POST
+async def ask_question_stream(request):
+    """Streaming variant of ask_question, served over ASGI as server-sent
+    events: 'sources' first, then 'token' events as the answer is generated,
+    then 'done' with timings once the QueryLog has been written.
+    """
+    user, error = await _authenticate(request)
+    if error:
+        return error
+    question, error = await _read_question(request)
+    if error:
+        return error
+
+    start_time = time.time()
+
+    try:
+        with trace() as timings:
+            qa_service = QuestionAnsweringService()
+            question_embedding = await qa_service.retrieval_service.aembed_query(question)
+            cached = None
+            if qa_service.answer_cache:
+                cached = await qa_service.answer_cache.alookup(user.id, question_embedding)
+            relevant_chunks = []
+            if cached is None:
+                relevant_chunks = await qa_service.retrieval_service.aretrieve_for_embedding(question_embedding, user_id=user.id, question=question)
+    except Exception as e:
+        return JsonResponse({"error": f"Internal server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def event_stream():
+        answer_parts, sources = [], []
+        time_to_first_token = None
+        context_stats = {}
+        failed = False
+
+        if cached is not None:
+            events = _cached_answer_events(cached)
+        elif relevant_chunks:
+            events = qa_service.llm_service.astream_answer(question, relevant_chunks)
+        else:
+            events = _no_results_events()
+
+        with trace(timings):
+            async for event in events:
+                if event["event"] == "context":
+                    # Logged with the query, not sent to the client
+                    context_stats = event["data"]
+                    continue
+                if event["event"] == "sources":
+                    sources = event["data"]
+                elif event["event"] == "token":
+                    if time_to_first_token is None:
+                        time_to_first_token = time.time() - start_time
+                    answer_parts.append(event["data"])
+                elif event["event"] == "error":
+                    answer_parts = [event["data"]]
+                    failed = True
+                yield _sse(event["event"], event["data"])
+
+        answer = "".join(answer_parts).strip()
+        if relevant_chunks and not failed and qa_service.answer_cache:
+            await qa_service.answer_cache.astore(
+                user.id, question_embedding, {"answer": answer, "sources": sources},
+                qa_service.chunk_ids(relevant_chunks),
+            )
+
+        response_time = time.time() - start_time
+        with trace(timings):
+            record('total', response_time)
+        await QueryLog.objects.acreate(
+            user=user,
+            question=question,
+            answer=answer,
+            sources=sources,
+            response_time=response_time,
+            time_to_first_token=time_to_first_token,
+            stage_timings=timings,
+            **context_stats,
+        )
+        yield _sse("done", {"response_time": response_time, "time_to_first_token": time_to_first_token, **context_stats})
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+METRICS_HELP = {
+    'vectormind_stage_seconds': "Seconds spent in each stage of answering questions and ingesting documents",
+    'vectormind_cache_hits_total': "Cache lookups answered from the cache",
+    'vectormind_cache_misses_total': "Cache lookups that missed",
+    'vectormind_ingest_chunks_total': "Chunks embedded for the vector store",
+    'vectormind_ingest_chunks_reused_total': "Chunks of a new document version kept with their vector, unchanged",
+    'vectormind_ingest_documents_total': "Documents ingested, by result",
+    'vectormind_index_vectors': "Vectors in the serving index, including unmerged and deleted ones",
+    'vectormind_index_unmerged_vectors': "Vectors appended since the last merge",
+    'vectormind_index_deleted_vectors': "Tombstoned vectors awaiting compaction",
+    'vectormind_index_load_seconds': "Seconds this worker took to load the current index",
+}
+
+
+def _metrics_text() -> str:
+    histograms, counters = get_metrics().collect()
+    # The embedding and answer caches count in the shared cache, across every worker
+    shared = {
+        'embedding': CachedEmbeddings(provider=None, model_name=settings.EMBEDDING_MODEL).stats(),
+        'answer': SemanticAnswerCache().stats() if settings.SEMANTIC_CACHE_ENABLED else None,
+    }
+    for cache, stats in shared.items():
+        if stats is not None:
+            counters[series_key('vectormind_cache_hits_total', {'cache': cache})] = stats['hits']
+            counters[series_key('vectormind_cache_misses_total', {'cache': cache})] = stats['misses']
+
+    index = get_index_store().stats()
+    gauges = {
+        series_key('vectormind_index_vectors', {}): index['vectors'],
+        series_key('vectormind_index_unmerged_vectors', {}): index['unmerged_vectors'],
+        series_key('vectormind_index_deleted_vectors', {}): index['deleted_vectors'],
+    }
+    if index['load_seconds'] is not None:
+        gauges[series_key('vectormind_index_load_seconds', {})] = index['load_seconds']
+    return render(histograms, counters, gauges, METRICS_HELP)
+
+
+@require_GET
+def metrics(request):
+    """Prometheus metrics: stage latency histograms, cache hits and misses,
+    ingest counters and index size
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(_metrics_text(), content_type='text/plain; version=0.0.4; charset=utf-8')